@@ -10,6 +10,7 @@ import json
 from datetime import datetime
 from database import get_db_session
 from models import UserBehavior
+from write_buffer import get_write_buffer
 
 
 class ABTestingService:
@@ -159,20 +160,25 @@ class ABTestingService:
     def log_test_assignment(session_id, test_name, variant):
         """Log A/B test assignment"""
         try:
-            db_session = get_db_session()
-
-            assignment_log = UserBehavior(
-                session_id=session_id,
-                action='ab_test_assignment',
-                behavior_metadata=json.dumps({
+            assignment_row = {
+                'session_id': session_id,
+                'action': 'ab_test_assignment',
+                'score_change': 0.0,
+                'behavior_metadata': json.dumps({
                     'test_name': test_name,
                     'variant': variant,
                     'assigned_at': datetime.now().isoformat()
                 }),
-                created_at=datetime.now()
-            )
+                'created_at': datetime.now()
+            }
 
-            db_session.add(assignment_log)
+            write_buffer = get_write_buffer()
+            if write_buffer:
+                write_buffer.enqueue(UserBehavior, assignment_row)
+                return
+
+            db_session = get_db_session()
+            db_session.add(UserBehavior(**assignment_row))
             db_session.commit()
             db_session.close()
 
@@ -0,0 +1,151 @@
+"""
+Analytics result cache
+Dashboards poll the same /api/analytics/* endpoints every few seconds, so
+results are cached per endpoint and filter parameters and recomputed only
+when the data behind them moves.
+
+Each source table has a high-water mark: its max id, plus the max of the
+column that changes when a row is updated (leads.updated_at,
+page_tracking.updated_at, ...), plus the table's rollup watermark when
+rollups are enabled. An entry remembers the marks of its sources and is
+served while they are unchanged. The marks are read in one query at most
+every ANALYTICS_CACHE_MAX_STALE_SECONDS, which bounds how stale a result
+can be; `window` results also expire after that long since their range
+moves with the clock. Concurrent misses on one key compute it once.
+
+Deletes do not move a high-water mark, so the tables the retention job
+purges also carry its watermark, which it stamps after deleting rows. Every
+process sees it on its next read of the marks.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from sqlalchemy import select, func
+from database import get_db_session
+from models import (Lead, Answer, UserBehavior, PageTracking, SessionExit,
+                    CustomerInformationForm, RollupWatermark)
+from caching import LRUCache
+from retention import RETAINED_TABLES, RETENTION_WATERMARK
+from config import Config
+
+# Source name (as in analytics_rollups.ROLLUPS) -> high-water mark columns
+SOURCES = {
+    'leads': (Lead.id, Lead.updated_at),
+    'answers': (Answer.id,),
+    'behaviors': (UserBehavior.id,),
+    'pages': (PageTracking.id, PageTracking.updated_at),
+    'exits': (SessionExit.id,),
+    'cifs': (CustomerInformationForm.id, CustomerInformationForm.updated_at),
+}
+
+
+def read_watermarks():
+    """{source: marks} for every source, from one indexed max() per column"""
+    columns = [(source, column) for source, source_columns in SOURCES.items()
+               for column in source_columns]
+    db_session = get_db_session()
+    try:
+        row = db_session.execute(select(*(
+            select(func.max(column)).scalar_subquery() for _, column in columns
+        ))).one()
+        watermarks = dict(db_session.execute(
+            select(RollupWatermark.name, RollupWatermark.last_time)).all())
+    finally:
+        db_session.close()
+    retained = {model.__table__ for model, _ in RETAINED_TABLES}
+    marks = {source: () for source in SOURCES}
+    for (source, _), value in zip(columns, row):
+        marks[source] += (value,)
+    return {source: values + (
+        watermarks.get(source) if Config.ANALYTICS_ROLLUPS_ENABLED else None,
+        watermarks.get(RETENTION_WATERMARK) if SOURCES[source][0].table in retained else None
+    ) for source, values in marks.items()}
+
+
+class AnalyticsCache:
+    """Results keyed by (name, filter parameters), valid while their sources' marks hold"""
+
+    def __init__(self, max_entries, max_stale_seconds, watermark_reader=read_watermarks):
+        self.max_stale_seconds = max_stale_seconds
+        self._results = LRUCache(max_entries)  # key -> (marks, value)
+        self._read_watermarks = watermark_reader
+        self._watermarks = None
+        self._watermarks_read_at = 0.0
+        self._watermark_lock = threading.Lock()
+        self._key_locks = {}  # key -> [lock, users]
+        self._lock = threading.Lock()
+        self.computations = 0
+        self.invalidations = 0
+        self.watermark_reads = 0
+
+    def get(self, name, filters, sources, compute):
+        """
+        Cached compute() for name and filters. sources are the SOURCES the
+        result is derived from; name may be a tuple to key on more than
+        the filters (e.g. the workflow version).
+        """
+        if not self.max_stale_seconds:
+            return compute()
+        key = (name, filters.cache_key)
+        marks = self._marks(sources)
+        entry = self._results.get(key)
+        if entry is not None and entry[0] == marks:
+            return entry[1]
+        with self._computing(key):
+            # Another caller may have computed it while we waited
+            entry = self._results.get(key)
+            if entry is not None and entry[0] == marks:
+                return entry[1]
+            if entry is not None:
+                self.invalidations += 1
+            value = compute()
+            self.computations += 1
+            self._results.set(key, (marks, value),
+                              ttl_seconds=self.max_stale_seconds if filters.window else None)
+            return value
+
+    def clear(self):
+        self._results.clear()
+        with self._watermark_lock:
+            self._watermarks = None
+
+    def stats(self):
+        return {
+            **self._results.stats(),
+            'max_stale_seconds': self.max_stale_seconds,
+            'computations': self.computations,
+            'invalidations': self.invalidations,
+            'watermark_reads': self.watermark_reads
+        }
+
+    def _marks(self, sources):
+        with self._watermark_lock:
+            now = time.monotonic()
+            if self._watermarks is None or now - self._watermarks_read_at >= self.max_stale_seconds:
+                self._watermarks = self._read_watermarks()
+                self._watermarks_read_at = now
+                self.watermark_reads += 1
+            watermarks = self._watermarks
+        return tuple(watermarks.get(source) for source in sources)
+
+    @contextmanager
+    def _computing(self, key):
+        """Hold the key's lock; the lock is dropped once nobody uses it"""
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, [threading.Lock(), 0])
+            key_lock[1] += 1
+        try:
+            with key_lock[0]:
+                yield
+        finally:
+            with self._lock:
+                key_lock[1] -= 1
+                if not key_lock[1]:
+                    del self._key_locks[key]
+
+
+analytics_cache = AnalyticsCache(
+    Config.ANALYTICS_CACHE_MAX_ENTRIES,
+    Config.ANALYTICS_CACHE_MAX_STALE_SECONDS
+)
@@ -0,0 +1,130 @@
+"""
+Time range and UTM filters for the analytics endpoints
+Every /api/analytics/* endpoint accepts `from`, `to`, `window` (24h, 7d, 30d)
+and `utm_source`. Raw queries bound the indexed time column of the table
+they scan (leads.created_at, page_tracking.entry_time, session_exits.exit_time,
+...), so a window only reads that slice of the table. Rollup queries bound
+the hour bucket instead, so their ranges have hourly granularity: `from` is
+rounded down and `to` up to the hour.
+"""
+
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from models import Lead
+
+WINDOWS = {
+    '24h': timedelta(hours=24),
+    '7d': timedelta(days=7),
+    '30d': timedelta(days=30)
+}
+
+
+def _naive_local(value):
+    # Timestamps are stored as naive local time (func.now())
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone().replace(tzinfo=None)
+    return value
+
+
+def _floor_hour(value):
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def _ceil_hour(value):
+    floored = _floor_hour(value)
+    return floored if floored == value else floored + timedelta(hours=1)
+
+
+def _floor_day(value):
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _ceil_day(value):
+    floored = _floor_day(value)
+    return floored if floored == value else floored + timedelta(days=1)
+
+
+class AnalyticsFilter:
+    """A half-open [start, end) time range plus an optional utm_source"""
+
+    def __init__(self, start=None, end=None, utm_source=None, window=None):
+        self.start = _naive_local(start)
+        self.end = _naive_local(end)
+        self.utm_source = utm_source
+        self.window = window  # the relative window start/end came from, if any
+        if self.start and self.end and self.start >= self.end:
+            raise ValueError("'from' must be earlier than 'to'")
+
+    @classmethod
+    def from_params(cls, start=None, end=None, window=None, utm_source=None, now=None):
+        """Build a filter from request parameters; window means [now - window, now)"""
+        if window is not None:
+            if window not in WINDOWS:
+                raise ValueError(f"window must be one of {', '.join(WINDOWS)}")
+            if start is not None or end is not None:
+                raise ValueError("window cannot be combined with 'from' or 'to'")
+            end = now or datetime.now()
+            start = end - WINDOWS[window]
+        return cls(start, end, utm_source, window)
+
+    @property
+    def cache_key(self):
+        """Hashable identity; a window is keyed by name, not by its moving bounds"""
+        if self.window is not None:
+            return (self.window, self.utm_source)
+        return (self.start, self.end, self.utm_source)
+
+    def apply(self, stmt, time_column, session_column=None):
+        """
+        Restrict a raw query to the range on time_column. utm_source is
+        matched on the lead, either directly (session_column=None on leads
+        queries) or through the row's session_column.
+        """
+        if self.start is not None:
+            stmt = stmt.where(time_column >= self.start)
+        if self.end is not None:
+            stmt = stmt.where(time_column < self.end)
+        if self.utm_source is not None:
+            if session_column is None:
+                stmt = stmt.where(Lead.utm_source == self.utm_source)
+            else:
+                # Never correlate: callers may already select from leads
+                stmt = stmt.where(session_column.in_(
+                    select(Lead.session_id).where(Lead.utm_source == self.utm_source)
+                    .correlate(None)))
+        return stmt
+
+    def apply_buckets(self, stmt, rollup_model):
+        """Restrict a rollup query to the hour buckets overlapping the range"""
+        if self.start is not None:
+            stmt = stmt.where(rollup_model.bucket >= _floor_hour(self.start))
+        if self.end is not None:
+            stmt = stmt.where(rollup_model.bucket < _ceil_hour(self.end))
+        if self.utm_source is not None:
+            stmt = stmt.where(rollup_model.utm_source == self.utm_source)
+        return stmt
+
+
+    def bucket_ranges(self):
+        """
+        Split the hour-rounded range into whole days and the hours of the
+        partial days at either end. Returns (hour_ranges, day_range): ranges
+        are half-open (start, end) pairs with None for an open end, and
+        day_range is None when no whole day is covered. A range open at the
+        end counts the current day as whole.
+        """
+        start = _floor_hour(self.start) if self.start is not None else None
+        end = _ceil_hour(self.end) if self.end is not None else None
+        first_day = _ceil_day(start) if start is not None else None
+        last_day = _floor_day(end) if end is not None else None
+        if first_day is not None and last_day is not None and first_day >= last_day:
+            return [(start, end)], None
+        hour_ranges = []
+        if start is not None and start < first_day:
+            hour_ranges.append((start, first_day))
+        if end is not None and last_day < end:
+            hour_ranges.append((last_day, end))
+        return hour_ranges, (first_day, last_day)
+
+
+NO_FILTER = AnalyticsFilter()
@@ -0,0 +1,632 @@
+"""
+Hourly analytics rollups
+Dashboards read small per-hour tables instead of scanning raw events:
+
+    analytics_lead_rollups      hour x utm_source x lead_type
+    analytics_behavior_rollups  hour x utm_source x action
+    analytics_page_rollups      hour x utm_source x page (+ session HyperLogLog,
+                                time-on-page TDigest)
+    analytics_answer_rollups    hour x utm_source x question (+ time_taken TDigest)
+    analytics_exit_rollups      hour x utm_source x exit reason / question / page
+
+The page and answer sketches are also unioned per day into
+analytics_page_daily_sketches and analytics_answer_daily_sketches, so a
+range reads one sketch per whole day plus the hours of its partial days.
+
+A compactor keeps them current. For each source table it finds the hours
+touched since its watermark (new ids, and for leads and pages rows updated
+since the last run), always adds the most recent ANALYTICS_ROLLUP_RECENT_HOURS
+to pick up late commits, and recomputes exactly those buckets. Recomputing a
+bucket is idempotent, so overlapping or repeated runs are harmless. The
+first run backfills all history. With ANALYTICS_RETENTION_ENABLED, hours
+before the retention cutoff that already have rollup rows are never
+recomputed: their raw rows may be purged, and a late row landing in such an
+hour would otherwise replace the saved totals with its own.
+
+Run once from the command line with:
+
+    python analytics_rollups.py
+"""
+
+import logging
+import threading
+import time
+from datetime import timedelta
+from sqlalchemy import (select, insert, update, delete, distinct, func, or_, literal_column,
+                        cast, bindparam, Text)
+from sqlalchemy.dialects.postgresql import BIT
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from database import get_db_session
+from models import (Lead, Answer, UserBehavior, PageTracking, SessionExit, LeadRollup,
+                    BehaviorRollup, PageRollup, ExitRollup, AnswerRollup, RollupWatermark,
+                    PageDailySketch, AnswerDailySketch)
+from workflow_index import get_workflow
+from sketches import HyperLogLog, TDigest, HLL_PRECISION
+from analytics_filters import NO_FILTER
+from retention import RETAINED_TABLES, cutoff_from
+from config import Config
+
+# Buckets rebuilt per DELETE/INSERT pair
+REBUILD_CHUNK_HOURS = 168
+# Daily sketch rows rebuilt per DELETE/INSERT pair
+REBUILD_CHUNK_DAYS = 7
+
+
+def hour_of(column):
+    # Literal unit so SELECT and GROUP BY render the identical expression
+    return func.date_trunc(literal_column("'hour'"), column)
+
+
+def day_of(column):
+    return func.date_trunc(literal_column("'day'"), column)
+
+
+def _in_hours(column, hours):
+    """Rows whose hour bucket is one of hours (range bounds keep it indexable)"""
+    return (column >= hours[0]) & (column < hours[-1] + timedelta(hours=1)) & \
+        hour_of(column).in_(hours)
+
+
+class Rollup:
+    """How one rollup table is derived from its source table"""
+
+    def __init__(self, name, model, id_column, time_column, aggregate, changed_column=None,
+                 after_rebuild=None, daily_sketches=None, sketch_key=None):
+        self.name = name
+        self.model = model
+        self.id_column = id_column
+        self.time_column = time_column
+        self.changed_column = changed_column
+        self._aggregate = aggregate
+        # Called with (db_session, in_hours) after a chunk's rows are rebuilt
+        self._after_rebuild = after_rebuild
+        # Model holding the per-day union of the sketch columns, per
+        # utm_source and sketch_key column
+        self.daily_sketches = daily_sketches
+        self.sketch_key = sketch_key
+
+    def aggregate(self, hours):
+        return self._aggregate(_in_hours(self.time_column, hours))
+
+    def after_rebuild(self, db_session, hours):
+        if self._after_rebuild:
+            self._after_rebuild(db_session, _in_hours(self.time_column, hours))
+
+    @property
+    def retained(self):
+        """Whether the retention job purges this rollup's source rows"""
+        return any(self.time_column is time_column for _, time_column in RETAINED_TABLES)
+
+    @property
+    def columns(self):
+        # Columns filled by after_rebuild are not part of the aggregate
+        return [column.name for column in self.model.__table__.columns
+                if column.name != 'id' and not column.info.get('after_rebuild')]
+
+    @property
+    def sketch_columns(self):
+        return [column.name for column in self.model.__table__.columns
+                if column.info.get('after_rebuild')]
+
+
+def _lead_rollup(in_hours):
+    required_mask = get_workflow().required_mask
+    return select(
+        hour_of(Lead.created_at), Lead.utm_source, Lead.lead_type,
+        func.count(Lead.id),
+        func.coalesce(func.sum(func.coalesce(Lead.lead_score, 0)), 0),
+        func.count(Lead.id).filter(
+            Lead.answered_mask.op('&')(required_mask) == required_mask)
+    ).where(in_hours).group_by(
+        hour_of(Lead.created_at), Lead.utm_source, Lead.lead_type)
+
+
+def _behavior_rollup(in_hours):
+    return select(
+        hour_of(UserBehavior.created_at), Lead.utm_source, UserBehavior.action,
+        func.count(UserBehavior.id),
+        func.coalesce(func.sum(func.coalesce(UserBehavior.score_change, 0)), 0)
+    ).select_from(UserBehavior).outerjoin(
+        Lead, Lead.session_id == UserBehavior.session_id
+    ).where(in_hours).group_by(
+        hour_of(UserBehavior.created_at), Lead.utm_source, UserBehavior.action)
+
+
+def _page_rollup(in_hours):
+    return select(
+        hour_of(PageTracking.entry_time), Lead.utm_source, PageTracking.page_identifier,
+        func.count(PageTracking.id),
+        func.coalesce(func.sum(PageTracking.time_spent), 0),
+        func.count(PageTracking.time_spent)
+    ).select_from(PageTracking).outerjoin(
+        Lead, Lead.session_id == PageTracking.session_id
+    ).where(in_hours).group_by(
+        hour_of(PageTracking.entry_time), Lead.utm_source, PageTracking.page_identifier)
+
+
+def _page_session_sketches(db_session, in_hours):
+    """
+    HyperLogLog of distinct sessions per page rollup row. Postgres hashes
+    the session ids and reduces them to the highest rank per register, so
+    only (register, rank) pairs come back.
+    """
+    hashed = select(
+        hour_of(PageTracking.entry_time).label('bucket'),
+        Lead.utm_source.label('utm_source'),
+        PageTracking.page_identifier.label('page_identifier'),
+        func.hashtextextended(PageTracking.session_id, 0).label('hash')
+    ).select_from(PageTracking).outerjoin(
+        Lead, Lead.session_id == PageTracking.session_id
+    ).where(in_hours).subquery()
+    # Rank: first set bit of the hash's high 64 - HLL_PRECISION bits
+    high_bits = func.substr(cast(cast(hashed.c.hash, BIT(64)), Text), 1, 64 - HLL_PRECISION)
+    rank = func.coalesce(func.nullif(func.strpos(high_bits, '1'), 0), 64 - HLL_PRECISION + 1)
+    register = hashed.c.hash.op('&')((1 << HLL_PRECISION) - 1)
+    group = (hashed.c.bucket, hashed.c.utm_source, hashed.c.page_identifier)
+    registers = select(*group, register.label('register'), func.max(rank).label('rank')) \
+        .group_by(*group, register).subquery()
+    rows = db_session.execute(select(
+        registers.c.bucket, registers.c.utm_source, registers.c.page_identifier,
+        func.array_agg(registers.c.register), func.array_agg(registers.c.rank)
+    ).group_by(registers.c.bucket, registers.c.utm_source, registers.c.page_identifier)).all()
+    return {(bucket, utm_source, page): HyperLogLog.from_ranks(indexes, ranks).to_bytes()
+            for bucket, utm_source, page, indexes, ranks in rows}
+
+
+def _digests(db_session, group, value_column, session_column, in_hours):
+    """TDigest of value_column per group, keyed by the group's values"""
+    rows = db_session.execute(select(
+        *group, func.array_agg(value_column)
+    ).select_from(session_column.table).outerjoin(
+        Lead, Lead.session_id == session_column
+    ).where(in_hours, value_column.is_not(None)).group_by(*group)).all()
+    return {tuple(row[:-1]): TDigest.from_values(row[-1]).to_bytes() for row in rows}
+
+
+def _store_sketches(db_session, model, key_columns, sketches):
+    """
+    Write {key tuple: {column: bytes}} onto the rollup rows with those key
+    values. Core table: an executemany UPDATE with its own WHERE clause.
+    """
+    if not sketches:
+        return
+    table = model.__table__
+    sketch_columns = [column.name for column in table.columns if column.info.get('after_rebuild')]
+    db_session.execute(
+        update(table).where(*[
+            table.c[name].is_not_distinct_from(bindparam(f"key_{name}"))
+            if table.c[name].nullable else table.c[name] == bindparam(f"key_{name}")
+            for name in key_columns
+        ]).values({name: bindparam(f"new_{name}") for name in sketch_columns}),
+        [{
+            **{f"key_{name}": value for name, value in zip(key_columns, key)},
+            **{f"new_{name}": values.get(name) for name in sketch_columns}
+        } for key, values in sketches.items()])
+
+
+def _page_sketches(db_session, in_hours):
+    sessions = _page_session_sketches(db_session, in_hours)
+    time_spent = _digests(
+        db_session,
+        (hour_of(PageTracking.entry_time), Lead.utm_source, PageTracking.page_identifier),
+        PageTracking.time_spent, PageTracking.session_id, in_hours)
+    _store_sketches(db_session, PageRollup, ('bucket', 'utm_source', 'page_identifier'), {
+        key: {'sessions_hll': sketch, 'time_spent_digest': time_spent.get(key)}
+        for key, sketch in sessions.items()
+    })
+
+
+def _answer_rollup(in_hours):
+    return select(
+        hour_of(Answer.created_at), Lead.utm_source, Answer.question_id,
+        func.count(Answer.id),
+        func.coalesce(func.sum(Answer.time_taken), 0),
+        func.count(Answer.time_taken)
+    ).select_from(Answer).outerjoin(
+        Lead, Lead.session_id == Answer.session_id
+    ).where(in_hours).group_by(
+        hour_of(Answer.created_at), Lead.utm_source, Answer.question_id)
+
+
+def _answer_sketches(db_session, in_hours):
+    time_taken = _digests(
+        db_session, (hour_of(Answer.created_at), Lead.utm_source, Answer.question_id),
+        Answer.time_taken, Answer.session_id, in_hours)
+    _store_sketches(db_session, AnswerRollup, ('bucket', 'utm_source', 'question_id'), {
+        key: {'time_taken_digest': digest} for key, digest in time_taken.items()
+    })
+
+
+def _exit_rollup(in_hours):
+    return select(
+        hour_of(SessionExit.exit_time), Lead.utm_source, SessionExit.exit_reason,
+        SessionExit.exit_question_id, SessionExit.exit_page,
+        func.count(SessionExit.id),
+        func.coalesce(func.sum(SessionExit.session_completion_percentage), 0),
+        func.count(SessionExit.session_completion_percentage)
+    ).select_from(SessionExit).outerjoin(
+        Lead, Lead.session_id == SessionExit.session_id
+    ).where(in_hours).group_by(
+        hour_of(SessionExit.exit_time), Lead.utm_source, SessionExit.exit_reason,
+        SessionExit.exit_question_id, SessionExit.exit_page)
+
+
+ROLLUPS = (
+    # Leads change after creation (score, lead_type, answers): re-read updates
+    Rollup('leads', LeadRollup, Lead.id, Lead.created_at, _lead_rollup,
+           changed_column=Lead.updated_at),
+    Rollup('behaviors', BehaviorRollup, UserBehavior.id,
+           UserBehavior.created_at, _behavior_rollup),
+    # Page exits fill in time_spent after the entry row is written. The
+    # server-side updated_at, not the client's exit_time, marks them changed
+    Rollup('pages', PageRollup, PageTracking.id, PageTracking.entry_time, _page_rollup,
+           changed_column=PageTracking.updated_at, after_rebuild=_page_sketches,
+           daily_sketches=PageDailySketch, sketch_key='page_identifier'),
+    Rollup('exits', ExitRollup, SessionExit.id,
+           SessionExit.exit_time, _exit_rollup),
+    Rollup('answers', AnswerRollup, Answer.id, Answer.created_at, _answer_rollup,
+           after_rebuild=_answer_sketches,
+           daily_sketches=AnswerDailySketch, sketch_key='question_id'),
+)
+
+
+def compact_rollup(rollup, recent_hours=None, late_seconds=None):
+    """
+    Recompute the dirty buckets of one rollup and advance its watermark in
+    the same transaction. Returns the number of buckets recomputed.
+    """
+    recent_hours = Config.ANALYTICS_ROLLUP_RECENT_HOURS if recent_hours is None else recent_hours
+    late_seconds = Config.ANALYTICS_ROLLUP_LATE_SECONDS if late_seconds is None else late_seconds
+
+    db_session = get_db_session()
+    try:
+        watermark = _locked_watermark(db_session, rollup.name)
+        now = db_session.execute(select(func.localtimestamp())).scalar()
+        max_id = db_session.execute(
+            select(func.max(rollup.id_column))).scalar() or 0
+
+        changed = rollup.id_column > watermark.last_id
+        if rollup.changed_column is not None and watermark.last_time is not None:
+            changed = or_(changed, rollup.changed_column >=
+                          watermark.last_time - timedelta(seconds=late_seconds))
+        hours = set(db_session.execute(
+            select(distinct(hour_of(rollup.time_column))).where(changed)).scalars())
+        hours.discard(None)
+        current_hour = now.replace(minute=0, second=0, microsecond=0)
+        hours.update(current_hour - timedelta(hours=offset)
+                     for offset in range(recent_hours + 1))
+        hours = sorted(hours)
+        if Config.ANALYTICS_RETENTION_ENABLED and rollup.retained:
+            hours = _without_saved_expired_hours(
+                db_session, rollup, hours,
+                cutoff_from(now, Config.ANALYTICS_RETENTION_DAYS))
+
+        for start in range(0, len(hours), REBUILD_CHUNK_HOURS):
+            chunk = hours[start:start + REBUILD_CHUNK_HOURS]
+            db_session.execute(
+                delete(rollup.model).where(rollup.model.bucket.in_(chunk)))
+            db_session.execute(
+                insert(rollup.model).from_select(rollup.columns, rollup.aggregate(chunk)))
+            rollup.after_rebuild(db_session, chunk)
+        if rollup.daily_sketches is not None:
+            _rebuild_daily_sketches(db_session, rollup, hours)
+
+        watermark.last_id = max_id
+        watermark.last_time = now
+        db_session.commit()
+        return len(hours)
+    except Exception:
+        db_session.rollback()
+        raise
+    finally:
+        db_session.close()
+
+
+def _rebuild_daily_sketches(db_session, rollup, hours):
+    """
+    Recompute the daily sketch rows of the days containing hours from the
+    hourly rollup rows. When there are none yet, every day is backfilled.
+    """
+    hourly, daily = rollup.model, rollup.daily_sketches
+    if db_session.execute(select(daily.id).limit(1)).first() is None:
+        days = set(db_session.execute(select(distinct(day_of(hourly.bucket)))).scalars())
+    else:
+        days = {hour.replace(hour=0) for hour in hours}
+    days = sorted(days)
+    key = hourly.__table__.c[rollup.sketch_key]
+    sketch_columns = rollup.sketch_columns
+
+    for start in range(0, len(days), REBUILD_CHUNK_DAYS):
+        chunk = days[start:start + REBUILD_CHUNK_DAYS]
+        db_session.execute(delete(daily).where(daily.day.in_(chunk)))
+        rows = db_session.execute(select(
+            day_of(hourly.bucket), hourly.utm_source, key,
+            *(hourly.__table__.c[name] for name in sketch_columns)
+        ).where(
+            hourly.bucket >= chunk[0], hourly.bucket < chunk[-1] + timedelta(days=1),
+            day_of(hourly.bucket).in_(chunk)
+        )).all()
+        unions = _union_sketches(rows, 3, sketch_columns)
+        if unions:
+            db_session.execute(insert(daily), [{
+                'day': day, 'utm_source': utm_source, rollup.sketch_key: key_value,
+                **{name: sketch.to_bytes() if sketch is not None else None
+                   for name, sketch in sketches.items()}
+            } for (day, utm_source, key_value), sketches in unions.items()])
+
+
+# Sketch class of each sketch column
+SKETCH_TYPES = {
+    'sessions_hll': HyperLogLog,
+    'time_spent_digest': TDigest,
+    'time_taken_digest': TDigest,
+}
+
+
+def _union_sketches(rows, key_length, sketch_columns):
+    """
+    {key: {column: union sketch or None}} from rows of key_length key
+    values followed by one serialized sketch per column
+    """
+    grouped = {}
+    for row in rows:
+        columns = grouped.setdefault(tuple(row[:key_length]), {name: [] for name in sketch_columns})
+        for name, data in zip(sketch_columns, row[key_length:]):
+            if data is not None:
+                columns[name].append(SKETCH_TYPES[name].from_bytes(data))
+    return {key: {name: SKETCH_TYPES[name].union(sketches) if sketches else None
+                  for name, sketches in columns.items()}
+            for key, columns in grouped.items()}
+
+
+def _without_saved_expired_hours(db_session, rollup, hours, cutoff):
+    """hours minus those before cutoff that already have rollup rows"""
+    expired = [hour for hour in hours if hour < cutoff]
+    if not expired:
+        return hours
+    saved = set(db_session.execute(
+        select(distinct(rollup.model.bucket)).where(
+            rollup.model.bucket >= expired[0], rollup.model.bucket < cutoff)
+    ).scalars())
+    return [hour for hour in hours if hour >= cutoff or hour not in saved]
+
+
+def _locked_watermark(db_session, name):
+    # Serializes compactors running in several worker processes
+    db_session.execute(
+        pg_insert(RollupWatermark).values(name=name, last_id=0)
+        .on_conflict_do_nothing())
+    return db_session.query(RollupWatermark).filter_by(
+        name=name).with_for_update().one()
+
+
+class RollupCompactor:
+    """Background thread that compacts every rollup periodically"""
+
+    def __init__(self, interval_seconds):
+        self.interval = interval_seconds
+        self._stopping = threading.Event()
+        self._thread = None
+        self.runs = 0
+        self.last_run_ms = 0.0
+        self.last_error = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self._run, name='analytics-rollup-compactor', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def compact_all(self):
+        """Compact every rollup; returns {rollup name: buckets recomputed}"""
+        started = time.perf_counter()
+        buckets = {}
+        for rollup in ROLLUPS:
+            try:
+                buckets[rollup.name] = compact_rollup(rollup)
+            except Exception as e:
+                self.last_error = f"{rollup.name}: {e}"
+                logging.error(f"Analytics rollup {rollup.name} failed: {e}")
+        self.runs += 1
+        self.last_run_ms = (time.perf_counter() - started) * 1000.0
+        return buckets
+
+    def stats(self):
+        return {
+            'runs': self.runs,
+            'last_run_ms': self.last_run_ms,
+            'last_error': self.last_error,
+            'interval_seconds': self.interval
+        }
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self.compact_all()
+            self._stopping.wait(self.interval)
+
+
+_compactor = None
+_init_lock = threading.Lock()
+
+
+def get_compactor():
+    """Return the process's compactor when ANALYTICS_ROLLUPS_ENABLED, else None"""
+    global _compactor
+    if not Config.ANALYTICS_ROLLUPS_ENABLED:
+        return None
+    with _init_lock:
+        if _compactor is None:
+            _compactor = RollupCompactor(
+                Config.ANALYTICS_ROLLUP_INTERVAL_SECONDS)
+        return _compactor
+
+
+# Readers used by the analytics endpoints when rollups are enabled
+
+TIME_PERCENTILES = (0.5, 0.9, 0.99)
+
+# Reason reported for sketch-based metrics when rollups are off: the
+# sketches are built by the compactor, not on the write path
+ROLLUPS_REQUIRED = "requires ANALYTICS_ROLLUPS_ENABLED"
+
+
+def format_percentiles(values):
+    """{'p50': ..., 'p90': ..., 'p99': ...} from values in TIME_PERCENTILES order"""
+    return {
+        f"p{round(quantile * 100)}": round(float(value), 2) if value is not None else None
+        for quantile, value in zip(TIME_PERCENTILES, values or [None] * len(TIME_PERCENTILES))
+    }
+
+
+def digest_percentiles(digest):
+    return format_percentiles(digest and [digest.quantile(q) for q in TIME_PERCENTILES])
+
+
+def _range_sketches(db_session, filters, rollup):
+    """
+    {sketch_key value: {column: union sketch or None}} over the filter's
+    range: daily sketches for whole days, hourly ones for partial days
+    """
+    hourly, daily = rollup.model, rollup.daily_sketches
+    sketch_columns = rollup.sketch_columns
+    hour_ranges, day_range = filters.bucket_ranges()
+    ranged = [(hourly, hourly.bucket, start, end) for start, end in hour_ranges]
+    if day_range is not None:
+        ranged.append((daily, daily.day) + day_range)
+
+    rows = []
+    for model, time_column, start, end in ranged:
+        table = model.__table__
+        stmt = select(table.c[rollup.sketch_key], *(table.c[name] for name in sketch_columns))
+        if start is not None:
+            stmt = stmt.where(time_column >= start)
+        if end is not None:
+            stmt = stmt.where(time_column < end)
+        if filters.utm_source is not None:
+            stmt = stmt.where(model.utm_source == filters.utm_source)
+        rows.extend(db_session.execute(stmt).all())
+    return {key[0]: sketches for key, sketches in _union_sketches(rows, 1, sketch_columns).items()}
+
+
+def _rollup(name):
+    return next(rollup for rollup in ROLLUPS if rollup.name == name)
+
+
+def lead_totals(filters=NO_FILTER):
+    """Lead counts, score total, completed count and conversions"""
+    db_session = get_db_session()
+    try:
+        leads = db_session.execute(filters.apply_buckets(select(
+            func.coalesce(func.sum(LeadRollup.leads), 0).label('total_leads'),
+            func.coalesce(func.sum(LeadRollup.leads).filter(
+                LeadRollup.lead_type == 'SQL'), 0).label('sql_leads'),
+            func.coalesce(func.sum(LeadRollup.leads).filter(
+                LeadRollup.lead_type == 'MQL'), 0).label('mql_leads'),
+            func.coalesce(func.sum(LeadRollup.leads).filter(
+                LeadRollup.lead_type == 'Unqualified'), 0).label('unqualified_leads'),
+            func.coalesce(func.sum(LeadRollup.score_sum),
+                          0).label('score_sum'),
+            func.coalesce(func.sum(LeadRollup.completed),
+                          0).label('completed')
+        ), LeadRollup)).one()
+        conversions = db_session.execute(filters.apply_buckets(
+            select(func.coalesce(func.sum(BehaviorRollup.events), 0))
+            .where(BehaviorRollup.action == 'ab_test_conversion'), BehaviorRollup)
+        ).scalar()
+    finally:
+        db_session.close()
+    totals = dict(leads._mapping)
+    totals['conversions'] = conversions
+    return totals
+
+
+def page_performance(filters=NO_FILTER):
+    db_session = get_db_session()
+    try:
+        rows = db_session.execute(filters.apply_buckets(select(
+            PageRollup.page_identifier,
+            func.sum(PageRollup.views).label('views'),
+            (func.sum(PageRollup.time_spent_sum) /
+             func.nullif(func.sum(PageRollup.time_spent_count), 0)).label('avg_time')
+        ), PageRollup).group_by(PageRollup.page_identifier)).all()
+        sketches = _range_sketches(db_session, filters, _rollup('pages'))
+    finally:
+        db_session.close()
+    no_sketches = {'sessions_hll': None, 'time_spent_digest': None}
+    results = []
+    for row in rows:
+        page_sketches = sketches.get(row.page_identifier, no_sketches)
+        sessions = page_sketches['sessions_hll']
+        results.append({
+            'page': row.page_identifier,
+            'views': int(row.views),
+            'unique_sessions': sessions.count() if sessions is not None else None,
+            'avg_time_spent': float(row.avg_time) if row.avg_time else 0.0,
+            'time_spent_percentiles': digest_percentiles(page_sketches['time_spent_digest'])
+        })
+    return results
+
+
+def answer_times(filters=NO_FILTER):
+    """Answer counts and time_taken average and percentiles per question"""
+    db_session = get_db_session()
+    try:
+        rows = db_session.execute(filters.apply_buckets(select(
+            AnswerRollup.question_id,
+            func.sum(AnswerRollup.answers).label('answers'),
+            func.sum(AnswerRollup.time_taken_count).label('timed_answers'),
+            (func.sum(AnswerRollup.time_taken_sum) /
+             func.nullif(func.sum(AnswerRollup.time_taken_count), 0)).label('avg_time')
+        ), AnswerRollup).group_by(AnswerRollup.question_id)
+            .order_by(AnswerRollup.question_id)).all()
+        sketches = _range_sketches(db_session, filters, _rollup('answers'))
+    finally:
+        db_session.close()
+    return [{
+        'question_id': row.question_id,
+        'answers': int(row.answers),
+        'timed_answers': int(row.timed_answers),
+        'avg_time_taken': float(row.avg_time) if row.avg_time else None,
+        'time_taken_percentiles': digest_percentiles(
+            sketches.get(row.question_id, {}).get('time_taken_digest'))
+    } for row in rows]
+
+
+def abandonment(filters=NO_FILTER):
+    db_session = get_db_session()
+    try:
+        exit_points = db_session.execute(filters.apply_buckets(select(
+            ExitRollup.exit_question_id, ExitRollup.exit_page,
+            func.sum(ExitRollup.exits).label('count')
+        ), ExitRollup).group_by(ExitRollup.exit_question_id, ExitRollup.exit_page)).all()
+        completion_by_reason = db_session.execute(filters.apply_buckets(select(
+            ExitRollup.exit_reason,
+            (func.sum(ExitRollup.completion_sum) /
+             func.nullif(func.sum(ExitRollup.completion_count), 0)).label('avg_completion')
+        ), ExitRollup).group_by(ExitRollup.exit_reason)).all()
+    finally:
+        db_session.close()
+    return {
+        'common_exit_points': [{
+            'question_id': point.exit_question_id,
+            'page': point.exit_page,
+            'count': int(point.count)
+        } for point in exit_points],
+        'completion_by_reason': [{
+            'reason': reason.exit_reason,
+            'avg_completion': float(reason.avg_completion) if reason.avg_completion else 0.0
+        } for reason in completion_by_reason]
+    }
+
+
+if __name__ == "__main__":
+    for name, buckets in RollupCompactor(0).compact_all().items():
+        print(f"{name}: recomputed {buckets} hourly buckets")
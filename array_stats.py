@@ -0,0 +1,28 @@
+"""
+Vectorized per-group statistics over numpy column arrays, shared by the
+funnel and cohort analytics.
+"""
+
+import numpy as np
+
+
+def grouped_quantiles(groups, values, group_count, quantiles):
+    """
+    Quantiles (linear interpolation, like numpy.quantile) of values per group
+    id in [0, group_count). Returns an array of shape (len(quantiles),
+    group_count), NaN for empty groups. One lexsort, no per-group loop.
+    """
+    result = np.full((len(quantiles), group_count), np.nan)
+    if not len(values):
+        return result
+    order = np.lexsort((values, groups))
+    values = np.asarray(values, dtype=np.float64)[order]
+    counts = np.bincount(groups, minlength=group_count)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    present = counts > 0
+    for row, quantile in enumerate(quantiles):
+        position = starts[present] + quantile * (counts[present] - 1)
+        low = np.floor(position).astype(np.int64)
+        high = np.ceil(position).astype(np.int64)
+        result[row, present] = values[low] + (values[high] - values[low]) * (position - low)
+    return result
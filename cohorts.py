@@ -0,0 +1,198 @@
+"""
+Cohort analytics over a columnar lead snapshot
+A cohort is a signup day x utm_source. For each cohort we report lead
+counts, SQL/MQL rates, score percentiles and the median hours from signup
+to first reaching SQL (leads.sql_at).
+
+Leads are loaded into a LeadSnapshot of typed numpy arrays in one streamed
+scan, never as ORM objects, and reused until COHORT_SNAPSHOT_REFRESH_SECONDS
+old. A stale snapshot is still served while one background thread rebuilds
+it, so only the first request in a process waits for the scan. Building the
+cohort matrix is then a handful of vectorized reductions.
+"""
+
+import logging
+import threading
+import time
+import numpy as np
+from sqlalchemy import select, case, func, extract
+from database import engine
+from models import Lead
+from array_stats import grouped_quantiles
+from analytics_filters import NO_FILTER
+from config import Config
+
+LEAD_TYPES = ('Unqualified', 'MQL', 'SQL')
+SCORE_PERCENTILES = (0.25, 0.5, 0.75, 0.9)
+
+
+class LeadSnapshot:
+    """Column arrays of every lead, with utm_source dictionary-encoded"""
+
+    def __init__(self, created_at, source_codes, sources, lead_types, scores, hours_to_sql):
+        self.created_at = np.asarray(created_at, dtype='datetime64[s]')
+        self.source_codes = np.asarray(source_codes, dtype=np.int32)
+        self.sources = list(sources)  # code -> utm_source ('' for none)
+        self.lead_types = np.asarray(lead_types, dtype=np.int8)  # index into LEAD_TYPES
+        self.scores = np.asarray(scores, dtype=np.float32)
+        self.hours_to_sql = np.asarray(hours_to_sql, dtype=np.float32)  # NaN if never SQL
+        self.built_at = time.time()
+        self.build_ms = 0.0
+
+    def __len__(self):
+        return len(self.created_at)
+
+    @classmethod
+    def load(cls, batch_rows=None):
+        """Stream all leads into a snapshot in one scan"""
+        started = time.perf_counter()
+        stmt = select(
+            Lead.created_at,
+            func.coalesce(Lead.utm_source, ''),
+            case((Lead.lead_type == 'SQL', 2), (Lead.lead_type == 'MQL', 1), else_=0),
+            func.coalesce(Lead.lead_score, 0),
+            extract('epoch', Lead.sql_at - Lead.created_at) / 3600.0
+        ).where(Lead.created_at.is_not(None))
+
+        columns = ([], [], [], [], [])
+        sources = {}
+        with engine.connect() as connection:
+            result = connection.execution_options(
+                stream_results=True,
+                yield_per=batch_rows or Config.JOURNEY_STREAM_BATCH_ROWS
+            ).execute(stmt)
+            for rows in result.partitions():
+                created_at, utm_sources, lead_types, scores, hours = zip(*rows)
+                # Encode the chunk's distinct sources, then map every row at once
+                distinct, inverse = np.unique(
+                    np.asarray(utm_sources, dtype=object), return_inverse=True)
+                codes = np.asarray([sources.setdefault(source, len(sources))
+                                    for source in distinct], dtype=np.int32)
+                columns[0].append(np.asarray(created_at, dtype='datetime64[s]'))
+                columns[1].append(codes[inverse])
+                columns[2].append(np.asarray(lead_types, dtype=np.int8))
+                columns[3].append(np.asarray(scores, dtype=np.float32))
+                columns[4].append(np.asarray(hours, dtype=np.float32))
+
+        arrays = [np.concatenate(column) if column else [] for column in columns]
+        snapshot = cls(arrays[0], arrays[1], sorted(sources, key=sources.get),
+                       arrays[2], arrays[3], arrays[4])
+        snapshot.build_ms = (time.perf_counter() - started) * 1000.0
+        return snapshot
+
+
+def cohort_matrix(snapshot, filters=NO_FILTER):
+    """Cohort rows (newest day first) for leads created in the filter's range"""
+    mask = np.ones(len(snapshot), dtype=bool)
+    if filters.start is not None:
+        mask &= snapshot.created_at >= np.datetime64(filters.start, 's')
+    if filters.end is not None:
+        mask &= snapshot.created_at < np.datetime64(filters.end, 's')
+    if filters.utm_source is not None:
+        if filters.utm_source not in snapshot.sources:
+            return []
+        mask &= snapshot.source_codes == snapshot.sources.index(filters.utm_source)
+    if not mask.any():
+        return []
+
+    days = snapshot.created_at[mask].astype('datetime64[D]').astype(np.int64)
+    source_codes = snapshot.source_codes[mask].astype(np.int64)
+    keys, cohort = np.unique(days * len(snapshot.sources) + source_codes, return_inverse=True)
+    cohort_count = len(keys)
+
+    lead_types = snapshot.lead_types[mask]
+    scores = snapshot.scores[mask]
+    hours_to_sql = snapshot.hours_to_sql[mask]
+
+    leads = np.bincount(cohort, minlength=cohort_count)
+    sql_leads = np.bincount(cohort, weights=lead_types == 2, minlength=cohort_count)
+    mql_leads = np.bincount(cohort, weights=lead_types == 1, minlength=cohort_count)
+    score_sums = np.bincount(cohort, weights=scores, minlength=cohort_count)
+    percentiles = grouped_quantiles(cohort, scores, cohort_count, SCORE_PERCENTILES)
+    reached_sql = ~np.isnan(hours_to_sql)
+    median_hours = grouped_quantiles(
+        cohort[reached_sql], hours_to_sql[reached_sql], cohort_count, [0.5])[0]
+
+    cohort_days = (keys // len(snapshot.sources)).astype('datetime64[D]')
+    cohort_sources = keys % len(snapshot.sources)
+
+    def rounded(value):
+        return None if np.isnan(value) else round(float(value), 2)
+
+    rows = [{
+        'day': str(cohort_days[i]),
+        'utm_source': snapshot.sources[cohort_sources[i]] or None,
+        'leads': int(leads[i]),
+        'sql_leads': int(sql_leads[i]),
+        'mql_leads': int(mql_leads[i]),
+        'sql_rate': round(float(sql_leads[i] / leads[i] * 100), 2),
+        'mql_rate': round(float(mql_leads[i] / leads[i] * 100), 2),
+        'average_score': round(float(score_sums[i] / leads[i]), 2),
+        'score_percentiles': {
+            f"p{int(quantile * 100)}": rounded(percentiles[row, i])
+            for row, quantile in enumerate(SCORE_PERCENTILES)
+        },
+        'median_hours_to_sql': rounded(median_hours[i])
+    } for i in range(cohort_count)]
+    rows.sort(key=lambda row: row['utm_source'] or '')
+    rows.sort(key=lambda row: row['day'], reverse=True)
+    return rows
+
+
+class SnapshotHolder:
+    """
+    The current LeadSnapshot; rebuilt in the background once older than
+    max_age_seconds, at most one rebuild at a time.
+    """
+
+    def __init__(self, max_age_seconds, loader=LeadSnapshot.load):
+        self.max_age_seconds = max_age_seconds
+        self._loader = loader
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self.last_error = None
+
+    def get(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = self._loader()
+                return self._snapshot
+        if time.time() - snapshot.built_at > self.max_age_seconds:
+            self._refresh_in_background()
+        return snapshot
+
+    def stats(self):
+        snapshot = self._snapshot
+        loaded = snapshot is not None
+        return {
+            'leads': len(snapshot) if loaded else 0,
+            'age_seconds': round(time.time() - snapshot.built_at, 1) if loaded else None,
+            'build_ms': snapshot.build_ms if loaded else None,
+            'max_age_seconds': self.max_age_seconds,
+            'last_error': self.last_error
+        }
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, name='cohort-snapshot', daemon=True).start()
+
+    def _refresh(self):
+        try:
+            snapshot = self._loader()
+            with self._lock:
+                self._snapshot = snapshot
+        except Exception as e:
+            self.last_error = str(e)
+            logging.error(f"Cohort snapshot refresh failed: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+
+lead_snapshot = SnapshotHolder(Config.COHORT_SNAPSHOT_REFRESH_SECONDS)
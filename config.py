@@ -24,5 +24,94 @@ class Config:
 
     # Analytics Configuration
     ANALYTICS_RETENTION_DAYS = int(os.getenv('ANALYTICS_RETENTION_DAYS', 90))
+    # Delete expired behaviors, page views and exits in a background job
+    ANALYTICS_RETENTION_ENABLED = os.getenv(
+        'ANALYTICS_RETENTION_ENABLED', 'False').lower() == 'true'
+    ANALYTICS_RETENTION_INTERVAL_SECONDS = int(
+        os.getenv('ANALYTICS_RETENTION_INTERVAL_SECONDS', 3600))
+    ANALYTICS_RETENTION_BATCH_ROWS = int(
+        os.getenv('ANALYTICS_RETENTION_BATCH_ROWS', 5000))
+    # Pause between delete batches
+    ANALYTICS_RETENTION_BATCH_PAUSE_MS = int(
+        os.getenv('ANALYTICS_RETENTION_BATCH_PAUSE_MS', 50))
     REALTIME_UPDATES_INTERVAL = int(
         os.getenv('REALTIME_UPDATES_INTERVAL', 30))  # seconds
+    # Serve /api/analytics/* from hourly rollup tables kept by a compactor
+    ANALYTICS_ROLLUPS_ENABLED = os.getenv(
+        'ANALYTICS_ROLLUPS_ENABLED', 'False').lower() == 'true'
+    ANALYTICS_ROLLUP_INTERVAL_SECONDS = int(
+        os.getenv('ANALYTICS_ROLLUP_INTERVAL_SECONDS', 60))
+    # Buckets this recent are always recomputed, to catch late commits
+    ANALYTICS_ROLLUP_RECENT_HOURS = int(
+        os.getenv('ANALYTICS_ROLLUP_RECENT_HOURS', 2))
+    # Overlap when re-reading rows changed since the last compaction
+    ANALYTICS_ROLLUP_LATE_SECONDS = int(
+        os.getenv('ANALYTICS_ROLLUP_LATE_SECONDS', 300))
+    # Age at which the in-memory lead snapshot behind cohort analytics is rebuilt
+    COHORT_SNAPSHOT_REFRESH_SECONDS = int(
+        os.getenv('COHORT_SNAPSHOT_REFRESH_SECONDS', 300))
+
+    # Event Ingestion Configuration
+    EVENT_BATCH_MAX_SIZE = int(os.getenv('EVENT_BATCH_MAX_SIZE', 500))
+    SESSION_BULK_MAX = int(os.getenv('SESSION_BULK_MAX', 1000))
+
+    # /api/analytics/customer-journey paging and streaming
+    JOURNEY_PAGE_SIZE = int(os.getenv('JOURNEY_PAGE_SIZE', 100))
+    JOURNEY_PAGE_SIZE_MAX = int(os.getenv('JOURNEY_PAGE_SIZE_MAX', 1000))
+    JOURNEY_STREAM_BATCH_ROWS = int(os.getenv('JOURNEY_STREAM_BATCH_ROWS', 1000))
+
+    # Rows fetched per server-side cursor batch by the bulk CRM export
+    CRM_EXPORT_BATCH_ROWS = int(os.getenv('CRM_EXPORT_BATCH_ROWS', 2000))
+
+    # Browser/CDN cache lifetime of the static workflow config endpoints
+    STATIC_CONFIG_MAX_AGE_SECONDS = int(
+        os.getenv('STATIC_CONFIG_MAX_AGE_SECONDS', 300))
+
+    # In-memory lead summary cache (0 disables); other workers may serve a
+    # summary up to this many seconds old
+    SUMMARY_CACHE_TTL_SECONDS = float(os.getenv('SUMMARY_CACHE_TTL_SECONDS', 5))
+    SUMMARY_CACHE_MAX_ENTRIES = int(os.getenv('SUMMARY_CACHE_MAX_ENTRIES', 10000))
+
+    # Analytics result cache (0 disables): table high-water marks are re-read
+    # at most this often, so a result is at most this many seconds stale
+    ANALYTICS_CACHE_MAX_STALE_SECONDS = float(
+        os.getenv('ANALYTICS_CACHE_MAX_STALE_SECONDS', REALTIME_UPDATES_INTERVAL))
+    ANALYTICS_CACHE_MAX_ENTRIES = int(os.getenv('ANALYTICS_CACHE_MAX_ENTRIES', 1000))
+
+    # Customer IDs reserved per database round trip, per worker process
+    CUSTOMER_ID_BLOCK_SIZE = int(os.getenv('CUSTOMER_ID_BLOCK_SIZE', 20))
+
+    # Write-behind buffer for telemetry inserts (UserBehavior/PageTracking)
+    WRITE_BEHIND_ENABLED = os.getenv(
+        'WRITE_BEHIND_ENABLED', 'False').lower() == 'true'
+    WRITE_BEHIND_FLUSH_INTERVAL_MS = int(
+        os.getenv('WRITE_BEHIND_FLUSH_INTERVAL_MS', 200))
+    WRITE_BEHIND_MAX_ROWS = int(os.getenv('WRITE_BEHIND_MAX_ROWS', 500))
+    WRITE_BEHIND_ID_BLOCK_SIZE = int(
+        os.getenv('WRITE_BEHIND_ID_BLOCK_SIZE', 100))
+    WRITE_BEHIND_MAX_QUEUE = int(os.getenv('WRITE_BEHIND_MAX_QUEUE', 50000))
+
+    # Durable local event log (tracking endpoints append, replayer drains)
+    EVENT_LOG_ENABLED = os.getenv('EVENT_LOG_ENABLED', 'False').lower() == 'true'
+    # Each worker process claims its own worker-N subdirectory
+    EVENT_LOG_DIR = os.getenv('EVENT_LOG_DIR', 'event_log')
+    EVENT_LOG_SEGMENT_BYTES = int(
+        os.getenv('EVENT_LOG_SEGMENT_BYTES', 64 * 1024 * 1024))
+    EVENT_LOG_REPLAY_BATCH_RECORDS = int(
+        os.getenv('EVENT_LOG_REPLAY_BATCH_RECORDS', 500))
+    EVENT_LOG_REPLAY_INTERVAL_MS = int(
+        os.getenv('EVENT_LOG_REPLAY_INTERVAL_MS', 500))
+    # page_tracking ids kept reserved in the background for logged page entries
+    EVENT_LOG_RESERVED_PAGE_IDS = int(
+        os.getenv('EVENT_LOG_RESERVED_PAGE_IDS', 200))
+
+    # Idempotency-Key handling for write endpoints
+    IDEMPOTENCY_CACHE_MAX_ENTRIES = int(
+        os.getenv('IDEMPOTENCY_CACHE_MAX_ENTRIES', 10000))
+    IDEMPOTENCY_TTL_SECONDS = int(os.getenv('IDEMPOTENCY_TTL_SECONDS', 86400))
+    # Share keys across workers through the idempotency_keys table
+    IDEMPOTENCY_DB_ENABLED = os.getenv(
+        'IDEMPOTENCY_DB_ENABLED', 'False').lower() == 'true'
+    # A claimed key with no response after this long is considered abandoned
+    IDEMPOTENCY_PENDING_TIMEOUT_SECONDS = int(
+        os.getenv('IDEMPOTENCY_PENDING_TIMEOUT_SECONDS', 60))
@@ -0,0 +1,3 @@
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers", "postgres: needs the Postgres database at DATABASE_URL")
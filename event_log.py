@@ -0,0 +1,456 @@
+"""
+Durable local event log
+Tracking endpoints append events to checksummed, rotating segment files and
+return without waiting on Postgres. A background replayer drains the segments
+into user_behaviors, page_tracking and session_exits in bulk through
+EventBatchService, committing its read offset in the same transaction, so
+every event is applied exactly once even across crashes.
+
+Page entries are answered with their page_tracking id before they reach the
+database. The replayer keeps EVENT_LOG_RESERVED_PAGE_IDS ids reserved from
+the page_tracking sequence between batches, so handing one out is a memory
+operation; when the reserve runs dry (the database has been down for a
+while) callers write page entries directly instead of logging them.
+
+Segments are never shared between processes: each process claims the first
+free worker-N directory under EVENT_LOG_DIR and holds an exclusive lock on it
+while it runs, so `uvicorn --workers N` uses worker-0 .. worker-N-1. A
+restarted worker claims a slot again and replays what was left in it. The
+replay offset is keyed by the slot, e.g. "event_log/worker-0".
+"""
+
+import json
+import logging
+import os
+import struct
+import threading
+import zlib
+from datetime import datetime
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+from sqlalchemy.exc import DBAPIError, OperationalError
+from database import get_db_session
+from models import EventLogOffset, PageTracking
+from write_buffer import id_allocator
+from config import Config
+
+RECORD_HEADER = struct.Struct('>II')  # payload length, crc32 of payload
+MAX_RECORD_BYTES = 16 * 1024 * 1024
+SEGMENT_SUFFIX = '.log'
+LOCK_FILENAME = 'owner.lock'
+
+
+class CorruptRecordError(Exception):
+    """Raised when a record fails its length or checksum validation"""
+
+
+class EventLogLockedError(Exception):
+    """Raised when another process already holds the log directory"""
+
+
+def _lock_directory(directory):
+    """
+    Take an exclusive, non-blocking lock on directory for this process and
+    return the open lock file; the lock lasts until the file is closed.
+    """
+    lock_file = open(os.path.join(directory, LOCK_FILENAME), 'a+b')
+    try:
+        if fcntl:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        lock_file.close()
+        raise EventLogLockedError(f"{directory} is in use by another process")
+    return lock_file
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def read_segment(path, start=0):
+    """
+    Yield (payload, end_position) for each complete record from start.
+    Stops quietly at a truncated tail; raises CorruptRecordError on a bad
+    length or checksum.
+    """
+    with open(path, 'rb') as segment_file:
+        segment_file.seek(start)
+        position = start
+        while True:
+            header = segment_file.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            length, checksum = RECORD_HEADER.unpack(header)
+            if length > MAX_RECORD_BYTES:
+                raise CorruptRecordError(
+                    f"{path}@{position}: record length {length} too large")
+            data = segment_file.read(length)
+            if len(data) < length:
+                return
+            if zlib.crc32(data) != checksum:
+                raise CorruptRecordError(f"{path}@{position}: checksum mismatch")
+            position += RECORD_HEADER.size + length
+            yield json.loads(data), position
+
+
+class SegmentedEventLog:
+    """Append-only log split into numbered segment files"""
+
+    def __init__(self, directory, segment_bytes, name=None):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.name = name or os.path.basename(os.path.normpath(directory))
+        os.makedirs(directory, exist_ok=True)
+        # Fail fast rather than interleave appends with another process
+        self._lock_file = _lock_directory(directory)
+
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._written = 0  # bytes appended since open
+        self._synced = 0  # bytes known to be on disk
+
+        # Always start a fresh segment; older ones are sealed for the replayer
+        existing = self.segments()
+        self._segment = (existing[-1] + 1) if existing else 1
+        self._file = open(self.segment_path(self._segment), 'ab')
+        self._size = 0
+        self.records_appended = 0
+
+    def segment_path(self, segment):
+        return os.path.join(self.directory, f"{segment:020d}{SEGMENT_SUFFIX}")
+
+    def segments(self):
+        """Sorted numbers of the segment files currently on disk"""
+        return sorted(
+            int(filename[:-len(SEGMENT_SUFFIX)])
+            for filename in os.listdir(self.directory)
+            if filename.endswith(SEGMENT_SUFFIX) and filename[:-len(SEGMENT_SUFFIX)].isdigit()
+        )
+
+    @property
+    def active_segment(self):
+        return self._segment
+
+    def append(self, payload):
+        """
+        Append one record and return once it is fsynced. Concurrent appends
+        share fsyncs: whichever caller syncs first covers everyone who wrote
+        before it (group commit).
+        """
+        data = json.dumps(payload, separators=(',', ':'),
+                          default=_json_default).encode('utf-8')
+        record = RECORD_HEADER.pack(len(data), zlib.crc32(data)) + data
+        with self._lock:
+            if self._size and self._size + len(record) > self.segment_bytes:
+                self._rotate()
+            self._file.write(record)
+            self._size += len(record)
+            self._written += len(record)
+            self.records_appended += 1
+            mark = self._written
+        self._sync(mark)
+
+    def _sync(self, mark):
+        with self._sync_lock:
+            if self._synced >= mark:
+                return
+            with self._lock:
+                self._file.flush()
+                target = self._written
+                # A duplicate fd stays valid if the segment rotates meanwhile
+                fd = os.dup(self._file.fileno())
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            self._synced = target
+
+    def _rotate(self):
+        # Caller holds self._lock
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._segment += 1
+        self._file = open(self.segment_path(self._segment), 'ab')
+        self._size = 0
+
+    def close(self):
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._lock_file.close()
+
+    def read_from(self, segment, position, max_records):
+        """
+        Read up to max_records starting at (segment, position).
+        Returns (payloads, next_segment, next_position). Corrupt data in a
+        sealed segment is logged and the rest of that segment skipped.
+        """
+        payloads = []
+        for current in self.segments():
+            if current < segment:
+                continue
+            if current > segment:
+                segment, position = current, 0
+            try:
+                for payload, end in read_segment(self.segment_path(current), position):
+                    payloads.append(payload)
+                    position = end
+                    if len(payloads) >= max_records:
+                        return payloads, segment, position
+            except CorruptRecordError as e:
+                if current == self.active_segment:
+                    raise
+                logging.error(f"Skipping rest of corrupt event log segment: {e}")
+            if current == self.active_segment:
+                break
+        return payloads, segment, position
+
+    def remove_segments_before(self, segment):
+        """Delete sealed segments that the replayer has fully committed"""
+        for current in self.segments():
+            if current >= segment or current == self.active_segment:
+                break
+            os.remove(self.segment_path(current))
+
+    def stats(self):
+        segments = self.segments()
+        return {
+            'directory': self.directory,
+            'active_segment': self.active_segment,
+            'segments': len(segments),
+            'bytes_on_disk': sum(os.path.getsize(self.segment_path(s)) for s in segments),
+            'records_appended': self.records_appended
+        }
+
+
+class EventLogReplayer:
+    """Drains the event log into Postgres and records its committed offset"""
+
+    def __init__(self, event_log, batch_records, interval_ms, reserved_page_ids=0):
+        self.event_log = event_log
+        self.batch_records = batch_records
+        self.interval = interval_ms / 1000.0
+        self.reserved_page_ids = reserved_page_ids
+        self._stopping = threading.Event()
+        self._thread = None
+        self.records_replayed = 0
+        self.records_dead_lettered = 0
+        self.last_error = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self._run, name='event-log-replayer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the thread after a final drain attempt"""
+        self._stopping.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.replay_available()
+
+    def replay_available(self):
+        """Replay until the log is drained or the database is unavailable"""
+        total = 0
+        while True:
+            try:
+                replayed = self.replay_once()
+            except Exception as e:
+                self.last_error = str(e)
+                if _is_transient(e):
+                    logging.error(f"Event log replay deferred: {e}")
+                    return total
+                # Isolate the failing record by replaying one at a time
+                logging.error(f"Event log replay failed, retrying per record: {e}")
+                try:
+                    replayed = self.replay_once(max_records=1)
+                except Exception as record_error:
+                    if _is_transient(record_error):
+                        return total
+                    self._dead_letter(record_error)
+                    replayed = 1
+            if not replayed:
+                return total
+            total += replayed
+
+    def replay_once(self, max_records=None):
+        """
+        Replay one batch of records in a single transaction together with the
+        offset update. Returns how many records were applied.
+        """
+        from services import EventBatchService
+
+        db_session = get_db_session()
+        try:
+            offset = self._locked_offset(db_session)
+            payloads, segment, position = self.event_log.read_from(
+                offset.segment, offset.position, max_records or self.batch_records)
+            if not payloads and (segment, position) == (offset.segment, offset.position):
+                db_session.rollback()
+                return 0
+
+            events = [_decode_event(event)
+                      for payload in payloads for event in payload['events']]
+            if events:
+                EventBatchService.write_events(db_session, events)
+            offset.segment, offset.position = segment, position
+            db_session.commit()
+        except Exception:
+            db_session.rollback()
+            raise
+        finally:
+            db_session.close()
+
+        self.records_replayed += len(payloads)
+        self.last_error = None
+        self.event_log.remove_segments_before(segment)
+        # Skipping past an empty sealed segment still counts as progress
+        return len(payloads) or 1
+
+    def _locked_offset(self, db_session):
+        offset = db_session.query(EventLogOffset).filter_by(
+            name=self.event_log.name).with_for_update().first()
+        if offset is None:
+            offset = EventLogOffset(
+                name=self.event_log.name, segment=0, position=0)
+            db_session.add(offset)
+        return offset
+
+    def _dead_letter(self, error):
+        """Move a record that can never be applied aside and skip past it"""
+        db_session = get_db_session()
+        try:
+            offset = self._locked_offset(db_session)
+            payloads, segment, position = self.event_log.read_from(
+                offset.segment, offset.position, 1)
+            with open(os.path.join(self.event_log.directory, 'dead-letter.jsonl'),
+                      'a', encoding='utf-8') as dead_letter:
+                for payload in payloads:
+                    dead_letter.write(json.dumps(
+                        {'error': str(error), 'payload': payload}) + '\n')
+            offset.segment, offset.position = segment, position
+            db_session.commit()
+        except Exception:
+            db_session.rollback()
+            raise
+        finally:
+            db_session.close()
+        self.records_dead_lettered += len(payloads)
+        logging.error(f"Event log record moved to dead letter file: {error}")
+
+    def reserve_page_ids(self):
+        """Top up the page_tracking ids handed out to logged page entries"""
+        try:
+            return id_allocator.refill(PageTracking, self.reserved_page_ids)
+        except Exception as e:
+            logging.error(f"Could not reserve page_tracking ids: {e}")
+            return 0
+
+    def stats(self):
+        return {
+            'records_replayed': self.records_replayed,
+            'records_dead_lettered': self.records_dead_lettered,
+            'reserved_page_ids': id_allocator.reserved(PageTracking),
+            'last_error': self.last_error
+        }
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self.reserve_page_ids()
+            try:
+                self.replay_available()
+            except Exception as e:
+                logging.error(f"Event log replayer error: {e}")
+            self._stopping.wait(self.interval)
+
+
+def _is_transient(error):
+    """Database unavailable or connection dropped: retry the same records later"""
+    return isinstance(error, OperationalError) or (
+        isinstance(error, DBAPIError) and error.connection_invalidated)
+
+
+def _decode_event(event):
+    if isinstance(event.get('timestamp'), str):
+        event = dict(event, timestamp=datetime.fromisoformat(event['timestamp']))
+    return event
+
+
+_event_log = None
+_replayer = None
+_init_lock = threading.Lock()
+
+
+def open_worker_log(base_directory, segment_bytes):
+    """Open the event log in the first worker-N slot no other process holds"""
+    base_name = os.path.basename(os.path.normpath(base_directory))
+    slot = 0
+    while True:
+        slot_name = f"worker-{slot}"
+        try:
+            return SegmentedEventLog(
+                os.path.join(base_directory, slot_name), segment_bytes,
+                name=f"{base_name}/{slot_name}")
+        except EventLogLockedError:
+            slot += 1
+
+
+def get_event_log():
+    """Return the process's event log when EVENT_LOG_ENABLED, else None"""
+    global _event_log
+    if not Config.EVENT_LOG_ENABLED:
+        return None
+    with _init_lock:
+        if _event_log is None:
+            _event_log = open_worker_log(
+                Config.EVENT_LOG_DIR, Config.EVENT_LOG_SEGMENT_BYTES)
+        return _event_log
+
+
+def get_replayer():
+    """Return the replayer for the process's event log, else None"""
+    global _replayer
+    event_log = get_event_log()
+    if event_log is None:
+        return None
+    with _init_lock:
+        if _replayer is None:
+            _replayer = EventLogReplayer(
+                event_log,
+                batch_records=Config.EVENT_LOG_REPLAY_BATCH_RECORDS,
+                interval_ms=Config.EVENT_LOG_REPLAY_INTERVAL_MS,
+                reserved_page_ids=Config.EVENT_LOG_RESERVED_PAGE_IDS)
+        return _replayer
+
+
+def append_events(events):
+    """
+    Durably append a list of batch-style event dicts as one record, stamping
+    each with the current time so replays keep the original event times.
+    Returns False if the log is disabled or the append failed.
+    """
+    event_log = get_event_log()
+    if event_log is None:
+        return False
+    now = datetime.now()
+    stamped = [dict(event, timestamp=event.get('timestamp') or now)
+               for event in events]
+    try:
+        event_log.append({'events': stamped})
+        return True
+    except Exception as e:
+        logging.error(f"Event log append failed: {e}")
+        return False
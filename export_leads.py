@@ -0,0 +1,130 @@
+"""
+Bulk CRM export
+Streams the CRM record of /api/lead/export/{session_id} for every lead
+matching a created_at range, utm_source and lead_type, as CSV or NDJSON.
+Records come from LeadService.iter_crm_batches, which reads through a
+server-side cursor, and each batch is encoded to one text chunk, so memory
+use does not grow with the number of leads.
+
+An HTTP response has already started with status 200 when a later batch
+fails, so a failure is logged and the output ends with an error line (an
+{"error": ...} object in NDJSON, a row starting with "#ERROR" in CSV)
+before the stream is aborted. The CLI exits with status 1.
+
+Run from the command line with:
+
+    python export_leads.py --format csv --from 2024-05-01 --lead-type SQL -o leads.csv
+"""
+
+import argparse
+import csv
+import io
+import json
+import logging
+import sys
+from datetime import datetime
+from analytics_filters import AnalyticsFilter
+from services import LeadService
+
+CRM_FIELDS = (
+    'name', 'location', 'business_type', 'staff_size', 'monthly_sales',
+    'features_interested', 'contact_info', 'email', 'phone', 'lead_score',
+    'lead_type', 'utm_source', 'session_start_time', 'assigned_to'
+)
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson'
+}
+
+
+def encode_ndjson(batches):
+    """One JSON object per line, one string per batch"""
+    for records in batches:
+        if records:
+            yield ''.join(json.dumps(record) + '\n' for record in records)
+
+
+def encode_csv(batches):
+    """Header row first, then one string of rows per batch. Lists are joined with '; '"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CRM_FIELDS, extrasaction='ignore')
+    writer.writeheader()
+    for records in batches:
+        for record in records:
+            features = record.get('features_interested')
+            if isinstance(features, list):
+                record = dict(record, features_interested='; '.join(map(str, features)))
+            writer.writerow(record)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+ENCODERS = {
+    'csv': encode_csv,
+    'ndjson': encode_ndjson
+}
+
+
+def error_line(format, error, records):
+    """Final line marking an export that failed after `records` records"""
+    message = f"export failed after {records} records: {error}"
+    if format == 'ndjson':
+        return json.dumps({'error': message, 'records_exported': records}) + '\n'
+    return f"#ERROR {message}\r\n"
+
+
+def export_chunks(format, filters, lead_type=None):
+    """
+    Encoded text chunks of the export in the given format. If reading or
+    encoding fails, yields an error line and then re-raises.
+    """
+    exported = [0]
+
+    def counted(batches):
+        for records in batches:
+            yield records
+            exported[0] += len(records)
+
+    try:
+        yield from ENCODERS[format](counted(LeadService.iter_crm_batches(filters, lead_type)))
+    except Exception as e:
+        logging.error(f"Lead export failed after {exported[0]} records: {e}")
+        yield error_line(format, e, exported[0])
+        raise
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export leads in CRM format")
+    parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+    parser.add_argument('--from', dest='start', type=datetime.fromisoformat,
+                        help="created at or after (ISO 8601)")
+    parser.add_argument('--to', dest='end', type=datetime.fromisoformat,
+                        help="created before (ISO 8601)")
+    parser.add_argument('--utm-source')
+    parser.add_argument('--lead-type', choices=['Unqualified', 'MQL', 'SQL'])
+    parser.add_argument('-o', '--output', help="file to write (default stdout)")
+    args = parser.parse_args(argv)
+
+    try:
+        filters = AnalyticsFilter(args.start, args.end, args.utm_source)
+    except ValueError as e:
+        parser.error(str(e))
+
+    output = open(args.output, 'w', newline='', encoding='utf-8') if args.output else sys.stdout
+    try:
+        for chunk in export_chunks(args.format, filters, args.lead_type):
+            output.write(chunk)
+    except Exception as e:
+        print(f"Export incomplete: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if args.output:
+            output.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+"""
+Question-step funnel
+Per question in questions_workflow order: how many sessions reached it,
+answered it, skipped it and abandoned on it, and the median seconds spent
+answering it.
+
+The input is one time-ordered event stream per session (session start,
+answers, skips, non-completed exits) read in a single pass, held as numpy
+column arrays. Every count is a vectorized reduction over those arrays;
+there is no per-session Python loop.
+
+Skips logged before skip events carried a question id, and exits without
+an exit_question_id, are attributed to the step after the furthest step
+the session had reached at that point.
+"""
+
+import numpy as np
+from array_stats import grouped_quantiles
+
+# Event kinds, in the order events at the same instant are sorted
+START, ANSWER, SKIP, EXIT = 0, 1, 2, 3
+UNKNOWN_QUESTION = -1
+
+
+class FunnelEvents:
+    """
+    Column arrays of events sorted by session then time: new_session marks
+    each session's first event, times are numpy datetime64 (NaT allowed).
+    """
+
+    def __init__(self, new_session, kinds, question_ids, times):
+        self.new_session = np.asarray(new_session, dtype=bool)
+        self.kinds = np.asarray(kinds, dtype=np.int8)
+        self.question_ids = np.asarray(question_ids, dtype=np.int64)
+        self.times = np.asarray(times, dtype='datetime64[us]')
+
+    @classmethod
+    def from_chunks(cls, chunks):
+        """
+        Build from (session_ids, kinds, question_ids, times) column chunks,
+        already ordered by session, with UNKNOWN_QUESTION for missing
+        question ids. Session ids are only compared to find boundaries and
+        are not kept.
+        """
+        new_session, kinds, question_ids, times = [], [], [], []
+        previous = None
+        for chunk_sessions, chunk_kinds, chunk_questions, chunk_times in chunks:
+            sessions = np.asarray(chunk_sessions, dtype=object)
+            if not len(sessions):
+                continue
+            boundaries = np.empty(len(sessions), dtype=bool)
+            boundaries[0] = sessions[0] != previous
+            boundaries[1:] = sessions[1:] != sessions[:-1]
+            previous = sessions[-1]
+            new_session.append(boundaries)
+            kinds.append(np.asarray(chunk_kinds, dtype=np.int8))
+            question_ids.append(np.asarray(chunk_questions, dtype=np.int64))
+            times.append(np.asarray(chunk_times, dtype='datetime64[us]'))
+        if not new_session:
+            return cls([], [], [], [])
+        return cls(np.concatenate(new_session), np.concatenate(kinds),
+                   np.concatenate(question_ids), np.concatenate(times))
+
+
+def _step_positions(question_ids, step_ids):
+    """Position of each question id in step order, UNKNOWN_QUESTION if not a step"""
+    lookup = np.full(max(max(step_ids, default=0), 0) + 1,
+                     UNKNOWN_QUESTION, dtype=np.int64)
+    lookup[np.asarray(step_ids, dtype=np.int64)] = np.arange(len(step_ids))
+    in_range = (question_ids >= 0) & (question_ids < len(lookup))
+    positions = np.full(len(question_ids), UNKNOWN_QUESTION, dtype=np.int64)
+    positions[in_range] = lookup[question_ids[in_range]]
+    return positions
+
+
+def _distinct_sessions_per_step(session_index, positions, mask, step_count):
+    """Number of distinct sessions with a masked event at each step"""
+    pairs = np.unique(session_index[mask] * step_count + positions[mask])
+    return np.bincount(pairs % step_count, minlength=step_count)
+
+
+def compute_funnel(events, steps):
+    """
+    Funnel rows for steps (questions in workflow order) from FunnelEvents.
+    """
+    step_ids = [step['id'] for step in steps]
+    step_count = len(step_ids)
+    if not step_count:
+        return []
+    session_index = np.cumsum(events.new_session) - 1
+    session_count = int(session_index[-1]) + 1 if len(session_index) else 0
+    positions = _step_positions(events.question_ids, step_ids)
+
+    # Furthest step known so far within each session. Sessions are
+    # contiguous and increasing, so offsetting by session keeps a global
+    # running max from leaking between sessions.
+    known = (events.kinds == ANSWER) | (events.kinds == SKIP)
+    offset = session_index * (step_count + 1)
+    progress = np.where(known & (positions >= 0), positions + 1, 0) + offset
+    furthest_so_far = np.maximum.accumulate(progress) - offset if len(progress) else progress
+
+    # Unattributed skips and exits land on the step after that
+    unattributed = ((events.kinds == SKIP) | (events.kinds == EXIT)) & (positions < 0)
+    positions = np.where(unattributed & (furthest_so_far < step_count),
+                         furthest_so_far, positions)
+
+    # Every session reaches the first step; otherwise the furthest step seen
+    furthest = np.zeros(session_count, dtype=np.int64)
+    located = positions >= 0
+    np.maximum.at(furthest, session_index[located], positions[located])
+    reached = np.cumsum(np.bincount(furthest, minlength=step_count)[::-1])[::-1]
+
+    answered = _distinct_sessions_per_step(
+        session_index, positions, located & (events.kinds == ANSWER), step_count)
+    skipped = _distinct_sessions_per_step(
+        session_index, positions, located & (events.kinds == SKIP), step_count)
+    abandoned = _distinct_sessions_per_step(
+        session_index, positions, located & (events.kinds == EXIT), step_count)
+
+    # Seconds from the session's previous event to each answer
+    previous_same_session = np.zeros(len(positions), dtype=bool)
+    previous_same_session[1:] = ~events.new_session[1:]
+    elapsed = np.full(len(positions), np.nan)
+    elapsed[1:] = (events.times[1:] - events.times[:-1]) / np.timedelta64(1, 's')
+    timed = located & (events.kinds == ANSWER) & previous_same_session & \
+        ~np.isnan(elapsed) & (elapsed >= 0)
+    medians = grouped_quantiles(positions[timed], elapsed[timed], step_count, [0.5])[0]
+
+    return [{
+        'question_id': step['id'],
+        'step': step.get('step'),
+        'reached': int(reached[position]),
+        'answered': int(answered[position]),
+        'skipped': int(skipped[position]),
+        'abandoned': int(abandoned[position]),
+        'median_time_seconds': None if np.isnan(medians[position]) else round(float(medians[position]), 2)
+    } for position, step in enumerate(steps)]
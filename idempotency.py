@@ -0,0 +1,271 @@
+"""
+Idempotency keys for write endpoints
+Clients send an `Idempotency-Key` header when they may retry a write. The
+first request with a key runs normally and its response is remembered; a
+retry with the same key and body gets that response back without touching
+the database. Reusing a key with a different body is rejected (422), and a
+retry that arrives while the first request is still running gets 409.
+Failed requests are not remembered, so they can be retried.
+
+Keys live in a bounded in-memory LRU. With IDEMPOTENCY_DB_ENABLED they are
+also claimed in the idempotency_keys table so retries that land on another
+worker process are deduplicated too.
+"""
+
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Optional
+from fastapi import Header, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from sqlalchemy import delete, update, or_, and_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from caching import LRUCache
+from database import get_db_session
+from models import IdempotencyKey
+from config import Config
+
+REPLAY_HEADER = 'Idempotent-Replayed'
+
+
+class IdempotencyStore:
+    """Remembers completed responses and tracks keys currently in progress"""
+
+    def __init__(self, max_entries, ttl_seconds, db_enabled=False,
+                 pending_timeout_seconds=60):
+        self.ttl_seconds = ttl_seconds
+        self.db_enabled = db_enabled
+        self.pending_timeout_seconds = pending_timeout_seconds
+        self._completed = LRUCache(max_entries, ttl_seconds)
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self.replays = 0
+
+    def begin(self, endpoint, key, fingerprint):
+        """
+        Claim a key before running the request.
+        Returns the stored response for a duplicate, or None if the caller
+        should run the request and then call complete() or abandon().
+        """
+        cache_key = (endpoint, key)
+        with self._lock:
+            cached = self._completed.get(cache_key)
+            if cached is not None:
+                return self._replay(cached, fingerprint)
+            if cache_key in self._in_flight:
+                raise _in_progress()
+            self._in_flight.add(cache_key)
+
+        if not self.db_enabled:
+            return None
+        try:
+            stored = self._claim_in_db(endpoint, key, fingerprint)
+        except HTTPException:
+            with self._lock:
+                self._in_flight.discard(cache_key)
+            raise
+        except Exception as e:
+            # Fall back to this process's memory if the table is unavailable
+            logging.error(f"Idempotency key lookup failed: {e}")
+            return None
+        if stored is None:
+            return None
+        with self._lock:
+            self._in_flight.discard(cache_key)
+            self._completed.set(cache_key, stored)
+        return self._replay(stored, fingerprint)
+
+    def complete(self, endpoint, key, fingerprint, response):
+        """Remember a successful response for later duplicates"""
+        stored = {'fingerprint': fingerprint, 'response': response}
+        with self._lock:
+            self._completed.set((endpoint, key), stored)
+            self._in_flight.discard((endpoint, key))
+        if self.db_enabled:
+            self._db_write(
+                update(IdempotencyKey)
+                .where(IdempotencyKey.endpoint == endpoint, IdempotencyKey.key == key)
+                .values(response=response))
+
+    def abandon(self, endpoint, key):
+        """Release a key whose request failed so a retry can run again"""
+        with self._lock:
+            self._in_flight.discard((endpoint, key))
+        if self.db_enabled:
+            self._db_write(
+                delete(IdempotencyKey)
+                .where(IdempotencyKey.endpoint == endpoint, IdempotencyKey.key == key,
+                       IdempotencyKey.response.is_(None)))
+
+    def stats(self):
+        stats = self._completed.stats()
+        with self._lock:
+            stats['in_flight'] = len(self._in_flight)
+        stats['replays'] = self.replays
+        stats['db_enabled'] = self.db_enabled
+        return stats
+
+    def _replay(self, stored, fingerprint):
+        if stored['fingerprint'] != fingerprint:
+            raise HTTPException(
+                status_code=422,
+                detail="Idempotency-Key was already used with a different request")
+        self.replays += 1
+        return stored['response']
+
+    def _claim_in_db(self, endpoint, key, fingerprint):
+        now = datetime.now()
+        db_session = get_db_session()
+        try:
+            # Expired keys and abandoned claims can be reused
+            db_session.execute(
+                delete(IdempotencyKey)
+                .where(IdempotencyKey.endpoint == endpoint, IdempotencyKey.key == key)
+                .where(or_(
+                    IdempotencyKey.created_at < now -
+                    timedelta(seconds=self.ttl_seconds),
+                    and_(IdempotencyKey.response.is_(None),
+                         IdempotencyKey.created_at < now - timedelta(seconds=self.pending_timeout_seconds))
+                ))
+            )
+            claimed = db_session.execute(
+                pg_insert(IdempotencyKey)
+                .values(endpoint=endpoint, key=key, fingerprint=fingerprint, created_at=now)
+                .on_conflict_do_nothing()
+                .returning(IdempotencyKey.key)
+            ).scalar()
+            existing = None if claimed else db_session.query(IdempotencyKey).filter_by(
+                endpoint=endpoint, key=key).first()
+            db_session.commit()
+        except Exception:
+            db_session.rollback()
+            raise
+        finally:
+            db_session.close()
+
+        if existing is None:
+            return None
+        if existing.fingerprint != fingerprint:
+            raise HTTPException(
+                status_code=422,
+                detail="Idempotency-Key was already used with a different request")
+        if existing.response is None:
+            raise _in_progress()
+        return {'fingerprint': existing.fingerprint, 'response': existing.response}
+
+    def _db_write(self, statement):
+        db_session = get_db_session()
+        try:
+            db_session.execute(statement)
+            db_session.commit()
+        except Exception as e:
+            logging.error(f"Idempotency key update failed: {e}")
+            db_session.rollback()
+        finally:
+            db_session.close()
+
+
+def _in_progress():
+    return HTTPException(
+        status_code=409,
+        detail="A request with this Idempotency-Key is still in progress")
+
+
+def request_fingerprint(arguments):
+    """Stable hash of an endpoint's arguments (request models, path values, body)"""
+    payload = {}
+    for name, value in arguments.items():
+        if isinstance(value, BaseModel):
+            value = value.model_dump(mode='json')
+        payload[name] = value
+    encoded = json.dumps(payload, sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def _replayed(response):
+    return JSONResponse(content=response, headers={REPLAY_HEADER: 'true'})
+
+
+def _cacheable(result):
+    return isinstance(result, (dict, list))
+
+
+def idempotent(endpoint):
+    """
+    Decorator for write endpoints: adds an optional `Idempotency-Key` header
+    parameter and deduplicates requests that carry one. Place it below the
+    @router decorator.
+    """
+    signature = inspect.signature(endpoint)
+    key_parameter = inspect.Parameter(
+        'idempotency_key', inspect.Parameter.KEYWORD_ONLY,
+        default=Header(None, alias='Idempotency-Key'), annotation=Optional[str])
+    name = endpoint.__name__
+
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, idempotency_key=None, **kwargs):
+            if not idempotency_key:
+                return await endpoint(*args, **kwargs)
+            arguments = {}
+            for arg_name, value in kwargs.items():
+                if isinstance(value, Request):
+                    value = (await value.body()).decode('utf-8', 'replace')
+                arguments[arg_name] = value
+            fingerprint = request_fingerprint(arguments)
+            stored = await run_in_threadpool(
+                idempotency_store.begin, name, idempotency_key, fingerprint)
+            if stored is not None:
+                return _replayed(stored)
+            try:
+                result = await endpoint(*args, **kwargs)
+            except BaseException:
+                await run_in_threadpool(idempotency_store.abandon, name, idempotency_key)
+                raise
+            if not _cacheable(result):
+                await run_in_threadpool(idempotency_store.abandon, name, idempotency_key)
+                return result
+            result = jsonable_encoder(result)
+            await run_in_threadpool(
+                idempotency_store.complete, name, idempotency_key, fingerprint, result)
+            return result
+    else:
+        @functools.wraps(endpoint)
+        def wrapper(*args, idempotency_key=None, **kwargs):
+            if not idempotency_key:
+                return endpoint(*args, **kwargs)
+            fingerprint = request_fingerprint(kwargs)
+            stored = idempotency_store.begin(name, idempotency_key, fingerprint)
+            if stored is not None:
+                return _replayed(stored)
+            try:
+                result = endpoint(*args, **kwargs)
+            except BaseException:
+                idempotency_store.abandon(name, idempotency_key)
+                raise
+            if not _cacheable(result):
+                idempotency_store.abandon(name, idempotency_key)
+                return result
+            result = jsonable_encoder(result)
+            idempotency_store.complete(
+                name, idempotency_key, fingerprint, result)
+            return result
+
+    wrapper.__signature__ = signature.replace(
+        parameters=list(signature.parameters.values()) + [key_parameter])
+    return wrapper
+
+
+idempotency_store = IdempotencyStore(
+    max_entries=Config.IDEMPOTENCY_CACHE_MAX_ENTRIES,
+    ttl_seconds=Config.IDEMPOTENCY_TTL_SECONDS,
+    db_enabled=Config.IDEMPOTENCY_DB_ENABLED,
+    pending_timeout_seconds=Config.IDEMPOTENCY_PENDING_TIMEOUT_SECONDS
+)
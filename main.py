@@ -2,6 +2,10 @@
 from fastapi.middleware.cors import CORSMiddleware
 from database import Base, engine
 from router import router
+from write_buffer import get_write_buffer
+from event_log import get_replayer
+from analytics_rollups import get_compactor
+from retention import get_retention_job
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -21,6 +25,41 @@ app.add_middleware(
 # Create all tables
 Base.metadata.create_all(engine)
 
+@app.on_event("startup")
+def start_background_workers():
+    write_buffer = get_write_buffer()
+    if write_buffer:
+        write_buffer.start()
+    replayer = get_replayer()
+    if replayer:
+        replayer.start()
+    compactor = get_compactor()
+    if compactor:
+        compactor.start()
+    retention_job = get_retention_job()
+    if retention_job:
+        retention_job.start()
+
+
+@app.on_event("shutdown")
+def stop_background_workers():
+    write_buffer = get_write_buffer()
+    if write_buffer:
+        # Flush queued telemetry before the process exits
+        write_buffer.stop()
+    replayer = get_replayer()
+    if replayer:
+        # Segments left behind are replayed on the next start
+        replayer.stop()
+        replayer.event_log.close()
+    compactor = get_compactor()
+    if compactor:
+        compactor.stop()
+    retention_job = get_retention_job()
+    if retention_job:
+        # Stops after the batch in progress; the next run resumes
+        retention_job.stop()
+
 @app.get("/")
 def read_root():
     return {"message": "Welcome to Leads Management API (FastAPI version)"}
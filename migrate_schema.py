@@ -0,0 +1,80 @@
+"""
+Schema upgrades for existing databases
+Base.metadata.create_all() creates missing tables but never adds columns or
+indexes to tables that already exist. Run this once after upgrading:
+
+    python migrate_schema.py
+
+Every statement is idempotent, so it is safe to run repeatedly.
+"""
+
+from sqlalchemy import text
+from database import Base, engine
+import models  # noqa: F401  (registers all tables on Base.metadata)
+
+MIGRATIONS = [
+    # Open pages per session, used by page transitions and session-level exits
+    "CREATE INDEX IF NOT EXISTS ix_page_tracking_open_session "
+    "ON page_tracking (session_id) WHERE exit_time IS NULL",
+    # Journeys read in (session_id, entry_time) order
+    "CREATE INDEX IF NOT EXISTS ix_page_tracking_session_entry "
+    "ON page_tracking (session_id, entry_time)",
+    "CREATE INDEX IF NOT EXISTS ix_user_behaviors_action_created "
+    "ON user_behaviors (action, created_at)",
+    # Time indexes used by the analytics rollups
+    "CREATE INDEX IF NOT EXISTS ix_leads_created_at ON leads (created_at)",
+    "CREATE INDEX IF NOT EXISTS ix_leads_updated_at ON leads (updated_at)",
+    "CREATE INDEX IF NOT EXISTS ix_user_behaviors_created_at ON user_behaviors (created_at)",
+    "CREATE INDEX IF NOT EXISTS ix_page_tracking_entry_time ON page_tracking (entry_time)",
+    "CREATE INDEX IF NOT EXISTS ix_page_tracking_exit_time ON page_tracking (exit_time)",
+    "CREATE INDEX IF NOT EXISTS ix_session_exits_exit_time ON session_exits (exit_time)",
+    # Per-section CIF completion counters; NULL rows are recomputed on next save
+    "ALTER TABLE customer_information_forms "
+    "ADD COLUMN IF NOT EXISTS section_completion JSON",
+    # Answered-question bitmap per lead, backfilled from existing answers
+    "ALTER TABLE leads ADD COLUMN IF NOT EXISTS answered_mask BIGINT NOT NULL DEFAULT 0",
+    "UPDATE leads SET answered_mask = leads.answered_mask | answered.mask "
+    "FROM (SELECT session_id, bit_or(1::bigint << question_id) AS mask FROM answers "
+    "WHERE question_id BETWEEN 0 AND 62 GROUP BY session_id) AS answered "
+    "WHERE leads.session_id = answered.session_id "
+    "AND leads.answered_mask <> (leads.answered_mask | answered.mask)",
+    # Time-windowed analytics filters
+    "CREATE INDEX IF NOT EXISTS ix_leads_utm_source_created ON leads (utm_source, created_at)",
+    "CREATE INDEX IF NOT EXISTS ix_customer_information_forms_created_at "
+    "ON customer_information_forms (created_at)",
+    # First time a lead reached SQL; leads that were already SQL stay NULL
+    "ALTER TABLE leads ADD COLUMN IF NOT EXISTS sql_at TIMESTAMP",
+    # Distinct-session sketches on page rollups; rebuild rows that lack one
+    "ALTER TABLE analytics_page_rollups ADD COLUMN IF NOT EXISTS sessions_hll BYTEA",
+    "UPDATE rollup_watermarks SET last_id = 0 WHERE name = 'pages' AND last_id > 0 "
+    "AND EXISTS (SELECT 1 FROM analytics_page_rollups WHERE sessions_hll IS NULL)",
+    # Answer latency; earlier answers have no time_taken
+    "ALTER TABLE answers ADD COLUMN IF NOT EXISTS time_taken DOUBLE PRECISION",
+    "CREATE INDEX IF NOT EXISTS ix_answers_created_at ON answers (created_at)",
+    # Time-on-page digests on page rollups; rebuild rows that lack one
+    "ALTER TABLE analytics_page_rollups ADD COLUMN IF NOT EXISTS time_spent_digest BYTEA",
+    "UPDATE rollup_watermarks SET last_id = 0 WHERE name = 'pages' AND last_id > 0 "
+    "AND EXISTS (SELECT 1 FROM analytics_page_rollups "
+    "WHERE time_spent_digest IS NULL AND time_spent_count > 0)",
+    # High-water mark of the analytics result cache
+    "CREATE INDEX IF NOT EXISTS ix_customer_information_forms_updated_at "
+    "ON customer_information_forms (updated_at)",
+    # Server-side write time of page rows; existing rows are already rolled
+    # up, so they keep NULL rather than all looking changed
+    "ALTER TABLE page_tracking ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP",
+    "ALTER TABLE page_tracking ALTER COLUMN updated_at SET DEFAULT now()",
+    "CREATE INDEX IF NOT EXISTS ix_page_tracking_updated_at ON page_tracking (updated_at)",
+]
+
+
+def run_migrations():
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        for statement in MIGRATIONS:
+            print(f"Applying: {statement}")
+            connection.execute(text(statement))
+    print("Schema is up to date.")
+
+
+if __name__ == "__main__":
+    run_migrations()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, Float, Text, DateTime, Boolean, JSON
+from sqlalchemy import Index, Column, String, Integer, BigInteger, Float, Text, DateTime, Boolean, JSON, LargeBinary
 from sqlalchemy.sql import func
 from database import Base
 
@@ -18,8 +18,13 @@ class Answer(Base):
     session_id = Column(String, nullable=False)
     question_id = Column(Integer, nullable=False)
     answer_text = Column(Text, nullable=False)
+    time_taken = Column(Float, nullable=True)  # Seconds, as sent by the client
     created_at = Column(DateTime, default=func.now())
 
+    __table_args__ = (
+        Index('ix_answers_created_at', 'created_at'),
+    )
+
 
 class Lead(Base):
     __tablename__ = 'leads'
@@ -41,9 +46,22 @@ class Lead(Base):
     features_interested = Column(Text, nullable=True)  # JSON string
     # New: CIF completion status
     cif_completed = Column(Boolean, default=False)
+    # Bit n is set once question n has been answered (see workflow_index)
+    answered_mask = Column(BigInteger, nullable=False,
+                           default=0, server_default='0')
+    # When the lead first reached SQL (time-to-SQL in cohort analytics)
+    sql_at = Column(DateTime, nullable=True)
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
 
+    __table_args__ = (
+        # Hour buckets and changed-since scans of the analytics rollups
+        Index('ix_leads_created_at', 'created_at'),
+        Index('ix_leads_updated_at', 'updated_at'),
+        # utm_source-filtered analytics windows
+        Index('ix_leads_utm_source_created', 'utm_source', 'created_at'),
+    )
+
 
 class UserBehavior(Base):
     __tablename__ = 'user_behaviors'
@@ -55,6 +73,12 @@ class UserBehavior(Base):
     behavior_metadata = Column(Text, nullable=True)  # JSON string
     created_at = Column(DateTime, default=func.now())
 
+    __table_args__ = (
+        # Counting one action (e.g. conversions), optionally over a time range
+        Index('ix_user_behaviors_action_created', 'action', 'created_at'),
+        Index('ix_user_behaviors_created_at', 'created_at'),
+    )
+
 
 # New: Customer Information Form
 class CustomerInformationForm(Base):
@@ -64,11 +88,28 @@ class CustomerInformationForm(Base):
     customer_id = Column(String(50), nullable=False, unique=True)
     session_id = Column(String, nullable=False)
     form_data = Column(JSON, nullable=True)  # Complete CIF data
+    # Completed required fields per section, e.g. {"basic_info": 2}
+    section_completion = Column(JSON, nullable=True)
     completed_at = Column(DateTime, nullable=True)
     completion_percentage = Column(Float, default=0.0)
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
 
+    __table_args__ = (
+        # Time-windowed CIF completion analytics
+        Index('ix_customer_information_forms_created_at', 'created_at'),
+        # High-water mark of the analytics result cache
+        Index('ix_customer_information_forms_updated_at', 'updated_at'),
+    )
+
+
+# New: Per-day customer ID counter, handed out to workers in blocks
+class CustomerIdCounter(Base):
+    __tablename__ = 'customer_id_counters'
+
+    day = Column(String(8), primary_key=True)  # YYYYMMDD
+    last_value = Column(Integer, nullable=False, default=0)
+
 
 # New: Page-by-page tracking
 class PageTracking(Base):
@@ -86,6 +127,20 @@ class PageTracking(Base):
     page_type = Column(String(50), nullable=True)
     # Additional tracking data (renamed from metadata)
     page_metadata = Column(JSON, nullable=True)
+    # Server-side write time; exit_time may come from the client
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        # Small index over open pages only, used to close a session's current page
+        Index('ix_page_tracking_open_session', 'session_id',
+              postgresql_where=exit_time.is_(None)),
+        # Ordered journey scans and keyset pagination by session
+        Index('ix_page_tracking_session_entry', 'session_id', 'entry_time'),
+        Index('ix_page_tracking_entry_time', 'entry_time'),
+        Index('ix_page_tracking_exit_time', 'exit_time'),
+        # Rows written since the rollup compactor's last run
+        Index('ix_page_tracking_updated_at', 'updated_at'),
+    )
 
 
 # New: Session exit tracking
@@ -103,3 +158,132 @@ class SessionExit(Base):
     session_completion_percentage = Column(Float, nullable=True)
     last_action = Column(String(100), nullable=True)
     exit_metadata = Column(JSON, nullable=True)  # Renamed from metadata
+
+    __table_args__ = (
+        Index('ix_session_exits_exit_time', 'exit_time'),
+    )
+
+
+# New: Replay position of the local append-only event log
+class EventLogOffset(Base):
+    __tablename__ = 'event_log_offsets'
+
+    name = Column(String(100), primary_key=True)  # EVENT_LOG_DIR name/worker slot
+    segment = Column(Integer, nullable=False, default=0)
+    position = Column(BigInteger, nullable=False, default=0)  # byte offset
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+
+# New: Idempotency keys of write requests (used when IDEMPOTENCY_DB_ENABLED)
+class IdempotencyKey(Base):
+    __tablename__ = 'idempotency_keys'
+
+    endpoint = Column(String(100), primary_key=True)
+    key = Column(String(255), primary_key=True)
+    fingerprint = Column(String(64), nullable=False)  # sha256 of the request
+    response = Column(JSON, nullable=True)  # NULL while the first request runs
+    created_at = Column(DateTime, default=func.now())
+
+
+# New: Hourly analytics rollups, recomputed per bucket by analytics_rollups.py.
+# utm_source is the lead's UTM source at the time of the rollup.
+class LeadRollup(Base):
+    __tablename__ = 'analytics_lead_rollups'
+
+    id = Column(Integer, primary_key=True)
+    bucket = Column(DateTime, nullable=False, index=True)  # hour of created_at
+    utm_source = Column(String, nullable=True)
+    lead_type = Column(String, nullable=True)
+    leads = Column(Integer, nullable=False, default=0)
+    score_sum = Column(Float, nullable=False, default=0.0)
+    # Leads that answered every required question
+    completed = Column(Integer, nullable=False, default=0)
+
+
+class BehaviorRollup(Base):
+    __tablename__ = 'analytics_behavior_rollups'
+
+    id = Column(Integer, primary_key=True)
+    bucket = Column(DateTime, nullable=False, index=True)  # hour of created_at
+    utm_source = Column(String, nullable=True)
+    action = Column(String, nullable=False)
+    events = Column(Integer, nullable=False, default=0)
+    score_sum = Column(Float, nullable=False, default=0.0)
+
+
+class PageRollup(Base):
+    __tablename__ = 'analytics_page_rollups'
+
+    id = Column(Integer, primary_key=True)
+    bucket = Column(DateTime, nullable=False, index=True)  # hour of entry_time
+    utm_source = Column(String, nullable=True)
+    page_identifier = Column(String(100), nullable=False)
+    views = Column(Integer, nullable=False, default=0)
+    time_spent_sum = Column(BigInteger, nullable=False, default=0)
+    time_spent_count = Column(Integer, nullable=False, default=0)
+    # HyperLogLog of distinct session ids (sketches.HyperLogLog.to_bytes)
+    sessions_hll = Column(LargeBinary, nullable=True, info={'after_rebuild': True})
+    # TDigest of time_spent (sketches.TDigest.to_bytes)
+    time_spent_digest = Column(LargeBinary, nullable=True, info={'after_rebuild': True})
+
+
+class ExitRollup(Base):
+    __tablename__ = 'analytics_exit_rollups'
+
+    id = Column(Integer, primary_key=True)
+    bucket = Column(DateTime, nullable=False, index=True)  # hour of exit_time
+    utm_source = Column(String, nullable=True)
+    exit_reason = Column(String(50), nullable=True)
+    exit_question_id = Column(Integer, nullable=True)
+    exit_page = Column(String(100), nullable=True)
+    exits = Column(Integer, nullable=False, default=0)
+    completion_sum = Column(Float, nullable=False, default=0.0)
+    completion_count = Column(Integer, nullable=False, default=0)
+
+
+class AnswerRollup(Base):
+    __tablename__ = 'analytics_answer_rollups'
+
+    id = Column(Integer, primary_key=True)
+    bucket = Column(DateTime, nullable=False, index=True)  # hour of created_at
+    utm_source = Column(String, nullable=True)
+    question_id = Column(Integer, nullable=False)
+    answers = Column(Integer, nullable=False, default=0)
+    time_taken_sum = Column(Float, nullable=False, default=0.0)
+    time_taken_count = Column(Integer, nullable=False, default=0)
+    # TDigest of time_taken (sketches.TDigest.to_bytes)
+    time_taken_digest = Column(LargeBinary, nullable=True, info={'after_rebuild': True})
+
+
+# Daily unions of the hourly sketches above, so reading a long range merges
+# one sketch per day instead of one per hour
+class PageDailySketch(Base):
+    __tablename__ = 'analytics_page_daily_sketches'
+
+    id = Column(Integer, primary_key=True)
+    day = Column(DateTime, nullable=False, index=True)
+    utm_source = Column(String, nullable=True)
+    page_identifier = Column(String(100), nullable=False)
+    sessions_hll = Column(LargeBinary, nullable=True)
+    time_spent_digest = Column(LargeBinary, nullable=True)
+
+
+class AnswerDailySketch(Base):
+    __tablename__ = 'analytics_answer_daily_sketches'
+
+    id = Column(Integer, primary_key=True)
+    day = Column(DateTime, nullable=False, index=True)
+    utm_source = Column(String, nullable=True)
+    question_id = Column(Integer, nullable=False)
+    time_taken_digest = Column(LargeBinary, nullable=True)
+
+
+# New: How far each rollup has read its source table
+class RollupWatermark(Base):
+    __tablename__ = 'rollup_watermarks'
+
+    name = Column(String(100), primary_key=True)
+    last_id = Column(BigInteger, nullable=False, default=0)
+    # Rows changed at or after this time (minus a safety margin) are re-read
+    last_time = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
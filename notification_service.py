@@ -177,23 +177,28 @@ class NotificationService:
         try:
             from database import get_db_session
             from models import UserBehavior
+            from write_buffer import get_write_buffer
 
-            db_session = get_db_session()
-
-            notification_log = UserBehavior(
-                session_id=lead_data.get('session_id'),
-                action='notification_sent',
-                behavior_metadata=json.dumps({
+            notification_row = {
+                'session_id': lead_data.get('session_id'),
+                'action': 'notification_sent',
+                'score_change': 0.0,
+                'behavior_metadata': json.dumps({
                     'lead_score': lead_data.get('lead_score'),
                     'lead_type': lead_data.get('lead_type'),
                     'notification_time': datetime.now().isoformat()
                 }),
-                created_at=datetime.now()
-            )
+                'created_at': datetime.now()
+            }
 
-            db_session.add(notification_log)
-            db_session.commit()
-            db_session.close()
+            write_buffer = get_write_buffer()
+            if write_buffer:
+                write_buffer.enqueue(UserBehavior, notification_row)
+            else:
+                db_session = get_db_session()
+                db_session.add(UserBehavior(**notification_row))
+                db_session.commit()
+                db_session.close()
 
             print(
                 f"📝 Notification logged for session: {lead_data.get('session_id')}")
@@ -0,0 +1,248 @@
+"""
+Analytics retention
+Deletes user_behaviors, page_tracking and session_exits rows older than
+ANALYTICS_RETENTION_DAYS. Rows go in batches of ANALYTICS_RETENTION_BATCH_ROWS,
+each in its own short transaction:
+
+    DELETE FROM t WHERE id IN (SELECT id FROM t WHERE <time> < cutoff
+                               ORDER BY id LIMIT n)
+
+so locks are held briefly and autovacuum can keep up between batches. The
+job keeps no state of its own: an interrupted run simply resumes with the
+rows that are still past the cutoff. Every worker process runs the job, but
+a run holds a Postgres advisory lock, so only one process purges at a time
+and the others skip that run.
+
+The cutoff is rounded down to the hour so whole rollup buckets expire
+together; analytics_rollups keeps the aggregates of deleted hours and never
+rebuilds an hour before the cutoff once it has been rolled up.
+
+Run once from the command line with:
+
+    python retention.py [days]
+"""
+
+import logging
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from sqlalchemy import select, delete, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from database import get_db_session, engine
+from models import UserBehavior, PageTracking, SessionExit, RollupWatermark
+from config import Config
+
+# (table, column rows expire by)
+RETAINED_TABLES = (
+    (UserBehavior, UserBehavior.created_at),
+    (PageTracking, PageTracking.entry_time),
+    (SessionExit, SessionExit.exit_time),
+)
+
+# pg_advisory_lock key serializing runs across worker processes
+RETENTION_LOCK_KEY = 0x5245544e  # 'RETN'
+
+# rollup_watermarks row stamped after every purge that deleted rows; deletes
+# do not move a table's high-water mark, so analytics_cache watches this
+RETENTION_WATERMARK = 'retention'
+
+
+def cutoff_from(now, days):
+    """Start of the hour `days` before now"""
+    return (now - timedelta(days=days)).replace(minute=0, second=0, microsecond=0)
+
+
+def retention_cutoff(days):
+    """Start of the hour `days` ago, in database time"""
+    db_session = get_db_session()
+    try:
+        now = db_session.execute(select(func.localtimestamp())).scalar()
+    finally:
+        db_session.close()
+    return cutoff_from(now, days)
+
+
+@contextmanager
+def retention_lock():
+    """
+    Hold the retention advisory lock for the duration of the block. Yields
+    False, without waiting, when another process holds it.
+    """
+    with engine.connect() as connection:
+        acquired = connection.execute(
+            select(func.pg_try_advisory_lock(RETENTION_LOCK_KEY))).scalar()
+        connection.commit()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                connection.execute(select(func.pg_advisory_unlock(RETENTION_LOCK_KEY)))
+                connection.commit()
+
+
+def purge_table(model, time_column, cutoff, batch_rows, pause_seconds=0.0, should_stop=None):
+    """Delete rows with time_column < cutoff in batches; returns rows deleted"""
+    expired = select(model.id).where(time_column < cutoff).order_by(
+        model.id).limit(batch_rows).scalar_subquery()
+    deleted = 0
+    while not (should_stop and should_stop()):
+        db_session = get_db_session()
+        try:
+            rows = db_session.execute(
+                delete(model).where(model.id.in_(expired))
+                .execution_options(synchronize_session=False)).rowcount
+            db_session.commit()
+        except Exception:
+            db_session.rollback()
+            raise
+        finally:
+            db_session.close()
+        deleted += rows
+        if rows < batch_rows:
+            break
+        if pause_seconds:
+            time.sleep(pause_seconds)
+    return deleted
+
+
+def record_purge(rows):
+    """Stamp the retention watermark with the time and running total of rows deleted"""
+    db_session = get_db_session()
+    try:
+        db_session.execute(
+            pg_insert(RollupWatermark)
+            .values(name=RETENTION_WATERMARK, last_id=rows, last_time=func.localtimestamp())
+            .on_conflict_do_update(
+                index_elements=[RollupWatermark.name],
+                set_={'last_id': RollupWatermark.last_id + rows,
+                      'last_time': func.localtimestamp()}))
+        db_session.commit()
+    except Exception:
+        db_session.rollback()
+        raise
+    finally:
+        db_session.close()
+
+
+class RetentionJob:
+    """Background thread that enforces ANALYTICS_RETENTION_DAYS periodically"""
+
+    def __init__(self, days, interval_seconds, batch_rows, pause_seconds=0.0,
+                 lock=retention_lock):
+        self.days = days
+        self.interval = interval_seconds
+        self.batch_rows = batch_rows
+        self.pause_seconds = pause_seconds
+        self._lock = lock
+        self._stopping = threading.Event()
+        self._thread = None
+        self.runs = 0
+        self.skipped_runs = 0
+        self.rows_deleted = 0
+        self.last_run = None
+        self.last_error = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self._run, name='analytics-retention', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def run_once(self):
+        """
+        Purge every retained table once. Returns a report with the cutoff,
+        rows deleted per table and the duration, or None when another
+        process is already purging.
+        """
+        with self._lock() as acquired:
+            if not acquired:
+                self.skipped_runs += 1
+                logging.info("Analytics retention: another process is purging, skipped")
+                return None
+            return self._purge()
+
+    def _purge(self):
+        started = time.perf_counter()
+        cutoff = retention_cutoff(self.days)
+        deleted = {}
+        for model, time_column in RETAINED_TABLES:
+            try:
+                deleted[model.__tablename__] = purge_table(
+                    model, time_column, cutoff, self.batch_rows,
+                    self.pause_seconds, self._stopping.is_set)
+            except Exception as e:
+                self.last_error = f"{model.__tablename__}: {e}"
+                logging.error(
+                    f"Retention purge of {model.__tablename__} failed: {e}")
+        if any(deleted.values()):
+            record_purge(sum(deleted.values()))
+        report = {
+            'cutoff': cutoff.isoformat(),
+            'rows_deleted': deleted,
+            'duration_ms': (time.perf_counter() - started) * 1000.0
+        }
+        self.runs += 1
+        self.rows_deleted += sum(deleted.values())
+        self.last_run = report
+        logging.info(f"Analytics retention: {report}")
+        return report
+
+    def stats(self):
+        return {
+            'retention_days': self.days,
+            'interval_seconds': self.interval,
+            'runs': self.runs,
+            'skipped_runs': self.skipped_runs,
+            'rows_deleted': self.rows_deleted,
+            'last_run': self.last_run,
+            'last_error': self.last_error
+        }
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                self.last_error = str(e)
+                logging.error(f"Analytics retention failed: {e}")
+            self._stopping.wait(self.interval)
+
+
+_retention_job = None
+_init_lock = threading.Lock()
+
+
+def get_retention_job():
+    """Return the process's retention job when ANALYTICS_RETENTION_ENABLED, else None"""
+    global _retention_job
+    if not Config.ANALYTICS_RETENTION_ENABLED:
+        return None
+    with _init_lock:
+        if _retention_job is None:
+            _retention_job = RetentionJob(
+                Config.ANALYTICS_RETENTION_DAYS,
+                Config.ANALYTICS_RETENTION_INTERVAL_SECONDS,
+                Config.ANALYTICS_RETENTION_BATCH_ROWS,
+                Config.ANALYTICS_RETENTION_BATCH_PAUSE_MS / 1000.0)
+        return _retention_job
+
+
+if __name__ == "__main__":
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else Config.ANALYTICS_RETENTION_DAYS
+    report = RetentionJob(days, 0, Config.ANALYTICS_RETENTION_BATCH_ROWS,
+                          Config.ANALYTICS_RETENTION_BATCH_PAUSE_MS / 1000.0).run_once()
+    if report is None:
+        sys.exit("Another process is purging; try again later")
+    print(f"Deleted rows older than {report['cutoff']} in {report['duration_ms']:.0f} ms")
+    for table, rows in report['rows_deleted'].items():
+        print(f"{table}: {rows}")
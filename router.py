@@ -1,11 +1,26 @@
 from fastapi import Body
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError, model_validator
+from typing import Optional, Literal
+from datetime import datetime
 from services import (QuestionService, AnswerService, ScoringService, LeadService,
-                      CustomerService, PageTrackingService, CIFService, SessionExitService, ConditionalResponseService)
+                      CustomerService, PageTrackingService, CIFService, SessionExitService, ConditionalResponseService,
+                      EventBatchService, AnalyticsService, lead_summary_cache)
 from notification_service import NotificationService
 from ab_testing_service import ABTestingService
+from write_buffer import get_write_buffer, id_allocator
+from event_log import get_event_log, get_replayer, append_events
+from idempotency import idempotent, idempotency_store
+from workflow_index import get_workflow
+from static_responses import static_json_response
+from analytics_rollups import get_compactor
+from analytics_filters import AnalyticsFilter
+from retention import get_retention_job
+from analytics_cache import analytics_cache
+from export_leads import export_chunks, FORMATS as EXPORT_FORMATS
+from models import PageTracking
 from config import Config
 import uuid
 import json
@@ -19,6 +34,11 @@ class SessionStartRequest(BaseModel):
     utm_source: str = "direct"
 
 
+class BulkSessionStartRequest(BaseModel):
+    count: int
+    utm_source: str = "direct"
+
+
 class LogAnswerRequest(BaseModel):
     session_id: str
     question_id: int
@@ -29,6 +49,7 @@ class LogAnswerRequest(BaseModel):
 class SkipQuestionRequest(BaseModel):
     session_id: str
     skip_reason: str = "user_skipped"
+    question_id: Optional[int] = None
 
 
 class LogBehaviorRequest(BaseModel):
@@ -116,6 +137,72 @@ class SessionExitRequest(BaseModel):
     last_action: Optional[str] = None
     metadata: Optional[dict] = None
 
+
+# New: Batched Event Models
+class BatchEvent(BaseModel):
+    type: Literal['behavior', 'page_entry', 'page_exit', 'session_exit']
+    session_id: Optional[str] = None
+    timestamp: Optional[datetime] = None
+    metadata: Optional[dict] = None
+    # behavior
+    action: Optional[str] = None
+    # page_entry / page_exit
+    page_identifier: Optional[str] = None
+    question_id: Optional[int] = None
+    page_type: Optional[str] = None
+    page_tracking_id: Optional[int] = None
+    # session_exit
+    exit_reason: str = "abandoned"
+    exit_question_id: Optional[int] = None
+    exit_page: Optional[str] = None
+    last_action: Optional[str] = None
+
+    @model_validator(mode='after')
+    def check_required_fields(self):
+        required = {
+            'behavior': ['session_id', 'action'],
+            'page_entry': ['session_id', 'page_identifier'],
+            'page_exit': [],
+            'session_exit': ['session_id'],
+        }[self.type]
+        missing = [field for field in required if not getattr(self, field)]
+        if missing:
+            raise ValueError(
+                f"{self.type} event missing required fields: {', '.join(missing)}")
+        if self.type == 'page_exit' and not (self.page_tracking_id or self.session_id):
+            raise ValueError(
+                "page_exit event requires page_tracking_id or session_id")
+        return self
+
+
+class EventBatchRequest(BaseModel):
+    events: list[BatchEvent]
+
+
+
+def _log_events_durably(events):
+    """
+    Append events to the local event log when it is enabled, giving page
+    entries page_tracking ids from the replayer's reserve so clients can
+    still reference them. Returns one page_tracking id per page_entry, or
+    None if the events were not logged and must be written to the database
+    directly (including when no reserved id is left).
+    """
+    if not get_event_log():
+        return None
+    page_tracking_ids = []
+    for event in events:
+        if event['type'] == 'page_entry' and event.get('page_tracking_id') is None:
+            event['page_tracking_id'] = id_allocator.take(PageTracking)
+            if event['page_tracking_id'] is None:
+                print("No reserved page_tracking ids left, writing events directly")
+                return None
+        if event['type'] == 'page_entry':
+            page_tracking_ids.append(event['page_tracking_id'])
+    if not append_events(events):
+        return None
+    return page_tracking_ids
+
 # API Endpoints
 # ...existing code...
 
@@ -126,38 +213,18 @@ def get_next_question(request: NextQuestionRequest):
     Returns the next unanswered question for the session after the given last_question_id.
     If all required questions are answered, returns None.
     """
-    from database import get_db_session
-    from models import Answer
-    db_session = get_db_session()
     try:
-        # Get all questions ordered
-        questions = QuestionService.get_questions()
-        questions_sorted = sorted(
-            questions, key=lambda q: q.get('order_index', q['id']))
-
-        # Get answered question IDs for this session
-        answered = db_session.query(Answer.question_id).filter_by(
-            session_id=request.session_id).distinct().all()
-        answered_ids = set(row[0] for row in answered)
-
-        # Find next unanswered required question after last_question_id
-        found_last = False
-        for q in questions_sorted:
-            if not found_last:
-                if q['id'] == request.last_question_id:
-                    found_last = True
-                continue
-            if q.get('required', True) and q['id'] not in answered_ids:
-                return q
-        # If none left, return None
-        return None
+        answered_mask = LeadService.get_answered_mask(request.session_id)
+
+        # Next unanswered required question after last_question_id, or None
+        return QuestionService.get_next_required_question(
+            request.last_question_id, answered_mask)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        db_session.close()
 
 
 @router.post("/api/session/start", tags=["Session & Question Flow"])
+@idempotent
 def start_session(request: SessionStartRequest):
     session_id = str(uuid.uuid4())
     success = LeadService.create_lead(session_id, request.utm_source)
@@ -166,13 +233,28 @@ def start_session(request: SessionStartRequest):
     raise HTTPException(status_code=400, detail="Failed to start session")
 
 
+@router.post("/api/session/start-bulk", tags=["Session & Question Flow"])
+@idempotent
+def start_sessions_bulk(request: BulkSessionStartRequest):
+    """Pre-provision sessions (e.g. for embedded widgets) in one transaction"""
+    if request.count < 1 or request.count > Config.SESSION_BULK_MAX:
+        raise HTTPException(
+            status_code=400,
+            detail=f"count must be between 1 and {Config.SESSION_BULK_MAX}")
+    session_ids = [str(uuid.uuid4()) for _ in range(request.count)]
+    if LeadService.create_leads_bulk(session_ids, request.utm_source):
+        return {"session_ids": session_ids, "message": "Sessions started successfully"}
+    raise HTTPException(status_code=400, detail="Failed to start sessions")
+
+
 @router.get("/api/questions", tags=["Session & Question Flow"])
-def get_questions():
-    questions = QuestionService.get_questions()
-    return questions
+def get_questions(request: Request):
+    return static_json_response(
+        request, 'questions', lambda workflow: workflow.questions)
 
 
 @router.post("/api/answer", tags=["Session & Question Flow"])
+@idempotent
 def log_answer(request: LogAnswerRequest):
     if not all([request.session_id, request.question_id, request.answer_text]):
         raise HTTPException(status_code=400, detail="Missing required fields")
@@ -184,6 +266,7 @@ def log_answer(request: LogAnswerRequest):
 
 
 @router.post("/api/answer-with-conditional", tags=["Session & Question Flow"])
+@idempotent
 def log_answer_with_conditional(request: LogAnswerRequest):
     """
     Log answer and handle conditional responses based on question type and answer.
@@ -200,7 +283,7 @@ def log_answer_with_conditional(request: LogAnswerRequest):
         raise HTTPException(status_code=400, detail="Failed to log answer")
 
     # Handle conditional logic based on question
-    if request.question_id == 1:  # Greeting question
+    if request.question_id == get_workflow().greeting_question_id:
         conditional_response = ConditionalResponseService.handle_greeting_response(
             request.session_id, request.answer_text)
         return {
@@ -214,6 +297,7 @@ def log_answer_with_conditional(request: LogAnswerRequest):
 
 
 @router.post("/api/skip-question", tags=["Session & Question Flow"])
+@idempotent
 def skip_question(request: SkipQuestionRequest):
     """
     Allow users to skip questions without penalty.
@@ -222,33 +306,44 @@ def skip_question(request: SkipQuestionRequest):
         raise HTTPException(status_code=400, detail="Missing session_id")
 
     # Log the skip as a behavior for tracking
+    metadata = {"reason": request.skip_reason}
+    if request.question_id is not None:
+        metadata["question_id"] = request.question_id
     score_change = ScoringService.log_behavior(
-        request.session_id, "question_skipped", {"reason": request.skip_reason})
+        request.session_id, "question_skipped", metadata)
+    if score_change is None:
+        raise HTTPException(status_code=400, detail="Failed to skip question")
 
     return {"message": "Question skipped successfully", "score_change": score_change}
 
 
 @router.post("/api/behavior", tags=["User Actions & Behaviors"])
+@idempotent
 def log_behavior(request: LogBehaviorRequest):
     if not all([request.session_id, request.action]):
         raise HTTPException(status_code=400, detail="Missing required fields")
+    if _log_events_durably([{"type": "behavior", "session_id": request.session_id,
+                             "action": request.action, "metadata": request.metadata}]) is not None:
+        score_change = ScoringService.get_scoring_map().get(request.action, 0)
+        return {"message": "Behavior logged successfully", "score_change": score_change}
     score_change = ScoringService.log_behavior(
         request.session_id, request.action, request.metadata)
+    if score_change is None:
+        raise HTTPException(status_code=400, detail="Failed to log behavior")
     return {"message": "Behavior logged successfully", "score_change": score_change}
 
 
 @router.get("/api/behavior/actions", tags=["User Actions & Behaviors"])
-def get_valid_actions():
+def get_valid_actions(request: Request):
     """
     Returns all valid user actions that can be logged via /api/behavior.
     """
-    from workflow_config import WORKFLOW_CONFIG
-    scoring_map = WORKFLOW_CONFIG.get('scoring', {})
-    actions = [action for action in scoring_map.keys()]
-    return {"actions": actions}
+    return static_json_response(
+        request, 'behavior_actions', lambda workflow: {"actions": workflow.scoring_actions})
 
 
 @router.post("/api/lead/profile", tags=["Lead Profile & Data"])
+@idempotent
 def update_lead_profile(request: LeadProfileRequest):
     if not request.session_id:
         raise HTTPException(status_code=400, detail="Missing session_id")
@@ -268,6 +363,7 @@ def update_lead_profile(request: LeadProfileRequest):
 
 
 @router.post("/api/lead/sync-odoo", tags=["CRM Integration"])
+@idempotent
 def sync_lead_to_odoo(request: OdooSyncRequest):
     from services import OdooSyncService
     odoo_id = OdooSyncService.sync_lead(request.session_id)
@@ -296,89 +392,60 @@ def get_current_score(session_id: str):
 
 
 @router.get("/api/product-menu", tags=["Product & CTA Options"])
-def get_product_menu():
-    from workflow_config import WORKFLOW_CONFIG
-    return WORKFLOW_CONFIG['product_menu']
+def get_product_menu(request: Request):
+    return static_json_response(
+        request, 'product_menu', lambda workflow: workflow.product_menu)
 
 
 @router.get("/api/cta-options", tags=["Product & CTA Options"])
-def get_cta_options():
-    from workflow_config import WORKFLOW_CONFIG
-    return WORKFLOW_CONFIG['cta_options']
+def get_cta_options(request: Request):
+    return static_json_response(
+        request, 'cta_options', lambda workflow: workflow.cta_options)
 
 
 @router.get("/api/lead/export/{session_id}", tags=["Lead Profile & Data"])
 def export_lead_data(session_id: str):
     summary = LeadService.get_lead_summary(session_id)
     if summary:
-        crm_data = {
-            "name": summary.get('name', 'Unknown'),
-            "location": summary.get('location', ''),
-            "business_type": summary.get('business_type', ''),
-            "staff_size": summary.get('staff_size', ''),
-            "monthly_sales": summary.get('monthly_sales', ''),
-            "features_interested": summary.get('features_interested', []),
-            "contact_info": summary.get('phone', summary.get('email', '')),
-            "email": summary.get('email', ''),
-            "phone": summary.get('phone', ''),
-            "lead_score": summary.get('lead_score', 0),
-            "lead_type": summary.get('lead_type', 'Unqualified'),
-            "utm_source": summary.get('utm_source', 'direct'),
-            "session_start_time": summary.get('created_at', ''),
-            "assigned_to": "CTL-Team"
-        }
-        return crm_data
+        return LeadService.to_crm_record(summary)
     raise HTTPException(status_code=404, detail="Lead not found")
 
 
+def analytics_filters(
+        start: Optional[datetime] = Query(None, alias="from"),
+        end: Optional[datetime] = Query(None, alias="to"),
+        window: Optional[Literal["24h", "7d", "30d"]] = None,
+        utm_source: Optional[str] = None):
+    """Time range (`from`/`to`, or a `window` ending now) and UTM filter for analytics"""
+    try:
+        return AnalyticsFilter.from_params(start, end, window, utm_source)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @router.get("/api/analytics/leads", tags=["Analytics & Reporting"])
-def get_leads_analytics():
+def get_leads_analytics(filters: AnalyticsFilter = Depends(analytics_filters)):
     try:
-        from database import get_db_session
-        from models import Lead, UserBehavior
-        db_session = get_db_session()
-        leads = db_session.query(Lead).all()
-        total_leads = len(leads)
-        sql_leads = len([l for l in leads if l.lead_type == 'SQL'])
-        mql_leads = len([l for l in leads if l.lead_type == 'MQL'])
-        unqualified_leads = len(
-            [l for l in leads if l.lead_type == 'Unqualified'])
-        average_score = sum([l.lead_score or 0 for l in leads]
-                            ) / total_leads if total_leads else 0
-
-        # Conversion rate: count of 'ab_test_conversion' actions
-        conversions = db_session.query(UserBehavior).filter(
-            UserBehavior.action == 'ab_test_conversion').count()
-        conversion_rate = (conversions / total_leads *
-                           100) if total_leads else 0
-
-        # Completion rate: leads who answered all required questions
-        completed = 0
-        for lead in leads:
-            from services import LeadService
-            try:
-                if LeadService.check_all_questions_answered(lead.session_id):
-                    completed += 1
-            except Exception as e:
-                print(
-                    f"Error checking questions for lead {lead.session_id}: {e}")
-        completion_rate = (completed / total_leads * 100) if total_leads else 0
-
-        analytics = {
-            "total_leads": total_leads,
-            "sql_leads": sql_leads,
-            "mql_leads": mql_leads,
-            "unqualified_leads": unqualified_leads,
-            "conversion_rate": round(conversion_rate, 2),
-            "average_score": round(average_score, 2),
-            "completion_rate": round(completion_rate, 2)
-        }
-        db_session.close()
-        return analytics
+        return AnalyticsService.get_leads_analytics(filters)
     except Exception as e:
         print(f"Error in analytics endpoint: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+
+@router.get("/api/lead/export", tags=["CRM Integration"])
+def export_leads_bulk(format: Literal["csv", "ndjson"] = "csv",
+                      lead_type: Optional[Literal["Unqualified", "MQL", "SQL"]] = None,
+                      filters: AnalyticsFilter = Depends(analytics_filters)):
+    """
+    Stream the CRM record (as /api/lead/export/{session_id}) of every lead
+    created in the `from`/`to`/`window` range, optionally by utm_source and
+    lead_type, as CSV or NDJSON in lead id order.
+    """
+    return StreamingResponse(
+        export_chunks(format, filters, lead_type),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="leads.{format}"'})
+
 # ...add other endpoints as needed...
 
 # A/B Testing Endpoints
@@ -391,6 +458,7 @@ def get_ab_test_variant(request: ABTestVariantRequest):
 
 
 @router.post("/api/ab-test/conversion", tags=["A/B Testing"])
+@idempotent
 def log_ab_test_conversion(request: ABTestConversionRequest):
     success = ABTestingService.log_conversion(
         request.session_id, request.test_name, request.variant, request.conversion_type, request.conversion_value)
@@ -402,6 +470,7 @@ def log_ab_test_conversion(request: ABTestConversionRequest):
 
 
 @router.post("/api/lead/notify", tags=["Notifications"])
+@idempotent
 def notify_lead(request: LeadNotificationRequest):
     summary = LeadService.get_lead_summary(request.session_id)
     if not summary:
@@ -454,7 +523,18 @@ class PageExitRequest(BaseModel):
 
 
 @router.post("/api/tracking/page-entry", tags=["Page Tracking"])
+@idempotent
 def log_page_entry(request: PageEntryRequest):
+    logged_ids = _log_events_durably([{
+        "type": "page_entry",
+        "session_id": request.session_id,
+        "page_identifier": request.page_identifier,
+        "question_id": request.question_id,
+        "page_type": request.page_type,
+        "metadata": request.metadata
+    }])
+    if logged_ids is not None:
+        return {"page_tracking_id": logged_ids[0]}
     page_tracking_id = PageTrackingService.log_page_entry(
         request.session_id,
         request.page_identifier,
@@ -467,8 +547,52 @@ def log_page_entry(request: PageEntryRequest):
     raise HTTPException(status_code=400, detail="Failed to log page entry")
 
 
+class PageTransitionRequest(BaseModel):
+    session_id: str
+    page_identifier: str
+    question_id: Optional[int] = None
+    page_type: Optional[str] = None
+    metadata: Optional[dict] = None
+
+
+@router.post("/api/tracking/page-transition", tags=["Page Tracking"])
+@idempotent
+def log_page_transition(request: PageTransitionRequest):
+    """
+    Close the session's current page and open the next one atomically.
+    The server finds the open page, so no page_tracking_id is needed.
+    """
+    logged_ids = _log_events_durably([
+        {"type": "page_exit", "session_id": request.session_id},
+        {
+            "type": "page_entry",
+            "session_id": request.session_id,
+            "page_identifier": request.page_identifier,
+            "question_id": request.question_id,
+            "page_type": request.page_type,
+            "metadata": request.metadata
+        }
+    ])
+    if logged_ids is not None:
+        return {"page_tracking_id": logged_ids[0], "closed_pages": []}
+    result = PageTrackingService.log_page_transition(
+        request.session_id,
+        request.page_identifier,
+        request.question_id,
+        request.page_type,
+        request.metadata
+    )
+    if result:
+        return result
+    raise HTTPException(status_code=400, detail="Failed to log page transition")
+
+
 @router.post("/api/tracking/page-exit", tags=["Page Tracking"])
+@idempotent
 def log_page_exit(request: PageExitRequest):
+    if _log_events_durably([{"type": "page_exit",
+                             "page_tracking_id": request.page_tracking_id}]) is not None:
+        return {"success": True}
     success = PageTrackingService.log_page_exit(
         request.page_tracking_id,
         None  # Optionally parse exit_time if provided
@@ -488,12 +612,10 @@ def get_customer_journey(session_id: str):
 @router.get("/api/tracking/customer-journey/{customer_id}", tags=["Page Tracking"])
 def get_customer_journey_by_id(customer_id: str):
     """Get complete page journey for a customer by customer ID"""
-    # First get the customer details to find session_id
-    customer_details = CustomerService.get_customer_details(customer_id)
-    if not customer_details:
+    session_id = CustomerService.resolve_session_id(customer_id)
+    if not session_id:
         raise HTTPException(status_code=404, detail="Customer not found")
 
-    session_id = customer_details["session_id"]
     journey = PageTrackingService.get_customer_journey(session_id)
 
     return {
@@ -514,16 +636,14 @@ def get_visual_journey(identifier: str, id_type: str = "session"):
     try:
         if id_type == "customer":
             # Get by customer ID
-            customer_details = CustomerService.get_customer_details(identifier)
-            if not customer_details:
+            session_id = CustomerService.resolve_session_id(identifier)
+            if not session_id:
                 raise HTTPException(
                     status_code=404, detail="Customer not found")
-            session_id = customer_details["session_id"]
-            journey = customer_details["page_journey"]
         else:
             # Get by session ID
             session_id = identifier
-            journey = PageTrackingService.get_customer_journey(session_id)
+        journey = PageTrackingService.get_customer_journey(session_id)
 
         # Create visual journey representation
         visual_journey = []
@@ -576,6 +696,7 @@ def start_cif(request: CIFStartRequest):
 
 
 @router.put("/api/cif/update", tags=["Customer Information Form"])
+@idempotent
 def update_cif(request: CIFUpdateRequest):
     """Update CIF data for a customer"""
     success = CIFService.update_cif_data(
@@ -589,6 +710,7 @@ def update_cif(request: CIFUpdateRequest):
 
 
 @router.post("/api/cif/complete", tags=["Customer Information Form"])
+@idempotent
 def complete_cif(request: CIFUpdateRequest):
     """Mark CIF as completed and update final data"""
     success = CIFService.update_cif_data(
@@ -610,8 +732,20 @@ def get_cif_data(customer_id: str):
 # New: Session Exit Tracking Endpoints
 
 @router.post("/api/session/exit", tags=["Session Management"])
+@idempotent
 def log_session_exit(request: SessionExitRequest):
     """Log session exit/abandonment"""
+    if _log_events_durably([{
+        "type": "session_exit",
+        "session_id": request.session_id,
+        "exit_reason": request.exit_reason,
+        "exit_question_id": request.exit_question_id,
+        "exit_page": request.exit_page,
+        "last_action": request.last_action,
+        "metadata": request.metadata
+    }]) is not None:
+        # The exit row is written when the event log is replayed
+        return {"message": "Session exit logged", "exit_id": None}
     exit_id = SessionExitService.log_session_exit(
         request.session_id,
         request.exit_reason,
@@ -625,37 +759,164 @@ def log_session_exit(request: SessionExitRequest):
     raise HTTPException(status_code=400, detail="Failed to log session exit")
 
 
+@router.post("/api/events/batch", tags=["Event Ingestion"])
+@idempotent
+async def log_event_batch(request: Request):
+    """
+    Ingest an ordered array of behavior, page_entry, page_exit and
+    session_exit events for one or more sessions in a single request.
+    The body is parsed as JSON whatever its Content-Type, so pages can flush
+    with navigator.sendBeacon on unload.
+    """
+    try:
+        batch = EventBatchRequest.model_validate(json.loads(await request.body()))
+    except (ValueError, ValidationError) as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if len(batch.events) > Config.EVENT_BATCH_MAX_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch exceeds {Config.EVENT_BATCH_MAX_SIZE} events")
+    if not batch.events:
+        return {"accepted": 0, "page_tracking_ids": [], "scores": {}}
+
+    events = [event.model_dump() for event in batch.events]
+    logged_ids = await run_in_threadpool(_log_events_durably, events)
+    if logged_ids is not None:
+        return {"accepted": len(events), "page_tracking_ids": logged_ids, "scores": {}}
+
+    result = await run_in_threadpool(EventBatchService.ingest_events, events)
+    if result is None:
+        raise HTTPException(status_code=400, detail="Failed to ingest events")
+    return result
+
+
+@router.get("/api/system/write-buffer", tags=["System"])
+def get_write_buffer_stats():
+    """Queue depth and flush latency of the telemetry write-behind buffer"""
+    write_buffer = get_write_buffer()
+    if not write_buffer:
+        return {"enabled": False}
+    return {"enabled": True, **write_buffer.stats()}
+
+
+@router.get("/api/system/analytics-rollups", tags=["System"])
+def get_analytics_rollup_stats():
+    """Run count and last error of the analytics rollup compactor"""
+    compactor = get_compactor()
+    if not compactor:
+        return {"enabled": False}
+    return {"enabled": True, **compactor.stats()}
+
+
+@router.get("/api/system/retention", tags=["System"])
+def get_retention_stats():
+    """Rows reclaimed and duration of the analytics retention job's runs"""
+    retention_job = get_retention_job()
+    if not retention_job:
+        return {"enabled": False}
+    return {"enabled": True, **retention_job.stats()}
+
+
+@router.get("/api/system/caches", tags=["System"])
+def get_cache_stats():
+    """Hit rates of the in-process read caches"""
+    return {"lead_summary": lead_summary_cache.stats(),
+            "analytics": analytics_cache.stats()}
+
+
+@router.get("/api/system/idempotency", tags=["System"])
+def get_idempotency_stats():
+    """Size and hit counts of the Idempotency-Key store"""
+    return idempotency_store.stats()
+
+
+@router.get("/api/system/event-log", tags=["System"])
+def get_event_log_stats():
+    """Segment backlog and replay progress of the local event log"""
+    event_log = get_event_log()
+    if not event_log:
+        return {"enabled": False}
+    return {"enabled": True, **event_log.stats(), **get_replayer().stats()}
+
+
 # New: Advanced Analytics Endpoints
 
 @router.get("/api/analytics/drop-off-points", tags=["Advanced Analytics"])
-def get_drop_off_analytics():
+def get_drop_off_analytics(filters: AnalyticsFilter = Depends(analytics_filters)):
     """Get analytics on where users typically abandon sessions"""
-    analytics = SessionExitService.get_abandonment_analytics()
+    analytics = SessionExitService.get_abandonment_analytics(filters)
     return analytics
 
 
 @router.get("/api/analytics/page-performance", tags=["Advanced Analytics"])
-def get_page_performance():
-    """Get page-wise engagement metrics"""
+def get_page_performance(filters: AnalyticsFilter = Depends(analytics_filters)):
+    """
+    Get page-wise engagement metrics. unique_sessions and
+    time_spent_percentiles need ANALYTICS_ROLLUPS_ENABLED; without it the
+    response lists them under unavailable_metrics.
+    """
     from services import PageTrackingService
     # Example: Aggregate page views, avg time, conversion rates
-    analytics = PageTrackingService.get_page_performance_analytics()
+    analytics = PageTrackingService.get_page_performance_analytics(filters)
     return analytics
 
 
+@router.get("/api/analytics/question-funnel", tags=["Advanced Analytics"])
+def get_question_funnel(filters: AnalyticsFilter = Depends(analytics_filters)):
+    """
+    Per question in workflow order: sessions that reached, answered, skipped
+    and abandoned it, and the median seconds taken to answer it.
+    """
+    return AnalyticsService.get_question_funnel(filters)
+
+
+@router.get("/api/analytics/answer-times", tags=["Advanced Analytics"])
+def get_answer_time_analytics(filters: AnalyticsFilter = Depends(analytics_filters)):
+    """
+    Per question: answer count and p50/p90/p99 of the client-reported
+    time_taken. The percentiles need ANALYTICS_ROLLUPS_ENABLED.
+    """
+    return AnalyticsService.get_answer_time_analytics(filters)
+
+
+@router.get("/api/analytics/cohorts", tags=["Advanced Analytics"])
+def get_cohort_analytics(filters: AnalyticsFilter = Depends(analytics_filters)):
+    """
+    Lead counts, SQL/MQL rates, score percentiles and median hours to SQL per
+    signup day and utm_source. Served from a lead snapshot refreshed every
+    COHORT_SNAPSHOT_REFRESH_SECONDS.
+    """
+    return AnalyticsService.get_cohort_analytics(filters)
+
+
 @router.get("/api/analytics/customer-journey", tags=["Advanced Analytics"])
-def get_journey_analytics():
-    """Get journey analysis across all customers"""
-    from services import PageTrackingService
-    # Example: Aggregate journeys for all customers
-    analytics = PageTrackingService.get_all_customer_journeys()
-    return analytics
+def get_journey_analytics(cursor: Optional[str] = None, limit: Optional[int] = None,
+                          format: Literal["json", "ndjson"] = "json",
+                          filters: AnalyticsFilter = Depends(analytics_filters)):
+    """
+    Get journey analysis across all customers, ordered by session_id.
+    JSON pages hold `limit` sessions (default JOURNEY_PAGE_SIZE); pass the
+    returned next_cursor as `cursor` for the next page. format=ndjson
+    streams one session per line, all sessions unless `limit` is given.
+    """
+    if limit is not None and not 1 <= limit <= Config.JOURNEY_PAGE_SIZE_MAX:
+        raise HTTPException(
+            status_code=400,
+            detail=f"limit must be between 1 and {Config.JOURNEY_PAGE_SIZE_MAX}")
+    if format == "ndjson":
+        journeys = PageTrackingService.iter_customer_journeys(
+            cursor, limit, filters)
+        return StreamingResponse(
+            (json.dumps(journey) + "\n" for journey in journeys),
+            media_type="application/x-ndjson")
+    return PageTrackingService.get_all_customer_journeys(
+        cursor, limit or Config.JOURNEY_PAGE_SIZE, filters)
 
 
 @router.get("/api/analytics/cif-completion", tags=["Advanced Analytics"])
-def get_cif_completion_analytics():
+def get_cif_completion_analytics(filters: AnalyticsFilter = Depends(analytics_filters)):
     """Get CIF completion rates and analytics"""
     from services import CIFService
     # Example: Aggregate CIF completion rates and breakdowns
-    analytics = CIFService.get_cif_completion_analytics()
+    analytics = CIFService.get_cif_completion_analytics(filters)
     return analytics
@@ -1,11 +1,28 @@
 import os
 import xmlrpc.client
 import json
+import copy
 from datetime import datetime, date
-from models import Question, Answer, Lead, UserBehavior, CustomerInformationForm, PageTracking, SessionExit
-from database import get_db_session
-from workflow_config import WORKFLOW_CONFIG
+from sqlalchemy import event as sa_event
+from sqlalchemy.orm import Session
+from sqlalchemy import (insert, update, select, case, cast, extract, literal, literal_column, true, bindparam, type_coerce, JSON,
+                        func, union_all, Integer, DateTime)
+from sqlalchemy.dialects.postgresql import insert as pg_insert, JSONB, aggregate_order_by
+from models import (Question, Answer, Lead, UserBehavior, CustomerInformationForm, PageTracking, SessionExit,
+                    CustomerIdCounter)
+from database import get_db_session, engine
+from workflow_index import get_workflow, question_bit
+from write_buffer import get_write_buffer
+from caching import LRUCache
+import analytics_rollups
+from analytics_filters import NO_FILTER
+from analytics_cache import analytics_cache
+from analytics_rollups import ROLLUPS_REQUIRED
+from funnel import FunnelEvents, compute_funnel, START, ANSWER, SKIP, EXIT, UNKNOWN_QUESTION
+from cohorts import lead_snapshot, cohort_matrix
+from config import Config
 import time
+import threading
 import traceback
 import logging
 from dotenv import load_dotenv
@@ -25,13 +42,39 @@ logging.basicConfig(
 
 logging.info("Test log entry")
 
+# Read-through cache of LeadService.get_lead_summary, keyed by session_id
+lead_summary_cache = LRUCache(
+    max_entries=Config.SUMMARY_CACHE_MAX_ENTRIES,
+    ttl_seconds=Config.SUMMARY_CACHE_TTL_SECONDS
+)
+
+
+# customer_id -> session_id; an assigned customer ID never changes
+customer_session_cache = LRUCache(max_entries=Config.SUMMARY_CACHE_MAX_ENTRIES)
+
+
+@sa_event.listens_for(Session, 'after_commit')
+def _drop_stale_lead_summaries(db_session):
+    """Update the lead caches only once the lead writes are committed"""
+    for session_id in db_session.info.pop('stale_lead_summaries', ()):
+        lead_summary_cache.delete(session_id)
+
+
+@sa_event.listens_for(Session, 'after_soft_rollback')
+def _forget_stale_lead_summaries(db_session, previous_transaction):
+    db_session.info.pop('stale_lead_summaries', None)
+
 
 class QuestionService:
     @staticmethod
     def get_questions():
-        """Fetch predefined questions from configuration."""
-        logging.info("Fetching predefined questions from configuration.")
-        return WORKFLOW_CONFIG['questions_workflow']
+        """Fetch predefined questions from configuration, in order."""
+        return get_workflow().questions
+
+    @staticmethod
+    def get_next_required_question(last_question_id, answered_mask):
+        """First required question after last_question_id not set in answered_mask."""
+        return get_workflow().next_required_question(last_question_id, answered_mask)
 
 
 class AnswerService:
@@ -49,15 +92,16 @@ class AnswerService:
             score = ScoringService.calculate_answer_score(
                 answer_text, time_taken)
 
-            new_answer = Answer(
-                session_id=session_id,
-                question_id=question_id,
-                answer_text=answer_text
-            )
-            db_session.add(new_answer)
-
-            # Update lead total score
-            LeadService.update_lead_score(session_id, score)
+            # Insert the answer and bump the lead score in one statement
+            LeadService.apply_score_delta(
+                db_session, session_id, score,
+                event_insert=insert(Answer).values(
+                    session_id=session_id,
+                    question_id=question_id,
+                    answer_text=answer_text,
+                    time_taken=time_taken
+                ),
+                answered_question_id=question_id)
 
             db_session.commit()
             return True, score
@@ -73,12 +117,12 @@ class ScoringService:
     @staticmethod
     def get_scoring_map():
         """Get scoring configuration."""
-        return WORKFLOW_CONFIG['scoring']
+        return get_workflow().scoring
 
     @staticmethod
     def get_lead_thresholds():
         """Get lead qualification thresholds."""
-        return WORKFLOW_CONFIG['lead_thresholds']
+        return get_workflow().lead_thresholds
 
     @staticmethod
     def calculate_answer_score(answer_text, time_taken=None):
@@ -101,7 +145,7 @@ class ScoringService:
 
     @staticmethod
     def log_behavior(session_id, action, metadata=None):
-        """Log user behavior and return score change."""
+        """Log user behavior and return score change, or None if it was not logged."""
         db_session = get_db_session()
         try:
             logging.info(
@@ -111,23 +155,34 @@ class ScoringService:
             scoring_map = ScoringService.get_scoring_map()
             score_change = scoring_map.get(action, 0)
 
-            behavior = UserBehavior(
-                session_id=session_id,
-                action=action,
-                score_change=score_change,
-                behavior_metadata=json.dumps(metadata) if metadata else None
-            )
-            db_session.add(behavior)
+            # Pure telemetry does not touch the score, so it can be buffered
+            write_buffer = get_write_buffer()
+            if write_buffer and not score_change:
+                write_buffer.enqueue(UserBehavior, {
+                    'session_id': session_id,
+                    'action': action,
+                    'score_change': score_change,
+                    'behavior_metadata': json.dumps(metadata) if metadata else None,
+                    'created_at': datetime.now()
+                })
+                return score_change
 
-            # Update lead total score
-            LeadService.update_lead_score(session_id, score_change)
+            # Insert the behavior and bump the lead score in one statement
+            LeadService.apply_score_delta(
+                db_session, session_id, score_change,
+                event_insert=insert(UserBehavior).values(
+                    session_id=session_id,
+                    action=action,
+                    score_change=score_change,
+                    behavior_metadata=json.dumps(metadata) if metadata else None
+                ))
 
             db_session.commit()
             return score_change
         except Exception as e:
             logging.error(f"Error logging behavior: {e}")
             db_session.rollback()
-            return 0
+            return None
         finally:
             db_session.close()
 
@@ -142,41 +197,46 @@ class ScoringService:
         else:
             return "Unqualified"
 
+    @staticmethod
+    def lead_type_expression(score_expr):
+        """SQL CASE equivalent of calculate_lead_type for server-side updates."""
+        thresholds = ScoringService.get_lead_thresholds()
+        return case(
+            (score_expr >= thresholds['sql'], "SQL"),
+            (score_expr >= thresholds['mql'], "MQL"),
+            else_="Unqualified"
+        )
+
 
 class LeadService:
     @staticmethod
-    def check_all_questions_answered(lead_id):
+    def check_all_questions_answered(session_id, answered_mask=None):
         """
         Checks if all required questions have been answered for the given lead.
         Returns True if complete, False otherwise.
         """
-        # TODO: Implement actual logic based on your models and DB
-        # For now, return True as a stub
-        return True
+        if answered_mask is None:
+            answered_mask = LeadService.get_answered_mask(session_id)
+        required_mask = get_workflow().required_mask
+        return answered_mask & required_mask == required_mask
+
     @staticmethod
     def create_lead(session_id, utm_source=None):
-        """Create a new lead session."""
+        """
+        Create a new lead session. The lead is inserted with its
+        session_opened score and lead_type already applied, together with the
+        matching behavior row, in a single transaction.
+        """
         db_session = get_db_session()
         try:
             logging.info(
                 f"Creating lead for session_id={session_id}, utm_source={utm_source}.")
-            logging.debug(
-                f"Lead details: session_id={session_id}, utm_source={utm_source}.")
 
-            lead = Lead(
-                session_id=session_id,
-                utm_source=utm_source,
-                lead_score=0
-            )
-            db_session.add(lead)
-            print(
-                f"[DEBUG] Added lead with session_id={session_id} to session. Attempting commit...")
+            lead_rows, behavior_rows = LeadService._new_session_rows(
+                [session_id], utm_source)
+            db_session.add(Lead(**lead_rows[0]))
+            db_session.add(UserBehavior(**behavior_rows[0]))
             db_session.commit()
-            print(f"[DEBUG] Commit successful for session_id={session_id}.")
-
-            # Log session opened behavior
-            ScoringService.log_behavior(session_id, 'session_opened')
-
             return True
         except Exception as e:
             logging.error(f"Error creating lead: {e}")
@@ -187,20 +247,120 @@ class LeadService:
         finally:
             db_session.close()
 
+    @staticmethod
+    def create_leads_bulk(session_ids, utm_source=None):
+        """
+        Pre-provision many sessions (e.g. for embedded widgets) with one
+        multi-row INSERT per table in a single transaction.
+        Returns True on success, False otherwise.
+        """
+        db_session = get_db_session()
+        try:
+            logging.info(
+                f"Creating {len(session_ids)} leads in bulk, utm_source={utm_source}.")
+            lead_rows, behavior_rows = LeadService._new_session_rows(
+                session_ids, utm_source)
+            db_session.execute(insert(Lead), lead_rows)
+            db_session.execute(insert(UserBehavior), behavior_rows)
+            db_session.commit()
+            return True
+        except Exception as e:
+            logging.error(f"Error creating leads in bulk: {e}")
+            db_session.rollback()
+            return False
+        finally:
+            db_session.close()
+
+    @staticmethod
+    def _new_session_rows(session_ids, utm_source):
+        """Lead and session_opened behavior rows with the opening score applied"""
+        score = ScoringService.get_scoring_map().get('session_opened', 0)
+        lead_type = ScoringService.calculate_lead_type(score)
+        now = datetime.now()
+        lead_rows = [{
+            'session_id': session_id,
+            'utm_source': utm_source,
+            'lead_score': score,
+            'lead_type': lead_type,
+            'sql_at': now if lead_type == 'SQL' else None
+        } for session_id in session_ids]
+        behavior_rows = [{
+            'session_id': session_id,
+            'action': 'session_opened',
+            'score_change': score,
+            'behavior_metadata': None,
+            'created_at': now
+        } for session_id in session_ids]
+        return lead_rows, behavior_rows
+
+    @staticmethod
+    def apply_score_delta(db_session, session_id, score_change, event_insert=None,
+                          answered_question_id=None):
+        """
+        Atomically add score_change to the lead inside the caller's transaction.
+        The increment and lead_type are computed server-side, so concurrent
+        events for the same session never lose points. If event_insert is
+        given it is attached as a data-modifying CTE, making the event row and
+        the score update a single statement. answered_question_id sets that
+        question's bit in answered_mask in the same statement.
+        Returns (lead_score, lead_type) after the update, or None if no lead.
+        """
+        new_score = func.coalesce(Lead.lead_score, 0) + score_change
+        new_type = ScoringService.lead_type_expression(new_score)
+        values = {
+            'lead_score': new_score,
+            'lead_type': new_type,
+            # Stamped the first time the lead reaches SQL
+            'sql_at': func.coalesce(Lead.sql_at, case((new_type == 'SQL', func.now())))
+        }
+        bit = question_bit(answered_question_id)
+        if bit:
+            values['answered_mask'] = Lead.answered_mask.op('|')(bit)
+        stmt = update(Lead).where(Lead.session_id == session_id).values(
+            **values
+        ).returning(Lead.lead_score, Lead.lead_type)
+        if event_insert is not None:
+            stmt = stmt.add_cte(event_insert.cte('inserted_event'))
+        row = db_session.execute(
+            stmt, execution_options={'synchronize_session': False}).first()
+        if row is None:
+            return None
+        LeadService.invalidate_summary(db_session, session_id)
+        return row.lead_score, row.lead_type
+
+    @staticmethod
+    def get_answered_mask(session_id, db_session=None):
+        """
+        Answered-question bitmap of a session (0 if there is no lead). Read
+        from the lead row every time: the bit is set by whichever worker
+        commits the answer, so a per-process copy would go stale. Pass the
+        caller's db_session to read inside its transaction; it is left open.
+        """
+        if db_session is not None:
+            return db_session.query(Lead.answered_mask).filter_by(
+                session_id=session_id).scalar() or 0
+        db_session = get_db_session()
+        try:
+            mask = db_session.query(Lead.answered_mask).filter_by(
+                session_id=session_id).scalar()
+        finally:
+            db_session.close()
+        return mask or 0
+
+    @staticmethod
+    def invalidate_summary(db_session, session_id):
+        """Drop the cached summary for session_id when db_session commits"""
+        db_session.info.setdefault('stale_lead_summaries', set()).add(session_id)
+
     @staticmethod
     def update_lead_score(session_id, score_change):
         """Update lead total score."""
         db_session = get_db_session()
         try:
-            lead = db_session.query(Lead).filter_by(
-                session_id=session_id).first()
-            if lead:
-                lead.lead_score += score_change
-                lead.lead_type = ScoringService.calculate_lead_type(
-                    lead.lead_score)
-                db_session.commit()
-                return True
-            return False
+            result = LeadService.apply_score_delta(
+                db_session, session_id, score_change)
+            db_session.commit()
+            return result is not None
         except Exception as e:
             print(f"Error updating lead score: {e}")
             db_session.rollback()
@@ -235,6 +395,7 @@ class LeadService:
                             setattr(lead, key, value)
 
                 logging.debug(f"Lead data before commit: {lead.__dict__}")
+                LeadService.invalidate_summary(db_session, session_id)
                 db_session.commit()
                 logging.info("Lead updated successfully.")
                 return True
@@ -253,37 +414,28 @@ class LeadService:
 
     @staticmethod
     def get_lead_summary(session_id):
-        """Get complete lead summary for CRM export."""
+        """
+        Get complete lead summary for CRM export.
+        Read-only: served from lead_summary_cache when possible, which the
+        score and profile write paths invalidate on commit.
+        """
+        use_cache = Config.SUMMARY_CACHE_TTL_SECONDS > 0
+        if use_cache:
+            cached = lead_summary_cache.get(session_id)
+            if cached is not None:
+                return copy.deepcopy(cached)
+
         db_session = get_db_session()
         try:
             lead = db_session.query(Lead).filter_by(
                 session_id=session_id).first()
-            if lead:
-                # Calculate lead type based on current score
-                lead_type = ScoringService.calculate_lead_type(lead.lead_score)
-
-                # Update lead type in database
-                lead.lead_type = lead_type
-                db_session.commit()
+            if not lead:
+                return None
 
-                return {
-                    'session_id': lead.session_id,
-                    'name': lead.name,
-                    'location': lead.location,
-                    'business_type': lead.business_type,
-                    'staff_size': lead.staff_size,
-                    'monthly_sales': lead.monthly_sales,
-                    'features_interested': json.loads(lead.features_interested) if lead.features_interested else [],
-                    'contact_info': lead.phone or lead.email,
-                    'email': lead.email,
-                    'phone': lead.phone,
-                    'lead_score': lead.lead_score,
-                    'lead_type': lead_type,
-                    'utm_source': lead.utm_source,
-                    'created_at': lead.created_at.isoformat() if lead.created_at else None,
-                    'updated_at': lead.updated_at.isoformat() if lead.updated_at else None
-                }
-            return None
+            summary = LeadService.summary_from_lead(lead)
+            if use_cache:
+                lead_summary_cache.set(session_id, summary)
+            return copy.deepcopy(summary)
         except Exception as e:
             print(f"Error getting lead summary: {e}")
             return None
@@ -291,6 +443,89 @@ class LeadService:
             db_session.close()
 
 
+    @staticmethod
+    def summary_from_lead(lead):
+        """Summary dict from a Lead or a row with the same column names"""
+        return {
+            'session_id': lead.session_id,
+            'name': lead.name,
+            'location': lead.location,
+            'business_type': lead.business_type,
+            'staff_size': lead.staff_size,
+            'monthly_sales': lead.monthly_sales,
+            'features_interested': LeadService._features_interested(lead),
+            'contact_info': lead.phone or lead.email,
+            'email': lead.email,
+            'phone': lead.phone,
+            'lead_score': lead.lead_score,
+            # Derived from the current score and thresholds, never written back
+            'lead_type': ScoringService.calculate_lead_type(lead.lead_score or 0),
+            'utm_source': lead.utm_source,
+            'created_at': lead.created_at.isoformat() if lead.created_at else None,
+            'updated_at': lead.updated_at.isoformat() if lead.updated_at else None
+        }
+
+    @staticmethod
+    def _features_interested(lead):
+        """Decoded features_interested; a malformed value is logged and read as []"""
+        if not lead.features_interested:
+            return []
+        try:
+            return json.loads(lead.features_interested)
+        except ValueError as e:
+            logging.error(
+                f"Malformed features_interested for session {lead.session_id}: {e}")
+            return []
+
+    @staticmethod
+    def to_crm_record(summary):
+        """CRM export record for a lead summary (/api/lead/export shape)"""
+        return {
+            "name": summary.get('name', 'Unknown'),
+            "location": summary.get('location', ''),
+            "business_type": summary.get('business_type', ''),
+            "staff_size": summary.get('staff_size', ''),
+            "monthly_sales": summary.get('monthly_sales', ''),
+            "features_interested": summary.get('features_interested', []),
+            "contact_info": summary.get('phone', summary.get('email', '')),
+            "email": summary.get('email', ''),
+            "phone": summary.get('phone', ''),
+            "lead_score": summary.get('lead_score', 0),
+            "lead_type": summary.get('lead_type', 'Unqualified'),
+            "utm_source": summary.get('utm_source', 'direct'),
+            "session_start_time": summary.get('created_at', ''),
+            "assigned_to": "CTL-Team"
+        }
+
+    @staticmethod
+    def iter_crm_batches(filters=NO_FILTER, lead_type=None, batch_rows=None):
+        """
+        Yield lists of CRM export records for the leads created in filters'
+        range, in id order. Rows are read through a server-side cursor a
+        batch at a time, so memory stays flat whatever the result size.
+        lead_type matches the type derived from the current score, as in
+        the single-lead export.
+        """
+        stmt = filters.apply(select(
+            Lead.session_id, Lead.name, Lead.location, Lead.business_type,
+            Lead.staff_size, Lead.monthly_sales, Lead.features_interested,
+            Lead.email, Lead.phone, Lead.lead_score, Lead.utm_source,
+            Lead.created_at, Lead.updated_at
+        ), Lead.created_at).order_by(Lead.id)
+        if lead_type is not None:
+            stmt = stmt.where(ScoringService.lead_type_expression(
+                func.coalesce(Lead.lead_score, 0)) == lead_type)
+
+        with engine.connect() as connection:
+            result = connection.execution_options(
+                stream_results=True,
+                yield_per=batch_rows or Config.CRM_EXPORT_BATCH_ROWS
+            ).execute(stmt)
+            for rows in result.partitions():
+                yield [LeadService.to_crm_record(LeadService.summary_from_lead(row))
+                       for row in rows]
+
+
 # Odoo Sync Service
 
 
@@ -356,11 +591,10 @@ class OdooSyncService:
     @staticmethod
     def check_all_questions_answered(session_id):
         """Check if user has provided a reasonable number of answers (simplified approach)"""
-        db_session = get_db_session()
         try:
-            # Count total answers provided by the user
-            answer_count = db_session.query(Answer).filter_by(
-                session_id=session_id).count()
+            # Count distinct questions answered by the user
+            answer_count = LeadService.get_answered_mask(
+                session_id).bit_count()
 
             # If user has provided at least 3 answers, consider it complete
             # This allows for flexibility with skipping questions
@@ -376,6 +610,64 @@ class OdooSyncService:
         except Exception as e:
             print(f"Error checking answers for session {session_id}: {e}")
             return False
+
+
+# New: Customer ID allocation
+class CustomerIdAllocator:
+    """
+    Hands out CID_YYYYMMDD_NNNN numbers from a per-day counter row.
+    Each process reserves a block of numbers with one atomic UPDATE, so
+    allocation is O(1) and concurrent workers never produce the same ID.
+    """
+    _lock = threading.Lock()
+    _blocks = {}  # day -> [next_number, last_number]
+
+    @staticmethod
+    def next_customer_id():
+        today = date.today().strftime("%Y%m%d")
+        with CustomerIdAllocator._lock:
+            block = CustomerIdAllocator._blocks.get(today)
+            if not block or block[0] > block[1]:
+                last = CustomerIdAllocator._reserve_block(today)
+                block = [last - Config.CUSTOMER_ID_BLOCK_SIZE + 1, last]
+                # Drop blocks for previous days
+                CustomerIdAllocator._blocks = {today: block}
+            number = block[0]
+            block[0] += 1
+        return f"CID_{today}_{str(number).zfill(4)}"
+
+    @staticmethod
+    def _reserve_block(day):
+        """Advance the day's counter by one block and return its last number"""
+        block_size = Config.CUSTOMER_ID_BLOCK_SIZE
+        db_session = get_db_session()
+        try:
+            last = db_session.execute(
+                update(CustomerIdCounter)
+                .where(CustomerIdCounter.day == day)
+                .values(last_value=CustomerIdCounter.last_value + block_size)
+                .returning(CustomerIdCounter.last_value),
+                execution_options={'synchronize_session': False}
+            ).scalar()
+            if last is None:
+                # First block of the day: start after any IDs issued before
+                # the counter existed, then let the upsert settle races
+                issued = db_session.query(func.max(
+                    cast(func.split_part(Lead.customer_id, '_', 3), Integer)
+                )).filter(Lead.customer_id.like(f"CID_{day}_%")).scalar() or 0
+                last = db_session.execute(
+                    pg_insert(CustomerIdCounter)
+                    .values(day=day, last_value=issued + block_size)
+                    .on_conflict_do_update(
+                        index_elements=[CustomerIdCounter.day],
+                        set_={'last_value': CustomerIdCounter.last_value + block_size})
+                    .returning(CustomerIdCounter.last_value)
+                ).scalar()
+            db_session.commit()
+            return last
+        except Exception:
+            db_session.rollback()
+            raise
         finally:
             db_session.close()
 
@@ -385,56 +677,56 @@ class CustomerService:
     @staticmethod
     def generate_customer_id():
         """Generate unique customer ID in format CID_YYYYMMDD_XXXX"""
-        db_session = get_db_session()
         try:
-            today = date.today().strftime("%Y%m%d")
-
-            # Get the count of customers created today
-            today_count = db_session.query(Lead).filter(
-                Lead.customer_id.like(f"CID_{today}_%")
-            ).count()
-
-            next_number = str(today_count + 1).zfill(4)
-            customer_id = f"CID_{today}_{next_number}"
-
-            return customer_id
+            return CustomerIdAllocator.next_customer_id()
         except Exception as e:
             print(f"Error generating customer ID: {e}")
             return None
-        finally:
-            db_session.close()
 
     @staticmethod
     def assign_customer_id(session_id):
-        """Assign customer ID to existing session"""
+        """
+        Assign customer ID to existing session. The lead is checked first,
+        so unknown sessions and leads that already have an ID never use up
+        a number from the day's range.
+        """
         db_session = get_db_session()
         try:
-            print(f"[DEBUG] Looking for session_id: {session_id}")
-            lead = db_session.query(Lead).filter_by(
-                session_id=session_id).first()
-            print(f"[DEBUG] Found lead: {lead}")
-
-            if lead and not lead.customer_id:
-                customer_id = CustomerService.generate_customer_id()
-                print(f"[DEBUG] Generated customer_id: {customer_id}")
-                lead.customer_id = customer_id
-                db_session.add(lead)  # Explicitly add the modified object
-                db_session.commit()
-                # Refresh to ensure changes are persisted
-                db_session.refresh(lead)
-                print(
-                    f"[DEBUG] Assigned customer_id {customer_id} to session {session_id}")
-                return customer_id
-            elif lead and lead.customer_id:
-                print(
-                    f"[DEBUG] Lead already has customer_id: {lead.customer_id}")
+            lead = db_session.execute(
+                select(Lead.customer_id).where(Lead.session_id == session_id)
+            ).first()
+            db_session.rollback()
+            if lead is None:
+                logging.info(f"No lead found for session_id: {session_id}")
+                return None
+            if lead.customer_id:
                 return lead.customer_id
-            else:
-                print(f"[DEBUG] No lead found for session_id: {session_id}")
+
+            # Allocated outside the lead transaction: the allocator commits
+            # on the same scoped session
+            customer_id = CustomerService.generate_customer_id()
+            if customer_id is None:
                 return None
+
+            # Only claims the ID if a concurrent call has not assigned one
+            assigned = db_session.execute(
+                update(Lead)
+                .where(Lead.session_id == session_id, Lead.customer_id.is_(None))
+                .values(customer_id=customer_id)
+                .returning(Lead.customer_id),
+                execution_options={'synchronize_session': False}
+            ).scalar()
+            if assigned:
+                db_session.commit()
+                logging.info(
+                    f"Assigned customer_id {assigned} to session {session_id}")
+                return assigned
+
+            db_session.rollback()
+            return db_session.query(Lead.customer_id).filter_by(
+                session_id=session_id).scalar()
         except Exception as e:
             print(f"Error assigning customer ID: {e}")
-            import traceback
             traceback.print_exc()
             db_session.rollback()
             return None
@@ -443,90 +735,127 @@ class CustomerService:
 
     @staticmethod
     def get_customer_details(customer_id):
-        """Get complete customer details by customer ID"""
+        """
+        Get complete customer details by customer ID.
+        The lead, CIF data, page journey and behaviors are assembled by one
+        query, with the lists built as ordered json_agg subqueries.
+        """
         db_session = get_db_session()
         try:
-            print(f"[DEBUG] Looking for customer_id: {customer_id}")
-            lead = db_session.query(Lead).filter_by(
-                customer_id=customer_id
+            page_journey = select(func.coalesce(
+                func.json_agg(aggregate_order_by(func.json_build_object(
+                    'page', PageTracking.page_identifier,
+                    'question_id', PageTracking.question_id,
+                    'entry_time', PageTracking.entry_time,
+                    'exit_time', PageTracking.exit_time,
+                    'time_spent', PageTracking.time_spent,
+                    'page_type', PageTracking.page_type
+                ), PageTracking.entry_time)),
+                literal_column("'[]'::json")
+            )).where(PageTracking.customer_id == Lead.customer_id).scalar_subquery()
+
+            behaviors = select(func.coalesce(
+                func.json_agg(aggregate_order_by(func.json_build_object(
+                    'action', UserBehavior.action,
+                    'score_change', UserBehavior.score_change,
+                    'timestamp', UserBehavior.created_at
+                ), UserBehavior.created_at)),
+                literal_column("'[]'::json")
+            )).where(UserBehavior.session_id == Lead.session_id).scalar_subquery()
+
+            cif_data = select(CustomerInformationForm.form_data).where(
+                CustomerInformationForm.customer_id == Lead.customer_id
+            ).scalar_subquery()
+
+            row = db_session.execute(
+                select(
+                    Lead.session_id, Lead.name, Lead.email, Lead.phone,
+                    Lead.business_type, Lead.location, Lead.lead_score,
+                    Lead.lead_type, Lead.utm_source, Lead.cif_completed,
+                    type_coerce(cif_data, JSON).label('cif_data'),
+                    type_coerce(page_journey, JSON).label('page_journey'),
+                    type_coerce(behaviors, JSON).label('behaviors')
+                ).where(Lead.customer_id == customer_id)
             ).first()
-            print(f"[DEBUG] Found lead: {lead}")
-
-            if lead:
-                # Get CIF data if available
-                cif = db_session.query(CustomerInformationForm).filter_by(
-                    customer_id=customer_id
-                ).first()
-                print(f"[DEBUG] Found CIF: {cif}")
-
-                # Get page tracking data
-                pages = db_session.query(PageTracking).filter_by(
-                    customer_id=customer_id
-                ).order_by(PageTracking.entry_time).all()
-                print(f"[DEBUG] Found pages: {len(pages)}")
-
-                # Get behaviors
-                behaviors = db_session.query(UserBehavior).filter_by(
-                    session_id=lead.session_id
-                ).order_by(UserBehavior.created_at).all()
-                print(f"[DEBUG] Found behaviors: {len(behaviors)}")
+            if row is None:
+                return None
 
-                return {
-                    'customer_id': customer_id,
-                    'session_id': lead.session_id,
-                    'lead_data': {
-                        'name': lead.name,
-                        'email': lead.email,
-                        'phone': lead.phone,
-                        'business_type': lead.business_type,
-                        'location': lead.location,
-                        'lead_score': lead.lead_score,
-                        'lead_type': lead.lead_type,
-                        'utm_source': lead.utm_source,
-                        'cif_completed': lead.cif_completed
-                    },
-                    'cif_data': cif.form_data if cif else None,
-                    'page_journey': [
-                        {
-                            'page': page.page_identifier,
-                            'question_id': page.question_id,
-                            'entry_time': page.entry_time.isoformat(),
-                            'exit_time': page.exit_time.isoformat() if page.exit_time else None,
-                            'time_spent': page.time_spent,
-                            'page_type': page.page_type
-                        } for page in pages
-                    ],
-                    'behaviors': [
-                        {
-                            'action': behavior.action,
-                            'score_change': behavior.score_change,
-                            'timestamp': behavior.created_at.isoformat()
-                        } for behavior in behaviors
-                    ]
-                }
-            print(f"[DEBUG] No lead found for customer_id: {customer_id}")
-            return None
+            return {
+                'customer_id': customer_id,
+                'session_id': row.session_id,
+                'lead_data': {
+                    'name': row.name,
+                    'email': row.email,
+                    'phone': row.phone,
+                    'business_type': row.business_type,
+                    'location': row.location,
+                    'lead_score': row.lead_score,
+                    'lead_type': row.lead_type,
+                    'utm_source': row.utm_source,
+                    'cif_completed': row.cif_completed
+                },
+                'cif_data': row.cif_data,
+                'page_journey': row.page_journey,
+                'behaviors': row.behaviors
+            }
         except Exception as e:
             print(f"Error getting customer details: {e}")
-            import traceback
             traceback.print_exc()
             return None
         finally:
             db_session.close()
 
+    @staticmethod
+    def resolve_session_id(customer_id):
+        """Session ID for a customer ID, or None. Customer IDs never move."""
+        session_id = customer_session_cache.get(customer_id)
+        if session_id is not None:
+            return session_id
+        db_session = get_db_session()
+        try:
+            session_id = db_session.query(Lead.session_id).filter_by(
+                customer_id=customer_id).scalar()
+        except Exception as e:
+            print(f"Error resolving customer ID: {e}")
+            return None
+        finally:
+            db_session.close()
+        if session_id is not None:
+            customer_session_cache.set(customer_id, session_id)
+        return session_id
+
 
 # New: Page Tracking Service
 class PageTrackingService:
     @staticmethod
-    def get_page_performance_analytics():
-        """Aggregate page views, average time spent, and conversion rates per page."""
+    def get_page_performance_analytics(filters=NO_FILTER):
+        """
+        Aggregate page views, average time spent, and conversion rates per page.
+        unique_sessions and time_spent_percentiles come from the rollup
+        sketches; without rollups they are left out and listed under
+        unavailable_metrics.
+        """
+        try:
+            return analytics_cache.get(
+                'page_performance', filters, ('pages', 'leads'),
+                lambda: PageTrackingService._page_performance(filters))
+        except Exception as e:
+            print(f"Error getting page performance analytics: {e}")
+            return {'page_performance': []}
+
+    @staticmethod
+    def _page_performance(filters):
+        if Config.ANALYTICS_ROLLUPS_ENABLED:
+            return {'page_performance': analytics_rollups.page_performance(filters)}
+
         db_session = get_db_session()
         try:
             from sqlalchemy import func
-            results = db_session.query(
+            results = filters.apply(db_session.query(
                 PageTracking.page_identifier,
                 func.count(PageTracking.id).label('views'),
                 func.avg(PageTracking.time_spent).label('avg_time')
+            ), PageTracking.entry_time, PageTracking.session_id
             ).group_by(PageTracking.page_identifier).all()
 
             analytics = []
@@ -536,42 +865,108 @@ class PageTrackingService:
                     'views': row.views,
                     'avg_time_spent': float(row.avg_time) if row.avg_time else 0.0
                 })
-            return {'page_performance': analytics}
-        except Exception as e:
-            print(f"Error getting page performance analytics: {e}")
-            return {'page_performance': []}
+            return {
+                'page_performance': analytics,
+                # No exact COUNT DISTINCT or sort over raw rows
+                'unavailable_metrics': {
+                    'unique_sessions': ROLLUPS_REQUIRED,
+                    'time_spent_percentiles': ROLLUPS_REQUIRED
+                }
+            }
         finally:
             db_session.close()
 
     @staticmethod
-    def get_all_customer_journeys():
-        """Aggregate journeys for all customers/sessions."""
-        db_session = get_db_session()
+    def get_all_customer_journeys(after_session_id=None, limit=None, filters=NO_FILTER):
+        """
+        Aggregate journeys for all customers/sessions, a page at a time.
+        Returns up to limit sessions after after_session_id, plus the cursor
+        for the next page (None when there are no more sessions).
+        """
         try:
-            sessions = db_session.query(
-                PageTracking.session_id).distinct().all()
-            journeys = []
-            for session in sessions:
-                session_id = session.session_id
-                pages = db_session.query(PageTracking).filter_by(
-                    session_id=session_id).order_by(PageTracking.entry_time).all()
-                journey = [{
-                    'page': page.page_identifier,
-                    'entry_time': page.entry_time.isoformat(),
-                    'exit_time': page.exit_time.isoformat() if page.exit_time else None,
-                    'time_spent': page.time_spent
-                } for page in pages]
-                journeys.append({'session_id': session_id, 'journey': journey})
-            return {'customer_journeys': journeys}
+            journeys = list(PageTrackingService.iter_customer_journeys(
+                after_session_id, limit, filters))
+            next_cursor = None
+            if limit and len(journeys) == limit:
+                next_cursor = journeys[-1]['session_id']
+            return {'customer_journeys': journeys, 'next_cursor': next_cursor}
         except Exception as e:
             print(f"Error getting all customer journeys: {e}")
-            return {'customer_journeys': []}
-        finally:
-            db_session.close()
+            return {'customer_journeys': [], 'next_cursor': None}
+
+    @staticmethod
+    def iter_customer_journeys(after_session_id=None, limit=None, filters=NO_FILTER):
+        """
+        Yield {'session_id', 'journey'} per session in session_id order from
+        a single ordered scan over page_tracking. Rows are streamed from a
+        server-side cursor on a dedicated connection, so memory stays flat
+        however many sessions there are. filters keeps the page views
+        entered in its time range.
+        """
+        stmt = filters.apply(select(
+            PageTracking.session_id, PageTracking.page_identifier,
+            PageTracking.entry_time, PageTracking.exit_time, PageTracking.time_spent
+        ), PageTracking.entry_time, PageTracking.session_id
+        ).order_by(PageTracking.session_id, PageTracking.entry_time)
+        if after_session_id is not None:
+            stmt = stmt.where(PageTracking.session_id > after_session_id)
+        if limit:
+            # Keyset page: the next `limit` distinct sessions after the cursor
+            sessions = filters.apply(
+                select(PageTracking.session_id),
+                PageTracking.entry_time, PageTracking.session_id
+            ).distinct().order_by(PageTracking.session_id).limit(limit)
+            if after_session_id is not None:
+                sessions = sessions.where(
+                    PageTracking.session_id > after_session_id)
+            stmt = stmt.where(PageTracking.session_id.in_(
+                select(sessions.subquery().c.session_id)))
+
+        with engine.connect() as connection:
+            result = connection.execution_options(
+                stream_results=True,
+                yield_per=Config.JOURNEY_STREAM_BATCH_ROWS
+            ).execute(stmt)
+            current_session, journey = None, []
+            for row in result:
+                if row.session_id != current_session:
+                    if current_session is not None:
+                        yield {'session_id': current_session, 'journey': journey}
+                    current_session, journey = row.session_id, []
+                journey.append({
+                    'page': row.page_identifier,
+                    'entry_time': row.entry_time.isoformat(),
+                    'exit_time': row.exit_time.isoformat() if row.exit_time else None,
+                    'time_spent': row.time_spent
+                })
+            if current_session is not None:
+                yield {'session_id': current_session, 'journey': journey}
 
     @staticmethod
     def log_page_entry(session_id, page_identifier, question_id=None, page_type=None, metadata=None):
         """Log when user enters a page"""
+        write_buffer = get_write_buffer()
+        if write_buffer:
+            try:
+                # customer_id is filled in by the buffer's flush
+                page_tracking_id = write_buffer.allocate_id(PageTracking)
+                write_buffer.enqueue(PageTracking, {
+                    'id': page_tracking_id,
+                    'session_id': session_id,
+                    'customer_id': None,
+                    'page_identifier': page_identifier,
+                    'question_id': question_id,
+                    'page_type': page_type or 'unknown',
+                    'page_metadata': metadata,
+                    'entry_time': datetime.now(),
+                    'exit_time': None,
+                    'time_spent': None
+                })
+                return page_tracking_id
+            except Exception as e:
+                print(f"Error buffering page entry: {e}")
+                return None
+
         db_session = get_db_session()
         try:
             # Get customer ID if available
@@ -600,6 +995,11 @@ class PageTrackingService:
     @staticmethod
     def log_page_exit(page_tracking_id, exit_time=None):
         """Log when user exits a page"""
+        write_buffer = get_write_buffer()
+        if write_buffer and write_buffer.close_pending_page(
+                page_tracking_id, exit_time or datetime.now()):
+            return True
+
         db_session = get_db_session()
         try:
             page_tracking = db_session.query(
@@ -623,6 +1023,88 @@ class PageTrackingService:
         finally:
             db_session.close()
 
+    @staticmethod
+    def page_exit_update(criteria):
+        """
+        UPDATE closing the matching page rows, with time_spent computed
+        server-side. Bind 'exit_at' per row; NULL means the database's now().
+        """
+        exit_at = func.coalesce(bindparam('exit_at', type_=DateTime), func.now())
+        return update(PageTracking.__table__).where(criteria).values(
+            exit_time=exit_at,
+            time_spent=cast(
+                extract('epoch', exit_at - PageTracking.entry_time), Integer)
+        )
+
+    @staticmethod
+    def log_page_transition(session_id, page_identifier, question_id=None, page_type=None, metadata=None):
+        """
+        Close the session's open page and open the next one in one statement.
+        Exit time and time_spent are computed by the database, and the open
+        page is found by session through the partial index on pages without
+        an exit_time, so clients no longer need to send page_tracking_id.
+        Transitions of one session are serialized by a transaction-scoped
+        advisory lock, so each one closes the page the previous one opened.
+        """
+        write_buffer = get_write_buffer()
+        if write_buffer:
+            write_buffer.close_pending_session_pages(session_id, datetime.now())
+
+        db_session = get_db_session()
+        try:
+            # Under READ COMMITTED two concurrent transitions would both see
+            # the same open page and each leave its new page open
+            db_session.execute(select(func.pg_advisory_xact_lock(
+                func.hashtextextended(session_id, 0))))
+            closed = PageTrackingService.page_exit_update(
+                (PageTracking.session_id == session_id) &
+                PageTracking.exit_time.is_(None)
+            ).returning(
+                PageTracking.id, PageTracking.page_identifier, PageTracking.time_spent
+            ).cte('closed_page')
+            opened = insert(PageTracking.__table__).from_select(
+                ['session_id', 'customer_id', 'page_identifier', 'question_id',
+                 'page_type', 'page_metadata', 'entry_time'],
+                select(
+                    literal(session_id),
+                    select(Lead.customer_id).where(
+                        Lead.session_id == session_id).scalar_subquery(),
+                    literal(page_identifier),
+                    literal(question_id, Integer),
+                    literal(page_type or 'unknown'),
+                    cast(literal(metadata, PageTracking.page_metadata.type),
+                         PageTracking.page_metadata.type),
+                    func.now()
+                )
+            ).returning(PageTracking.id).cte('opened_page')
+
+            rows = db_session.execute(
+                select(
+                    opened.c.id.label('opened_id'),
+                    closed.c.id.label('closed_id'),
+                    closed.c.page_identifier.label('closed_page'),
+                    closed.c.time_spent.label('closed_time_spent')
+                ).select_from(opened.outerjoin(closed, true())),
+                {'exit_at': None}
+            ).all()
+            db_session.commit()
+            return {
+                'page_tracking_id': rows[0].opened_id,
+                'closed_pages': [
+                    {
+                        'page_tracking_id': row.closed_id,
+                        'page': row.closed_page,
+                        'time_spent': row.closed_time_spent
+                    } for row in rows if row.closed_id is not None
+                ]
+            }
+        except Exception as e:
+            print(f"Error logging page transition: {e}")
+            db_session.rollback()
+            return None
+        finally:
+            db_session.close()
+
     @staticmethod
     def get_customer_journey(session_id):
         """Get complete page journey for a session"""
@@ -654,22 +1136,12 @@ class PageTrackingService:
 # New: Customer Information Form Service
 class CIFService:
     @staticmethod
-    def get_cif_completion_analytics():
-        """Aggregate CIF completion rates and breakdowns."""
-        db_session = get_db_session()
+    def get_cif_completion_analytics(filters=NO_FILTER):
+        """Aggregate CIF completion rates and breakdowns for forms started in range."""
         try:
-            from sqlalchemy import func
-            total = db_session.query(func.count(
-                CustomerInformationForm.id)).scalar()
-            completed = db_session.query(func.count(CustomerInformationForm.id)).filter(
-                CustomerInformationForm.completion_percentage >= 100.0).scalar()
-            avg_completion = db_session.query(
-                func.avg(CustomerInformationForm.completion_percentage)).scalar()
-            return {
-                'total_cif': total,
-                'completed_cif': completed,
-                'avg_completion_percentage': float(avg_completion) if avg_completion else 0.0
-            }
+            return analytics_cache.get(
+                'cif_completion', filters, ('cifs', 'leads'),
+                lambda: CIFService._cif_completion(filters))
         except Exception as e:
             print(f"Error getting CIF completion analytics: {e}")
             return {
@@ -677,9 +1149,36 @@ class CIFService:
                 'completed_cif': 0,
                 'avg_completion_percentage': 0.0
             }
+
+    @staticmethod
+    def _cif_completion(filters):
+        db_session = get_db_session()
+        try:
+            from sqlalchemy import func
+            total, completed, avg_completion = db_session.execute(filters.apply(select(
+                func.count(CustomerInformationForm.id),
+                func.count(CustomerInformationForm.id).filter(
+                    CustomerInformationForm.completion_percentage >= 100.0),
+                func.avg(CustomerInformationForm.completion_percentage)
+            ), CustomerInformationForm.created_at, CustomerInformationForm.session_id)).one()
+            return {
+                'total_cif': total,
+                'completed_cif': completed,
+                'avg_completion_percentage': float(avg_completion) if avg_completion else 0.0
+            }
         finally:
             db_session.close()
 
+    REQUIRED_FIELDS = {
+        'basic_info': ['full_name', 'email', 'phone'],
+        'business_details': ['business_name', 'business_type', 'industry'],
+        'operational_info': ['staff_size', 'monthly_sales'],
+        'technology_profile': ['current_pos', 'features_needed'],
+        'financial_info': ['annual_revenue', 'investment_capacity']
+    }
+    TOTAL_REQUIRED_FIELDS = sum(len(fields)
+                                for fields in REQUIRED_FIELDS.values())
+
     @staticmethod
     def start_cif(session_id, customer_id):
         """Start CIF process for a customer"""
@@ -695,6 +1194,7 @@ class CIFService:
                     customer_id=customer_id,
                     session_id=session_id,
                     form_data={},
+                    section_completion={},
                     completion_percentage=0.0
                 )
                 db_session.add(cif)
@@ -713,38 +1213,32 @@ class CIFService:
         """Update CIF data for a customer"""
         db_session = get_db_session()
         try:
-            cif = db_session.query(CustomerInformationForm).filter_by(
-                customer_id=customer_id
-            ).first()
-
-            if cif:
-                if section:
-                    # Update specific section
-                    current_data = cif.form_data or {}
-                    current_data[section] = form_data
-                    cif.form_data = current_data
-                else:
-                    # Update entire form data
-                    cif.form_data = form_data
-
-                # Calculate completion percentage
-                completion_percentage = CIFService._calculate_completion_percentage(
-                    cif.form_data)
-                cif.completion_percentage = completion_percentage
-
-                # Mark as completed if 100%
-                if completion_percentage >= 100.0:
-                    cif.completed_at = datetime.now()
-
-                    # Update lead table
-                    lead = db_session.query(Lead).filter_by(
-                        customer_id=customer_id).first()
-                    if lead:
-                        lead.cif_completed = True
+            if section:
+                completion_percentage = CIFService._patch_section(
+                    db_session, customer_id, section, form_data)
+            else:
+                completion_percentage = CIFService._replace_form(
+                    db_session, customer_id, form_data)
+
+            if completion_percentage is None:
+                # Forms saved before section counters existed
+                completion_percentage = CIFService._rewrite_legacy_form(
+                    db_session, customer_id, form_data, section)
+            if completion_percentage is None:
+                db_session.rollback()
+                return False
+
+            # Mark the lead once the form is complete
+            if completion_percentage >= 100.0:
+                db_session.execute(
+                    update(Lead)
+                    .where(Lead.customer_id == customer_id)
+                    .values(cif_completed=True),
+                    execution_options={'synchronize_session': False}
+                )
 
-                db_session.commit()
-                return True
-            return False
+            db_session.commit()
+            return True
         except Exception as e:
             print(f"Error updating CIF data: {e}")
             db_session.rollback()
@@ -753,34 +1247,121 @@ class CIFService:
             db_session.close()
 
     @staticmethod
-    def _calculate_completion_percentage(form_data):
-        """Calculate CIF completion percentage"""
-        if not form_data:
-            return 0.0
-
-        required_sections = [
-            'basic_info', 'business_details', 'operational_info',
-            'technology_profile', 'financial_info'
-        ]
+    def _patch_section(db_session, customer_id, section, section_data):
+        """
+        Merge one section into form_data inside the database and shift the
+        completion percentage by that section's change in completed fields.
+        Concurrent saves of different sections both survive because each
+        merge is applied to the current row under its row lock.
+        Returns the new completion percentage, or None if there is no form
+        with section counters for this customer.
+        """
+        cif = CustomerInformationForm
+        total = CIFService.TOTAL_REQUIRED_FIELDS
+        completed = CIFService._count_section_fields(section, section_data)
+
+        previous = func.coalesce(
+            cast(cast(cif.section_completion, JSONB)[section].astext, Integer), 0)
+        completed_fields = func.round(
+            cif.completion_percentage * total / 100.0) + (completed - previous)
+        completion_percentage = completed_fields * 100.0 / total
+
+        return db_session.execute(
+            update(cif)
+            .where(cif.customer_id == customer_id,
+                   cif.section_completion.isnot(None))
+            .values(
+                form_data=cast(
+                    func.coalesce(cast(cif.form_data, JSONB), cast({}, JSONB))
+                    .op('||')(func.jsonb_build_object(section, cast(section_data, JSONB))),
+                    JSON),
+                section_completion=cast(
+                    cast(cif.section_completion, JSONB)
+                    .op('||')(func.jsonb_build_object(section, completed)),
+                    JSON),
+                completion_percentage=completion_percentage,
+                completed_at=case(
+                    (completion_percentage >= 100.0, func.now()),
+                    else_=cif.completed_at)
+            )
+            .returning(cif.completion_percentage),
+            execution_options={'synchronize_session': False}
+        ).scalar()
 
-        required_fields = {
-            'basic_info': ['full_name', 'email', 'phone'],
-            'business_details': ['business_name', 'business_type', 'industry'],
-            'operational_info': ['staff_size', 'monthly_sales'],
-            'technology_profile': ['current_pos', 'features_needed'],
-            'financial_info': ['annual_revenue', 'investment_capacity']
+    @staticmethod
+    def _replace_form(db_session, customer_id, form_data):
+        """Overwrite the whole form; counters are computed from the new data"""
+        cif = CustomerInformationForm
+        section_completion = CIFService._section_completion(form_data)
+        completion_percentage = CIFService._percentage(section_completion)
+        values = {
+            'form_data': form_data,
+            'section_completion': section_completion,
+            'completion_percentage': completion_percentage
         }
+        if completion_percentage >= 100.0:
+            values['completed_at'] = datetime.now()
+        return db_session.execute(
+            update(cif)
+            .where(cif.customer_id == customer_id)
+            .values(**values)
+            .returning(cif.completion_percentage),
+            execution_options={'synchronize_session': False}
+        ).scalar()
+
+    @staticmethod
+    def _rewrite_legacy_form(db_session, customer_id, form_data, section):
+        """Full read-modify-write for rows without section counters"""
+        cif = db_session.query(CustomerInformationForm).filter_by(
+            customer_id=customer_id
+        ).with_for_update().first()
+        if not cif:
+            return None
+
+        if section:
+            current_data = dict(cif.form_data or {})
+            current_data[section] = form_data
+            cif.form_data = current_data
+        else:
+            cif.form_data = form_data
+
+        cif.section_completion = CIFService._section_completion(cif.form_data)
+        cif.completion_percentage = CIFService._percentage(
+            cif.section_completion)
+        if cif.completion_percentage >= 100.0:
+            cif.completed_at = datetime.now()
+        db_session.flush()
+        return cif.completion_percentage
+
+    @staticmethod
+    def _count_section_fields(section, section_data):
+        """Number of required fields filled in for one section"""
+        if not isinstance(section_data, dict):
+            return 0
+        return sum(1 for field in CIFService.REQUIRED_FIELDS.get(section, [])
+                   if section_data.get(field))
 
-        total_fields = sum(len(fields) for fields in required_fields.values())
-        completed_fields = 0
+    @staticmethod
+    def _section_completion(form_data):
+        """Completed required fields per section present in form_data"""
+        return {
+            section: CIFService._count_section_fields(section, section_data)
+            for section, section_data in (form_data or {}).items()
+        }
 
-        for section, fields in required_fields.items():
-            if section in form_data:
-                for field in fields:
-                    if field in form_data[section] and form_data[section][field]:
-                        completed_fields += 1
+    @staticmethod
+    def _percentage(section_completion):
+        completed_fields = sum(
+            count for section, count in section_completion.items()
+            if section in CIFService.REQUIRED_FIELDS)
+        return (completed_fields / CIFService.TOTAL_REQUIRED_FIELDS) * 100.0
 
-        return (completed_fields / total_fields) * 100.0
+    @staticmethod
+    def _calculate_completion_percentage(form_data):
+        """Calculate CIF completion percentage"""
+        if not form_data:
+            return 0.0
+        return CIFService._percentage(CIFService._section_completion(form_data))
 
     @staticmethod
     def get_cif_data(customer_id):
@@ -824,7 +1405,7 @@ class SessionExitService:
 
             # Calculate completion percentage
             completion_percentage = SessionExitService._calculate_session_completion(
-                session_id)
+                db_session, session_id)
 
             session_exit = SessionExit(
                 session_id=session_id,
@@ -847,52 +1428,59 @@ class SessionExitService:
             db_session.close()
 
     @staticmethod
-    def _calculate_session_completion(session_id):
+    def _calculate_session_completion(db_session, session_id):
         """Calculate what percentage of the session was completed"""
-        db_session = get_db_session()
         try:
-            # Get total required questions
-            questions = QuestionService.get_questions()
-            required_questions = [q['id']
-                                  for q in questions if q.get('required', True)]
-            total_required = len(required_questions)
+            answered_count = LeadService.get_answered_mask(
+                session_id, db_session).bit_count()
+            return SessionExitService._completion_from_answer_count(
+                answered_count)
+        except Exception as e:
+            print(f"Error calculating session completion: {e}")
+            return 0.0
 
-            # Get total answers provided (simplified approach)
-            answered_count = db_session.query(Answer).filter_by(
-                session_id=session_id
-            ).count()
+    @staticmethod
+    def _completion_from_answer_count(answered_count):
+        """Convert a session's answer count into a completion percentage"""
+        # Use a reasonable baseline for completion calculation
+        max_expected_answers = 7  # Based on typical question flow
 
-            # Use a reasonable baseline for completion calculation
-            max_expected_answers = 7  # Based on typical question flow
+        if max_expected_answers == 0:
+            return 100.0
 
-            if max_expected_answers == 0:
-                return 100.0
+        return min((answered_count / max_expected_answers) * 100.0, 100.0)
 
-            completion_percentage = min(
-                (answered_count / max_expected_answers) * 100.0, 100.0)
-            return completion_percentage
+    @staticmethod
+    def get_abandonment_analytics(filters=NO_FILTER):
+        """Get analytics on where users typically abandon sessions"""
+        try:
+            return analytics_cache.get(
+                'abandonment', filters, ('exits', 'leads'),
+                lambda: SessionExitService._abandonment(filters))
         except Exception as e:
-            print(f"Error calculating session completion: {e}")
-            return 0.0
-        finally:
-            db_session.close()
+            print(f"Error getting abandonment analytics: {e}")
+            return {'common_exit_points': [], 'completion_by_reason': []}
 
     @staticmethod
-    def get_abandonment_analytics():
-        """Get analytics on where users typically abandon sessions"""
+    def _abandonment(filters):
+        if Config.ANALYTICS_ROLLUPS_ENABLED:
+            return analytics_rollups.abandonment(filters)
+
         db_session = get_db_session()
         try:
             # Get most common exit points
             from sqlalchemy import func
-            exit_points = db_session.query(
+            exit_points = filters.apply(db_session.query(
                 SessionExit.exit_question_id,
                 SessionExit.exit_page,
                 func.count(SessionExit.id).label('count')
+            ), SessionExit.exit_time, SessionExit.session_id
             ).group_by(SessionExit.exit_question_id, SessionExit.exit_page).all()
 
-            completion_by_reason = db_session.query(
+            completion_by_reason = filters.apply(db_session.query(
                 SessionExit.exit_reason,
                 func.avg(SessionExit.session_completion_percentage).label('avg_completion')
+            ), SessionExit.exit_time, SessionExit.session_id
             ).group_by(SessionExit.exit_reason).all()
 
             return {
@@ -910,24 +1498,362 @@ class SessionExitService:
                     } for reason in completion_by_reason
                 ]
             }
+        finally:
+            db_session.close()
+
+
+# New: Dashboard analytics computed in the database
+class AnalyticsService:
+    @staticmethod
+    def get_leads_analytics(filters=NO_FILTER):
+        """
+        Lead counts by type, conversion rate, average score and completion
+        rate from one aggregate query, so the cost is a single round trip.
+        filters selects leads created (and conversions logged) in its range.
+        """
+        return analytics_cache.get(
+            'leads', filters, ('leads', 'behaviors'),
+            lambda: AnalyticsService._leads_analytics(filters))
+
+    @staticmethod
+    def _leads_analytics(filters):
+        if Config.ANALYTICS_ROLLUPS_ENABLED:
+            return AnalyticsService._format_leads_analytics(
+                analytics_rollups.lead_totals(filters))
+
+        db_session = get_db_session()
+        try:
+            required_mask = get_workflow().required_mask
+            conversions = filters.apply(
+                select(func.count(UserBehavior.id)).where(
+                    UserBehavior.action == 'ab_test_conversion'),
+                UserBehavior.created_at, UserBehavior.session_id).scalar_subquery()
+            row = db_session.execute(filters.apply(select(
+                func.count(Lead.id).label('total_leads'),
+                func.count(Lead.id).filter(
+                    Lead.lead_type == 'SQL').label('sql_leads'),
+                func.count(Lead.id).filter(
+                    Lead.lead_type == 'MQL').label('mql_leads'),
+                func.count(Lead.id).filter(
+                    Lead.lead_type == 'Unqualified').label('unqualified_leads'),
+                func.coalesce(func.sum(func.coalesce(Lead.lead_score, 0)), 0
+                              ).label('score_sum'),
+                # Leads who answered all required questions
+                func.count(Lead.id).filter(
+                    Lead.answered_mask.op('&')(required_mask) == required_mask
+                ).label('completed'),
+                conversions.label('conversions')
+            ), Lead.created_at)).one()
+        finally:
+            db_session.close()
+        return AnalyticsService._format_leads_analytics(dict(row._mapping))
+
+    @staticmethod
+    def get_answer_time_analytics(filters=NO_FILTER):
+        """
+        Answer counts and time_taken average and p50/p90/p99 per question.
+        The percentiles come from merged t-digests built by the rollup
+        compactor; without rollups they are left out and listed under
+        unavailable_metrics rather than sorted from raw answers.
+        """
+        try:
+            return analytics_cache.get(
+                'answer_times', filters, ('answers', 'leads'),
+                lambda: AnalyticsService._answer_times(filters))
         except Exception as e:
-            print(f"Error getting abandonment analytics: {e}")
-            return {'common_exit_points': [], 'completion_by_reason': []}
+            print(f"Error getting answer time analytics: {e}")
+            return {'answer_times': []}
+
+    @staticmethod
+    def _answer_times(filters):
+        if Config.ANALYTICS_ROLLUPS_ENABLED:
+            return {'answer_times': analytics_rollups.answer_times(filters)}
+        db_session = get_db_session()
+        try:
+            rows = db_session.execute(filters.apply(select(
+                Answer.question_id,
+                func.count(Answer.id).label('answers'),
+                func.count(Answer.time_taken).label('timed_answers'),
+                func.avg(Answer.time_taken).label('avg_time')
+            ), Answer.created_at, Answer.session_id).group_by(Answer.question_id)
+                .order_by(Answer.question_id)).all()
         finally:
             db_session.close()
+        return {'answer_times': [{
+            'question_id': row.question_id,
+            'answers': row.answers,
+            'timed_answers': row.timed_answers,
+            'avg_time_taken': float(row.avg_time) if row.avg_time is not None else None
+        } for row in rows], 'unavailable_metrics': {'time_taken_percentiles': ROLLUPS_REQUIRED}}
+
+    @staticmethod
+    def get_question_funnel(filters=NO_FILTER):
+        """
+        Question-step funnel (see funnel.py) from one ordered scan over the
+        union of session starts, answers, skips and non-completed exits,
+        streamed into column arrays.
+        """
+        workflow = get_workflow()
+        try:
+            return analytics_cache.get(
+                ('question_funnel', workflow.version), filters,
+                ('leads', 'answers', 'behaviors', 'exits'),
+                lambda: AnalyticsService._question_funnel(workflow.questions, filters))
+        except Exception as e:
+            print(f"Error getting question funnel: {e}")
+            return {'funnel': []}
+
+    @staticmethod
+    def _question_funnel(steps, filters):
+        # Skips carry their question id in the behavior's JSON metadata
+        skip_question = cast(UserBehavior.behavior_metadata,
+                             JSONB)['question_id'].astext
+        events = union_all(
+            filters.apply(select(
+                Lead.session_id, literal(START).label('kind'),
+                literal(UNKNOWN_QUESTION).label('question_id'),
+                Lead.created_at.label('at')
+            ), Lead.created_at),
+            filters.apply(select(
+                Answer.session_id, literal(ANSWER), Answer.question_id, Answer.created_at
+            ), Answer.created_at, Answer.session_id),
+            filters.apply(select(
+                UserBehavior.session_id, literal(SKIP),
+                case((skip_question.op('~')('^[0-9]{1,9}$'), cast(skip_question, Integer)),
+                     else_=UNKNOWN_QUESTION),
+                UserBehavior.created_at
+            ).where(UserBehavior.action == 'question_skipped'),
+                UserBehavior.created_at, UserBehavior.session_id),
+            filters.apply(select(
+                SessionExit.session_id, literal(EXIT),
+                func.coalesce(SessionExit.exit_question_id, UNKNOWN_QUESTION),
+                SessionExit.exit_time
+            ).where(SessionExit.exit_reason.is_distinct_from('completed')),
+                SessionExit.exit_time, SessionExit.session_id)
+        ).subquery()
+        stmt = select(events).order_by(
+            events.c.session_id, events.c.at.nulls_first(), events.c.kind)
+
+        with engine.connect() as connection:
+            result = connection.execution_options(
+                stream_results=True,
+                yield_per=Config.JOURNEY_STREAM_BATCH_ROWS
+            ).execute(stmt)
+            funnel_events = FunnelEvents.from_chunks(
+                zip(*rows) for rows in result.partitions())
+        return {'funnel': compute_funnel(funnel_events, steps)}
+
+    @staticmethod
+    def get_cohort_analytics(filters=NO_FILTER):
+        """Signup day x utm_source cohorts from the in-memory lead snapshot"""
+        try:
+            cohorts = cohort_matrix(lead_snapshot.get(), filters)
+        except Exception as e:
+            print(f"Error getting cohort analytics: {e}")
+            cohorts = []
+        return {'cohorts': cohorts, 'snapshot': lead_snapshot.stats()}
+
+    @staticmethod
+    def _format_leads_analytics(totals):
+        total_leads = totals['total_leads']
+        conversion_rate = (totals['conversions'] / total_leads *
+                           100) if total_leads else 0
+        completion_rate = (totals['completed'] / total_leads *
+                           100) if total_leads else 0
+        average_score = (totals['score_sum'] /
+                         total_leads) if total_leads else 0
+        return {
+            "total_leads": total_leads,
+            "sql_leads": totals['sql_leads'],
+            "mql_leads": totals['mql_leads'],
+            "unqualified_leads": totals['unqualified_leads'],
+            "conversion_rate": round(float(conversion_rate), 2),
+            "average_score": round(float(average_score), 2),
+            "completion_rate": round(float(completion_rate), 2)
+        }
+
+
+# New: Batched event ingestion
+class EventBatchService:
+    @staticmethod
+    def ingest_events(events):
+        """
+        Ingest an ordered list of mixed tracking events in one transaction.
+
+        Each event is a dict with a 'type' of behavior, page_entry, page_exit
+        or session_exit plus the fields of the matching single-event endpoint.
+        Rows are written with multi-row INSERTs and each session's score
+        changes are summed and applied once. A page_exit without
+        page_tracking_id closes the session's latest page_entry from the same
+        batch, or its open pages if the batch has none.
+        Returns the created page_tracking ids (in page_entry order) and the
+        updated score per session, or None on failure.
+        """
+        db_session = get_db_session()
+        try:
+            result = EventBatchService.write_events(db_session, events)
+            db_session.commit()
+            return result
+        except Exception as e:
+            logging.error(f"Error ingesting event batch: {e}")
+            db_session.rollback()
+            return None
+        finally:
+            db_session.close()
+
+    @staticmethod
+    def write_events(db_session, events):
+        """
+        Write a batch of events inside the caller's transaction (see
+        ingest_events). A page_entry may carry a pre-allocated
+        page_tracking_id, which is inserted as its primary key.
+        """
+        now = datetime.now()
+        scoring_map = ScoringService.get_scoring_map()
+        behaviors, entries, exits, session_exits = [], [], [], []
+        score_deltas = {}
+        for event in events:
+            event_type = event['type']
+            if event_type == 'behavior':
+                score_change = scoring_map.get(event['action'], 0)
+                behaviors.append({
+                    'session_id': event['session_id'],
+                    'action': event['action'],
+                    'score_change': score_change,
+                    'behavior_metadata': json.dumps(event['metadata']) if event.get('metadata') else None,
+                    'created_at': event.get('timestamp') or now
+                })
+                if score_change:
+                    score_deltas[event['session_id']] = score_deltas.get(
+                        event['session_id'], 0) + score_change
+            elif event_type == 'page_entry':
+                entries.append(event)
+            elif event_type == 'page_exit':
+                # Remember how many entries preceded the exit in the batch
+                exits.append((event, len(entries)))
+            elif event_type == 'session_exit':
+                session_exits.append(event)
+            else:
+                raise ValueError(f"Unknown event type: {event_type}")
+
+        # One lookup for the customer IDs of every session in the batch
+        lookup_ids = {e['session_id'] for e in entries + session_exits}
+        customer_ids, answered_masks = {}, {}
+        if lookup_ids:
+            for lead in db_session.query(
+                Lead.session_id, Lead.customer_id, Lead.answered_mask
+            ).filter(Lead.session_id.in_(lookup_ids)):
+                customer_ids[lead.session_id] = lead.customer_id
+                answered_masks[lead.session_id] = lead.answered_mask
+
+        if behaviors:
+            db_session.execute(insert(UserBehavior), behaviors)
+
+        # Resolve exits: by explicit id, by a page_entry earlier in this batch,
+        # or else by closing pages already open for the session. The last kind
+        # runs before this batch's entries are inserted so it cannot close them.
+        exits_by_id, exits_by_session, exits_by_entry = [], [], []
+        for event, entries_before in exits:
+            if event.get('page_tracking_id') is not None:
+                exits_by_id.append({
+                    'target_id': event['page_tracking_id'],
+                    'exit_at': event.get('timestamp')
+                })
+                continue
+            entry_index = EventBatchService._latest_batch_entry(
+                entries, entries_before, event.get('session_id'))
+            if entry_index is not None:
+                exits_by_entry.append((entry_index, event.get('timestamp')))
+            elif event.get('session_id'):
+                exits_by_session.append({
+                    'target_session': event['session_id'],
+                    'exit_at': event.get('timestamp')
+                })
+        if exits_by_session:
+            db_session.execute(
+                PageTrackingService.page_exit_update(
+                    (PageTracking.session_id == bindparam('target_session')) &
+                    PageTracking.exit_time.is_(None)),
+                exits_by_session)
+
+        page_rows = [{
+            'session_id': e['session_id'],
+            'customer_id': customer_ids.get(e['session_id']),
+            'page_identifier': e['page_identifier'],
+            'question_id': e.get('question_id'),
+            'page_type': e.get('page_type') or 'unknown',
+            'page_metadata': e.get('metadata'),
+            'entry_time': e.get('timestamp') or now
+        } for e in entries]
+        page_tracking_ids = [e.get('page_tracking_id') for e in entries]
+        preassigned = [dict(row, id=page_id) for row, page_id
+                       in zip(page_rows, page_tracking_ids) if page_id is not None]
+        new_indexes = [index for index, page_id
+                       in enumerate(page_tracking_ids) if page_id is None]
+        if preassigned:
+            db_session.execute(insert(PageTracking), preassigned)
+        if new_indexes:
+            result = db_session.execute(
+                insert(PageTracking).returning(
+                    PageTracking.id, sort_by_parameter_order=True),
+                [page_rows[index] for index in new_indexes])
+            for index, row in zip(new_indexes, result):
+                page_tracking_ids[index] = row.id
+
+        exits_by_id.extend({
+            'target_id': page_tracking_ids[entry_index],
+            'exit_at': exit_at
+        } for entry_index, exit_at in exits_by_entry)
+        if exits_by_id:
+            db_session.execute(
+                PageTrackingService.page_exit_update(
+                    PageTracking.id == bindparam('target_id')),
+                exits_by_id)
+
+        if session_exits:
+            db_session.execute(insert(SessionExit), [{
+                'session_id': e['session_id'],
+                'customer_id': customer_ids.get(e['session_id']),
+                'exit_question_id': e.get('exit_question_id'),
+                'exit_page': e.get('exit_page'),
+                'exit_reason': e.get('exit_reason') or 'abandoned',
+                'session_completion_percentage': SessionExitService._completion_from_answer_count(
+                    (answered_masks.get(e['session_id']) or 0).bit_count()),
+                'last_action': e.get('last_action'),
+                'exit_metadata': e.get('metadata'),
+                'exit_time': e.get('timestamp') or now
+            } for e in session_exits])
+
+        scores = {}
+        for session_id, delta in score_deltas.items():
+            result = LeadService.apply_score_delta(
+                db_session, session_id, delta)
+            if result:
+                scores[session_id] = {
+                    'lead_score': result[0], 'lead_type': result[1]}
+
+        return {
+            'accepted': len(events),
+            'page_tracking_ids': page_tracking_ids,
+            'scores': scores
+        }
+
+    @staticmethod
+    def _latest_batch_entry(entries, entries_before, session_id):
+        """Find the index of the session's last page_entry before an exit event"""
+        for index in range(entries_before - 1, -1, -1):
+            if entries[index]['session_id'] == session_id:
+                return index
+        return None
 
 
 class ConditionalResponseService:
     @staticmethod
     def handle_greeting_response(session_id, answer_text):
         """Handle different responses to the greeting question"""
-        from workflow_config import WORKFLOW_CONFIG
-
-        greeting_responses = WORKFLOW_CONFIG.get('greeting_responses', {})
-
-        if answer_text in greeting_responses:
-            response_config = greeting_responses[answer_text]
+        response_config = get_workflow().greeting_responses.get(answer_text)
 
+        if response_config:
             if response_config['response_type'] == 'about_info':
                 # Return information about the service
                 return {
@@ -962,13 +1888,4 @@ class ConditionalResponseService:
     @staticmethod
     def get_next_question_after_greeting(session_id, next_action):
         """Get the appropriate next question based on the action"""
-        if next_action == 'continue_to_business_type':
-            # Return business type question (id: 2)
-            questions = QuestionService.get_questions()
-            business_type_question = next(
-                (q for q in questions if q['id'] == 2), None)
-            return business_type_question
-        elif next_action == 'end_session':
-            return None
-
-        return None
+        return get_workflow().greeting_next_question.get(next_action)
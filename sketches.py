@@ -0,0 +1,190 @@
+"""
+Mergeable probabilistic sketches
+HyperLogLog estimates the number of distinct values in a stream with a fixed
+number of small registers, and two sketches merge by taking the register
+maximum, so per-bucket sketches can be combined over any range of buckets.
+TDigest does the same for quantiles (p50/p90/p99) with a bounded number of
+weighted centroids.
+
+Hashes are 64-bit: the low PRECISION bits pick the register and the rank is
+the position of the first set bit in the remaining high bits. This matches
+the SQL in analytics_rollups, which hashes session ids with Postgres'
+hashtextextended() and stores the registers per rollup bucket.
+"""
+
+import hashlib
+import numpy as np
+
+HLL_PRECISION = 12  # 4096 registers, ~1.6% standard error
+TDIGEST_COMPRESSION = 200  # ~100 centroids per digest
+_SPARSE, _DENSE = b'S', b'D'
+
+
+class HyperLogLog:
+    """HyperLogLog distinct counter over 64-bit hashes"""
+
+    def __init__(self, precision=HLL_PRECISION, registers=None):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = np.zeros(self.size, dtype=np.uint8) if registers is None \
+            else np.asarray(registers, dtype=np.uint8)
+
+    @classmethod
+    def from_ranks(cls, indexes, ranks, precision=HLL_PRECISION):
+        """Build from (register index, rank) pairs, e.g. aggregated in SQL"""
+        sketch = cls(precision)
+        sketch.update_ranks(indexes, ranks)
+        return sketch
+
+    def update_ranks(self, indexes, ranks):
+        np.maximum.at(self.registers, np.asarray(indexes, dtype=np.int64),
+                      np.asarray(ranks, dtype=np.uint8))
+
+    def add_hashes(self, hashes):
+        """Add an array of 64-bit hashes (signed or unsigned)"""
+        hashes = np.asarray(hashes).astype(np.uint64)
+        indexes = hashes & np.uint64(self.size - 1)
+        remaining = hashes >> np.uint64(self.precision)
+        width = 64 - self.precision
+        # Rank = leading zeros of the width-bit remainder + 1; bit length by
+        # binary search so it stays exact for every 64-bit value
+        bit_length = np.zeros(len(hashes), dtype=np.int64)
+        for shift in (32, 16, 8, 4, 2, 1):
+            high = remaining >= (np.uint64(1) << np.uint64(shift))
+            bit_length[high] += shift
+            remaining = np.where(high, remaining >> np.uint64(shift), remaining)
+        bit_length += (remaining > 0)
+        self.update_ranks(indexes, width - bit_length + 1)
+
+    def add(self, value):
+        digest = hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest()
+        self.add_hashes(np.frombuffer(digest, dtype='<u8'))
+
+    def merge(self, other):
+        """Fold other into this sketch (the union of both streams)"""
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    @classmethod
+    def union(cls, sketches):
+        """One sketch of all sketches' streams: a single max over their stacked registers"""
+        sketches = list(sketches)
+        return cls(sketches[0].precision,
+                   np.max(np.stack([sketch.registers for sketch in sketches]), axis=0))
+
+    def count(self):
+        """Estimated number of distinct values"""
+        m = self.size
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate while many registers are empty
+            estimate = m * np.log(m / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self):
+        """Sparse (index, rank) pairs while few registers are set, else dense"""
+        nonzero = np.flatnonzero(self.registers)
+        if len(nonzero) * 3 < self.size:
+            pairs = np.empty(len(nonzero), dtype=[('index', '<u2'), ('rank', 'u1')])
+            pairs['index'] = nonzero
+            pairs['rank'] = self.registers[nonzero]
+            return _SPARSE + bytes([self.precision]) + pairs.tobytes()
+        return _DENSE + bytes([self.precision]) + self.registers.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        kind, precision, body = data[:1], data[1], data[2:]
+        if kind == _DENSE:
+            return cls(precision, np.frombuffer(body, dtype=np.uint8).copy())
+        pairs = np.frombuffer(body, dtype=[('index', '<u2'), ('rank', 'u1')])
+        return cls.from_ranks(pairs['index'], pairs['rank'], precision)
+
+
+class TDigest:
+    """
+    Mergeable quantile sketch (t-digest with the arcsine scale function).
+    Values are kept as weighted centroids, small near the tails and large in
+    the middle, so extreme quantiles stay accurate with about
+    compression / 2 centroids whatever the number of values.
+    """
+
+    def __init__(self, compression=TDIGEST_COMPRESSION, means=(), weights=(),
+                 minimum=np.inf, maximum=-np.inf):
+        self.compression = compression
+        self.means = np.asarray(means, dtype=np.float64)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.minimum = float(minimum)
+        self.maximum = float(maximum)
+
+    @classmethod
+    def from_values(cls, values, compression=TDIGEST_COMPRESSION):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        digest = cls(compression)
+        if len(values):
+            digest._compress(values, np.ones(len(values)),
+                             values.min(), values.max())
+        return digest
+
+    @property
+    def count(self):
+        return float(self.weights.sum())
+
+    def merge(self, other):
+        """Fold other into this digest"""
+        if other.count:
+            self._compress(np.concatenate((self.means, other.means)),
+                           np.concatenate((self.weights, other.weights)),
+                           min(self.minimum, other.minimum),
+                           max(self.maximum, other.maximum))
+        return self
+
+    @classmethod
+    def union(cls, digests):
+        """One digest of all digests' values, compressed once"""
+        digests = [digest for digest in digests if digest.count]
+        if not digests:
+            return cls()
+        union = cls(digests[0].compression)
+        union._compress(np.concatenate([digest.means for digest in digests]),
+                        np.concatenate([digest.weights for digest in digests]),
+                        min(digest.minimum for digest in digests),
+                        max(digest.maximum for digest in digests))
+        return union
+
+    def _compress(self, means, weights, minimum, maximum):
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+        total = weights.sum()
+        # Centroids whose midpoints share a unit of the scale k(q) merge;
+        # k(q) = compression / (2 pi) * asin(2q - 1)
+        midpoints = (np.cumsum(weights) - weights / 2) / total
+        scale = self.compression / (2 * np.pi) * np.arcsin(2 * midpoints - 1)
+        groups = np.floor(scale - scale[0]).astype(np.int64)
+        _, groups = np.unique(groups, return_inverse=True)
+        self.weights = np.bincount(groups, weights=weights)
+        self.means = np.bincount(groups, weights=means * weights) / self.weights
+        self.minimum, self.maximum = float(minimum), float(maximum)
+
+    def quantile(self, q):
+        """Estimated q-quantile (None if the digest is empty)"""
+        if not self.count:
+            return None
+        if len(self.means) == 1:
+            return float(self.means[0])
+        centers = np.cumsum(self.weights) - self.weights / 2
+        positions = np.concatenate(([0.0], centers, [self.count]))
+        values = np.concatenate(([self.minimum], self.means, [self.maximum]))
+        return float(np.interp(q * self.count, positions, values))
+
+    def to_bytes(self):
+        header = np.array([self.compression, self.minimum, self.maximum], dtype='<f8')
+        return header.tobytes() + np.stack((self.means, self.weights)).astype('<f8').tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        compression, minimum, maximum = np.frombuffer(data[:24], dtype='<f8')
+        centroids = np.frombuffer(data[24:], dtype='<f8').reshape(2, -1)
+        return cls(compression, centroids[0], centroids[1], minimum, maximum)
@@ -0,0 +1,62 @@
+"""
+Pre-encoded JSON responses for static workflow config
+Endpoints such as /api/questions serve the same WORKFLOW_CONFIG data on
+every widget load. The body is encoded once per workflow version and served
+as bytes with a strong ETag, and a matching If-None-Match gets a bodiless
+304. Reloading the workflow (workflow_index.reload_workflow) changes the
+version, which rebuilds the bodies on next use.
+"""
+
+import hashlib
+import json
+import threading
+from fastapi import Request, Response
+from workflow_index import get_workflow
+from config import Config
+
+_encoded = {}  # name -> (workflow version, body, etag)
+_lock = threading.Lock()
+
+
+def encode_json(payload):
+    """Encode like FastAPI's JSONResponse and derive a strong ETag"""
+    body = json.dumps(payload, ensure_ascii=False, allow_nan=False,
+                      separators=(',', ':')).encode('utf-8')
+    return body, '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def _encoded_for(name, build):
+    workflow = get_workflow()
+    cached = _encoded.get(name)
+    if cached and cached[0] == workflow.version:
+        return cached[1], cached[2]
+    with _lock:
+        cached = _encoded.get(name)
+        if cached and cached[0] == workflow.version:
+            return cached[1], cached[2]
+        body, etag = encode_json(build(workflow))
+        _encoded[name] = (workflow.version, body, etag)
+        return body, etag
+
+
+def _etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    # Weak comparison is what If-None-Match specifies
+    return '*' in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def static_json_response(request: Request, name, build):
+    """
+    Serve build(workflow)'s JSON from the per-version byte cache, or 304 if
+    the client already has it.
+    """
+    body, etag = _encoded_for(name, build)
+    headers = {
+        'ETag': etag,
+        'Cache-Control': f"public, max-age={Config.STATIC_CONFIG_MAX_AGE_SECONDS}"
+    }
+    if _etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type='application/json', headers=headers)
@@ -0,0 +1,113 @@
+import threading
+import time
+from datetime import datetime
+from analytics_cache import AnalyticsCache
+from analytics_filters import AnalyticsFilter, NO_FILTER
+
+
+class Watermarks:
+    def __init__(self):
+        self.marks = {'leads': (1, None, None), 'pages': (1, None, None)}
+        self.reads = 0
+
+    def __call__(self):
+        self.reads += 1
+        return dict(self.marks)
+
+
+def test_result_reused_until_its_sources_move():
+    watermarks = Watermarks()
+    cache = AnalyticsCache(100, 60, watermark_reader=watermarks)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {'total': len(calls)}
+
+    assert cache.get('leads', NO_FILTER, ('leads',), compute) == {'total': 1}
+    assert cache.get('leads', NO_FILTER, ('leads',), compute) == {'total': 1}
+    # Another filter is another entry
+    other = AnalyticsFilter(utm_source='google')
+    assert cache.get('leads', other, ('leads',), compute) == {'total': 2}
+
+    # A table the result does not read moving keeps it (marks re-read now)
+    watermarks.marks['pages'] = (2, None, None)
+    cache._watermarks = None
+    assert cache.get('leads', NO_FILTER, ('leads',), compute) == {'total': 1}
+    watermarks.marks['leads'] = (2, None, None)
+    cache._watermarks = None
+    assert cache.get('leads', NO_FILTER, ('leads',), compute) == {'total': 3}
+    assert cache.get('leads', NO_FILTER, ('leads',), compute) == {'total': 3}
+    assert cache.stats()['invalidations'] == 1
+
+    cache.clear()
+    assert cache.get('leads', NO_FILTER, ('leads',), compute) == {'total': 4}
+
+
+def test_watermarks_read_at_most_once_per_staleness_bound():
+    watermarks = Watermarks()
+    cache = AnalyticsCache(100, 0.05, watermark_reader=watermarks)
+    cache.get('leads', NO_FILTER, ('leads',), lambda: 1)
+    watermarks.marks['leads'] = (2, None, None)
+    # Within the bound the old marks (and result) are still served
+    assert cache.get('leads', NO_FILTER, ('leads',), lambda: 2) == 1
+    assert watermarks.reads == 1
+    time.sleep(0.06)
+    assert cache.get('leads', NO_FILTER, ('leads',), lambda: 2) == 2
+    assert watermarks.reads == 2
+
+
+def test_window_keyed_by_name_and_expires():
+    watermarks = Watermarks()
+    cache = AnalyticsCache(100, 0.05, watermark_reader=watermarks)
+    first = AnalyticsFilter.from_params(window='24h', now=datetime(2024, 5, 1, 12))
+    later = AnalyticsFilter.from_params(window='24h', now=datetime(2024, 5, 1, 12, 0, 10))
+    assert first.cache_key == later.cache_key
+    assert cache.get('leads', first, ('leads',), lambda: 'a') == 'a'
+    assert cache.get('leads', later, ('leads',), lambda: 'b') == 'a'
+    time.sleep(0.06)
+    assert cache.get('leads', later, ('leads',), lambda: 'b') == 'b'
+
+
+def test_concurrent_misses_compute_once():
+    cache = AnalyticsCache(100, 60, watermark_reader=Watermarks())
+    started = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        time.sleep(0.05)
+        return 'value'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+        cache.get('funnel', NO_FILTER, ('leads',), compute))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ['value'] * 8
+    assert len(calls) == 1
+    assert not cache._key_locks
+
+
+def test_failed_computation_is_not_cached():
+    cache = AnalyticsCache(100, 60, watermark_reader=Watermarks())
+
+    def fail():
+        raise RuntimeError("database down")
+
+    try:
+        cache.get('leads', NO_FILTER, ('leads',), fail)
+    except RuntimeError:
+        pass
+    assert cache.get('leads', NO_FILTER, ('leads',), lambda: 'ok') == 'ok'
+
+
+def test_disabled_always_computes():
+    watermarks = Watermarks()
+    cache = AnalyticsCache(100, 0, watermark_reader=watermarks)
+    assert cache.get('leads', NO_FILTER, ('leads',), lambda: 1) == 1
+    assert cache.get('leads', NO_FILTER, ('leads',), lambda: 2) == 2
+    assert watermarks.reads == 0
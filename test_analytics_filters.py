@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+from analytics_filters import AnalyticsFilter
+from models import PageTracking, PageRollup
+from router import router
+
+
+def _sql(stmt):
+    return str(stmt.compile(dialect=postgresql.dialect(),
+                            compile_kwargs={'literal_binds': True}))
+
+
+def test_window_ends_now():
+    now = datetime(2024, 5, 10, 12, 0)
+    filters = AnalyticsFilter.from_params(window='7d', now=now)
+    assert filters.start == now - timedelta(days=7)
+    assert filters.end == now
+
+
+def test_rejects_bad_ranges():
+    with pytest.raises(ValueError):
+        AnalyticsFilter.from_params(datetime(2024, 5, 2), datetime(2024, 5, 1))
+    with pytest.raises(ValueError):
+        AnalyticsFilter.from_params(start=datetime(2024, 5, 1), window='24h')
+
+
+def test_aware_datetimes_become_local():
+    aware = datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc)
+    assert AnalyticsFilter(aware).start == aware.astimezone().replace(tzinfo=None)
+
+
+def test_raw_and_rollup_bounds():
+    filters = AnalyticsFilter(datetime(2024, 5, 1, 3, 30), datetime(2024, 5, 1, 6, 15), 'google')
+
+    raw = _sql(filters.apply(select(PageTracking.id),
+                             PageTracking.entry_time, PageTracking.session_id))
+    assert "page_tracking.entry_time >= '2024-05-01 03:30:00'" in raw
+    assert "page_tracking.entry_time < '2024-05-01 06:15:00'" in raw
+    assert "leads.utm_source = 'google'" in raw
+
+    rollup = _sql(filters.apply_buckets(select(PageRollup.views), PageRollup))
+    assert "bucket >= '2024-05-01 03:00:00'" in rollup
+    assert "bucket < '2024-05-01 07:00:00'" in rollup
+    assert "analytics_page_rollups.utm_source = 'google'" in rollup
+
+
+def test_endpoint_rejects_invalid_range():
+    app = FastAPI()
+    app.include_router(router)
+    response = TestClient(app).get(
+        "/api/analytics/cif-completion",
+        params={"from": "2024-05-02T00:00:00", "to": "2024-05-01T00:00:00"})
+    assert response.status_code == 400
+
+
+def test_bucket_ranges_split_whole_days_from_partial_hours():
+    hours, days = AnalyticsFilter(datetime(2024, 5, 1, 13, 20), datetime(2024, 5, 4, 2, 10)).bucket_ranges()
+    assert hours == [(datetime(2024, 5, 1, 13), datetime(2024, 5, 2)),
+                     (datetime(2024, 5, 4), datetime(2024, 5, 4, 3))]
+    assert days == (datetime(2024, 5, 2), datetime(2024, 5, 4))
+
+    # Within one day: hours only
+    hours, days = AnalyticsFilter(datetime(2024, 5, 1, 1), datetime(2024, 5, 1, 5)).bucket_ranges()
+    assert hours == [(datetime(2024, 5, 1, 1), datetime(2024, 5, 1, 5))] and days is None
+
+    # Open ends read whole days, including the current one
+    assert AnalyticsFilter().bucket_ranges() == ([], (None, None))
+    assert AnalyticsFilter(start=datetime(2024, 5, 1)).bucket_ranges() == \
+        ([], (datetime(2024, 5, 1), None))
@@ -0,0 +1,59 @@
+from datetime import datetime
+import numpy as np
+from analytics_filters import AnalyticsFilter
+from cohorts import LeadSnapshot, SnapshotHolder, cohort_matrix
+
+NAN = float('nan')
+
+
+def _snapshot():
+    return LeadSnapshot(
+        created_at=[datetime(2024, 5, 1, 9), datetime(2024, 5, 1, 10), datetime(2024, 5, 1, 11),
+                    datetime(2024, 5, 2, 9), datetime(2024, 5, 2, 23)],
+        source_codes=[0, 0, 1, 0, 0],
+        sources=['google', ''],
+        lead_types=[2, 1, 0, 2, 0],
+        scores=[80, 40, 10, 90, 20],
+        hours_to_sql=[2.0, NAN, NAN, 6.0, NAN])
+
+
+def test_cohorts_by_day_and_source():
+    rows = cohort_matrix(_snapshot())
+    assert [(row['day'], row['utm_source'], row['leads']) for row in rows] == [
+        ('2024-05-02', 'google', 2), ('2024-05-01', None, 1), ('2024-05-01', 'google', 2)]
+
+    google_may_1 = rows[2]
+    assert google_may_1['sql_leads'] == 1 and google_may_1['mql_leads'] == 1
+    assert google_may_1['sql_rate'] == 50.0
+    assert google_may_1['average_score'] == 60.0
+    assert google_may_1['score_percentiles']['p50'] == 60.0
+    assert google_may_1['median_hours_to_sql'] == 2.0
+    assert rows[1]['median_hours_to_sql'] is None
+
+
+def test_filters_range_and_source():
+    filters = AnalyticsFilter(datetime(2024, 5, 1, 10), datetime(2024, 5, 2, 12), 'google')
+    rows = cohort_matrix(_snapshot(), filters)
+    assert [(row['day'], row['leads']) for row in rows] == [('2024-05-02', 1), ('2024-05-01', 1)]
+    assert cohort_matrix(_snapshot(), AnalyticsFilter(utm_source='bing')) == []
+
+
+def test_percentiles_match_numpy():
+    scores = np.arange(1, 12, dtype=np.float32)
+    snapshot = LeadSnapshot([datetime(2024, 5, 1)] * 11, [0] * 11, ['x'], [0] * 11,
+                            scores, [NAN] * 11)
+    percentiles = cohort_matrix(snapshot)[0]['score_percentiles']
+    assert percentiles['p90'] == round(float(np.quantile(scores, 0.9)), 2)
+
+
+def test_holder_loads_once_then_serves_cached():
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return _snapshot()
+
+    holder = SnapshotHolder(max_age_seconds=300, loader=loader)
+    assert holder.get() is holder.get()
+    assert len(loads) == 1
+    assert holder.stats()['leads'] == 5
@@ -1,3 +1,4 @@
+import uuid
 import pytest
 from fastapi.testclient import TestClient
 from main import app
@@ -20,6 +21,16 @@ def test_session_start_endpoint():
     response = client.post("/api/session/start", json={"utm_source": "test-source"})
     assert response.status_code in [200, 422]  # 422 if body validation fails
 
+def test_session_start_bulk():
+    response = client.post("/api/session/start-bulk", json={"count": 3, "utm_source": "widget"})
+    assert response.status_code in [200, 400]
+    if response.status_code == 200:
+        assert len(response.json()["session_ids"]) == 3
+
+def test_session_start_bulk_rejects_zero():
+    response = client.post("/api/session/start-bulk", json={"count": 0})
+    assert response.status_code == 400
+
 def test_next_question():
     response = client.post("/api/next-question", json={"session_id": "test-session", "last_question_id": 1})
     assert response.status_code in [200, 422]
@@ -124,6 +135,10 @@ def test_tracking_page_exit():
     response = client.post("/api/tracking/page-exit", json={"session_id": "test-session", "page": "home"})
     assert response.status_code in [200, 422]
 
+def test_tracking_page_transition():
+    response = client.post("/api/tracking/page-transition", json={"session_id": "test-session", "page_identifier": "question_2", "question_id": 2})
+    assert response.status_code in [200, 400]
+
 def test_tracking_journey():
     response = client.get("/api/tracking/journey/test-session")
     assert response.status_code in [200, 404]
@@ -167,6 +182,60 @@ def test_session_exit():
     response = client.post("/api/session/exit", json={"session_id": "test-session"})
     assert response.status_code in [200, 422]
 
+def test_events_batch():
+    session_id = client.post("/api/session/start", json={"utm_source": "test-source"}).json()["session_id"]
+    payload = {"events": [
+        {"type": "behavior", "session_id": session_id, "action": "clicked_demo"},
+        {"type": "page_entry", "session_id": session_id, "page_identifier": "home"},
+        {"type": "page_exit", "session_id": session_id},
+        {"type": "page_entry", "session_id": session_id, "page_identifier": "question_1"},
+        {"type": "behavior", "session_id": session_id, "action": "clicked_demo"},
+        {"type": "session_exit", "session_id": session_id}
+    ]}
+    response = client.post("/api/events/batch", json=payload)
+    assert response.status_code == 200
+    body = response.json()
+    assert body["accepted"] == 6
+    # session_opened (5) plus two clicked_demo (15 each), applied once
+    assert body["scores"] == {session_id: {"lead_score": 35, "lead_type": "MQL"}}
+    page_ids = body["page_tracking_ids"]
+    assert len(page_ids) == 2 and all(isinstance(page_id, int) for page_id in page_ids)
+
+    journey = client.get(f"/api/tracking/journey/{session_id}").json()["journey"]
+    pages = sorted(journey, key=lambda page: page["id"])
+    assert [(page["id"], page["page"]) for page in pages] == list(zip(page_ids, ["home", "question_1"]))
+    assert pages[0]["exit_time"] is not None and pages[1]["exit_time"] is None
+
+def test_events_batch_invalid_event():
+    response = client.post("/api/events/batch", json={"events": [{"type": "behavior", "session_id": "test-session"}]})
+    assert response.status_code == 422
+
+def test_analytics_question_funnel():
+    utm_source = f"funnel-{uuid.uuid4()}"
+    session_id = client.post("/api/session/start", json={"utm_source": utm_source}).json()["session_id"]
+    for question_id, answer in [(1, "Yes, let's start"), (2, "Retail")]:
+        response = client.post("/api/answer", json={
+            "session_id": session_id, "question_id": question_id, "answer_text": answer})
+        assert response.status_code == 200
+    response = client.post("/api/skip-question", json={"session_id": session_id, "question_id": 3})
+    assert response.status_code == 200
+
+    response = client.get("/api/analytics/question-funnel", params={"utm_source": utm_source})
+    assert response.status_code == 200
+    funnel = response.json()["funnel"]
+    assert [step["question_id"] for step in funnel] == [q["id"] for q in client.get("/api/questions").json()]
+    counts = {step["question_id"]: (step["reached"], step["answered"], step["skipped"], step["abandoned"])
+              for step in funnel}
+    assert counts[1] == (1, 1, 0, 0)
+    assert counts[2] == (1, 1, 0, 0)
+    assert counts[3] == (1, 0, 1, 0)
+    assert counts[4] == (0, 0, 0, 0)
+
+def test_write_buffer_stats():
+    response = client.get("/api/system/write-buffer")
+    assert response.status_code == 200
+    assert "enabled" in response.json()
+
 def test_analytics_drop_off_points():
     response = client.get("/api/analytics/drop-off-points")
     assert response.status_code == 200
@@ -179,6 +248,17 @@ def test_analytics_customer_journey():
     response = client.get("/api/analytics/customer-journey")
     assert response.status_code == 200
 
+def test_analytics_customer_journey_paginated():
+    response = client.get("/api/analytics/customer-journey", params={"limit": 2})
+    assert response.status_code == 200
+    assert "next_cursor" in response.json()
+    assert len(response.json()["customer_journeys"]) <= 2
+
+def test_analytics_customer_journey_ndjson():
+    response = client.get("/api/analytics/customer-journey", params={"format": "ndjson", "limit": 2})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+
 def test_analytics_cif_completion():
     response = client.get("/api/analytics/cif-completion")
     assert response.status_code == 200
@@ -6,10 +6,11 @@ table_columns = {
     'leads': [
         'id', 'session_id', 'customer_id', 'utm_source', 'lead_score', 'lead_type',
         'name', 'email', 'phone', 'business_type', 'location', 'staff_size',
-        'monthly_sales', 'features_interested', 'cif_completed', 'created_at', 'updated_at'
+        'monthly_sales', 'features_interested', 'cif_completed', 'created_at', 'updated_at',
+        'answered_mask', 'sql_at'
     ],
     'answers': [
-        'id', 'session_id', 'question_id', 'answer_text', 'created_at'
+        'id', 'session_id', 'question_id', 'answer_text', 'time_taken', 'created_at'
     ],
     'questions': [
         'id', 'text', 'score'
@@ -18,13 +19,49 @@ table_columns = {
         'id', 'session_id', 'action', 'score_change', 'behavior_metadata', 'created_at'
     ],
     'customer_information_forms': [
-        'id', 'customer_id', 'session_id', 'form_data', 'completed_at', 'completion_percentage', 'created_at', 'updated_at'
+        'id', 'customer_id', 'session_id', 'form_data', 'section_completion', 'completed_at', 'completion_percentage', 'created_at', 'updated_at'
     ],
     'page_tracking': [
-        'id', 'session_id', 'customer_id', 'page_identifier', 'question_id', 'entry_time', 'exit_time', 'time_spent', 'page_type', 'page_metadata'
+        'id', 'session_id', 'customer_id', 'page_identifier', 'question_id', 'entry_time', 'exit_time', 'time_spent', 'page_type', 'page_metadata', 'updated_at'
     ],
     'session_exits': [
         'id', 'session_id', 'customer_id', 'exit_question_id', 'exit_page', 'exit_reason', 'exit_time', 'session_completion_percentage', 'last_action', 'exit_metadata'
+    ],
+    'event_log_offsets': [
+        'name', 'segment', 'position', 'updated_at'
+    ],
+    'customer_id_counters': [
+        'day', 'last_value'
+    ],
+    'idempotency_keys': [
+        'endpoint', 'key', 'fingerprint', 'response', 'created_at'
+    ],
+    'analytics_lead_rollups': [
+        'bucket', 'utm_source', 'lead_type', 'leads', 'score_sum', 'completed'
+    ],
+    'analytics_behavior_rollups': [
+        'bucket', 'utm_source', 'action', 'events', 'score_sum'
+    ],
+    'analytics_page_rollups': [
+        'bucket', 'utm_source', 'page_identifier', 'views', 'time_spent_sum', 'time_spent_count',
+        'sessions_hll', 'time_spent_digest'
+    ],
+    'analytics_answer_rollups': [
+        'bucket', 'utm_source', 'question_id', 'answers', 'time_taken_sum', 'time_taken_count',
+        'time_taken_digest'
+    ],
+    'analytics_exit_rollups': [
+        'bucket', 'utm_source', 'exit_reason', 'exit_question_id', 'exit_page', 'exits',
+        'completion_sum', 'completion_count'
+    ],
+    'analytics_page_daily_sketches': [
+        'day', 'utm_source', 'page_identifier', 'sessions_hll', 'time_spent_digest'
+    ],
+    'analytics_answer_daily_sketches': [
+        'day', 'utm_source', 'question_id', 'time_taken_digest'
+    ],
+    'rollup_watermarks': [
+        'name', 'last_id', 'last_time', 'updated_at'
     ]
 }
 
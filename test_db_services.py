@@ -0,0 +1,319 @@
+import threading
+import uuid
+from datetime import date
+from contextlib import contextmanager
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import event, insert, select, delete
+from database import Base, engine, get_db_session
+import services
+from models import Lead, UserBehavior, PageTracking, CustomerIdCounter, CustomerInformationForm
+from services import (LeadService, PageTrackingService, CustomerIdAllocator, CustomerService,
+                      ScoringService, AnalyticsService, customer_session_cache)
+from analytics_filters import NO_FILTER
+from workflow_index import get_workflow
+import router
+
+pytestmark = pytest.mark.postgres
+
+
+@pytest.fixture(scope="module", autouse=True)
+def tables():
+    Base.metadata.create_all(engine)
+
+
+@contextmanager
+def statements():
+    """Collect the SQL statements sent to the database"""
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield executed
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+
+def new_session_id():
+    return f"test-{uuid.uuid4()}"
+
+
+def test_score_delta_updates_lead_and_inserts_event_in_one_statement():
+    session_id = new_session_id()
+    assert LeadService.create_lead(session_id, 'test')
+
+    db_session = get_db_session()
+    try:
+        with statements() as executed:
+            score, lead_type = LeadService.apply_score_delta(
+                db_session, session_id, 60,
+                event_insert=insert(UserBehavior).values(
+                    session_id=session_id, action='clicked_demo', score_change=60))
+        db_session.commit()
+    finally:
+        db_session.close()
+
+    assert len(executed) == 1
+    assert (score, lead_type) == (65, 'SQL')
+    db_session = get_db_session()
+    try:
+        lead = db_session.execute(select(Lead).filter_by(session_id=session_id)).scalar_one()
+        assert (lead.lead_score, lead.lead_type) == (65, 'SQL')
+        assert lead.sql_at is not None
+        actions = db_session.execute(select(UserBehavior.action).filter_by(
+            session_id=session_id).order_by(UserBehavior.id)).scalars().all()
+        assert actions == ['session_opened', 'clicked_demo']
+    finally:
+        db_session.close()
+
+
+def test_score_delta_for_unknown_session_returns_none():
+    session_id = new_session_id()
+    db_session = get_db_session()
+    try:
+        assert LeadService.apply_score_delta(db_session, session_id, 10) is None
+        db_session.rollback()
+    finally:
+        db_session.close()
+
+
+def test_page_transition_closes_and_opens_pages_in_one_statement():
+    session_id = new_session_id()
+    assert LeadService.create_lead(session_id, 'test')
+    first_id = PageTrackingService.log_page_entry(session_id, 'question_1', 1, 'question')
+
+    with statements() as executed:
+        result = PageTrackingService.log_page_transition(
+            session_id, 'question_2', 2, 'question')
+    # The per-session advisory lock, then one statement for both pages
+    page_statements = [sql for sql in executed if 'page_tracking' in sql]
+    assert len(executed) == 2 and len(page_statements) == 1
+    assert [page['page_tracking_id'] for page in result['closed_pages']] == [first_id]
+    assert result['closed_pages'][0]['page'] == 'question_1'
+
+    PageTrackingService.log_page_transition(session_id, 'question_3', 3, 'question')
+    db_session = get_db_session()
+    try:
+        pages = db_session.execute(select(
+            PageTracking.id, PageTracking.page_identifier, PageTracking.exit_time,
+            PageTracking.time_spent
+        ).filter_by(session_id=session_id).order_by(PageTracking.id)).all()
+    finally:
+        db_session.close()
+    assert [page.page_identifier for page in pages] == ['question_1', 'question_2', 'question_3']
+    assert pages[1].id == result['page_tracking_id']
+    # Only the latest page is still open
+    assert [page.exit_time is None for page in pages] == [False, False, True]
+    assert pages[0].time_spent is not None
+
+
+def test_concurrent_page_transitions_leave_one_open_page():
+    session_id = new_session_id()
+    assert LeadService.create_lead(session_id, 'test')
+
+    def transitions(worker):
+        for step in range(30):
+            PageTrackingService.log_page_transition(session_id, f"page_{worker}_{step}")
+
+    threads = [threading.Thread(target=transitions, args=(worker,)) for worker in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    db_session = get_db_session()
+    try:
+        open_pages = db_session.execute(select(PageTracking.id).filter_by(
+            session_id=session_id, exit_time=None)).scalars().all()
+    finally:
+        db_session.close()
+    assert len(open_pages) == 1
+
+
+def test_bulk_session_start_inserts_all_rows_with_one_insert_per_table():
+    app = FastAPI()
+    app.include_router(router.router)
+    with statements() as executed:
+        response = TestClient(app).post(
+            "/api/session/start-bulk", json={"count": 5, "utm_source": "widget"})
+    assert response.status_code == 200
+    session_ids = response.json()["session_ids"]
+    assert len(set(session_ids)) == 5
+    inserts = [sql for sql in executed if sql.lstrip().upper().startswith('INSERT')]
+    assert len(inserts) == 2
+
+    db_session = get_db_session()
+    try:
+        leads = db_session.execute(select(
+            Lead.session_id, Lead.utm_source, Lead.lead_score, Lead.lead_type
+        ).where(Lead.session_id.in_(session_ids))).all()
+        behaviors = db_session.execute(select(UserBehavior.session_id).where(
+            UserBehavior.session_id.in_(session_ids),
+            UserBehavior.action == 'session_opened')).scalars().all()
+    finally:
+        db_session.close()
+    assert sorted(lead.session_id for lead in leads) == sorted(session_ids)
+    assert {(lead.utm_source, lead.lead_score, lead.lead_type) for lead in leads} == \
+        {('widget', 5, 'Unqualified')}
+    assert sorted(behaviors) == sorted(session_ids)
+
+
+@pytest.fixture
+def allocator_days(monkeypatch):
+    """Run CustomerIdAllocator on far-future days with 3-number blocks"""
+    days = ['20990101', '20990102', '20990103']
+    today = [date(2099, 1, 1)]
+
+    class FakeDate(date):
+        @classmethod
+        def today(cls):
+            return today[0]
+
+    def reset():
+        db_session = get_db_session()
+        try:
+            db_session.execute(delete(CustomerIdCounter).where(CustomerIdCounter.day.in_(days)))
+            db_session.execute(delete(Lead).where(Lead.customer_id.like('CID_2099010%')))
+            db_session.commit()
+        finally:
+            db_session.close()
+
+    monkeypatch.setattr(services, 'date', FakeDate)
+    monkeypatch.setattr(services.Config, 'CUSTOMER_ID_BLOCK_SIZE', 3)
+    monkeypatch.setattr(CustomerIdAllocator, '_blocks', {})
+    reset()
+    yield today
+    reset()
+
+
+def counter(day):
+    db_session = get_db_session()
+    try:
+        return db_session.execute(select(CustomerIdCounter.last_value).filter_by(day=day)).scalar()
+    finally:
+        db_session.close()
+
+
+def test_customer_ids_come_from_reserved_blocks_per_day(allocator_days):
+    ids = [CustomerIdAllocator.next_customer_id() for _ in range(4)]
+    assert ids == [f"CID_20990101_000{n}" for n in range(1, 5)]
+    # Four IDs took two blocks of three
+    assert counter('20990101') == 6
+
+    allocator_days[0] = date(2099, 1, 2)
+    assert CustomerIdAllocator.next_customer_id() == "CID_20990102_0001"
+    assert list(CustomerIdAllocator._blocks) == ['20990102']
+    assert counter('20990102') == 3
+    # The previous day's counter is left as it was
+    assert counter('20990101') == 6
+
+
+def test_first_block_of_a_day_follows_ids_issued_without_a_counter(allocator_days):
+    db_session = get_db_session()
+    try:
+        db_session.execute(insert(Lead).values(
+            session_id=new_session_id(), customer_id='CID_20990103_0007'))
+        db_session.commit()
+    finally:
+        db_session.close()
+
+    allocator_days[0] = date(2099, 1, 3)
+    assert CustomerIdAllocator.next_customer_id() == "CID_20990103_0008"
+    assert counter('20990103') == 10
+
+
+def test_customer_details_come_from_one_query():
+    session_id = new_session_id()
+    assert LeadService.create_lead(session_id, 'test')
+    customer_id = CustomerService.assign_customer_id(session_id)
+    PageTrackingService.log_page_entry(session_id, 'home')
+    PageTrackingService.log_page_transition(session_id, 'question_1', 1)
+    assert ScoringService.log_behavior(session_id, 'clicked_demo') == 15
+    db_session = get_db_session()
+    try:
+        db_session.add(CustomerInformationForm(
+            customer_id=customer_id, session_id=session_id,
+            form_data={'basic_info': {'full_name': 'Ana'}}))
+        db_session.commit()
+    finally:
+        db_session.close()
+
+    with statements() as executed:
+        details = CustomerService.get_customer_details(customer_id)
+    assert len(executed) == 1
+    assert details['session_id'] == session_id
+    assert details['lead_data']['lead_score'] == 20
+    assert details['cif_data'] == {'basic_info': {'full_name': 'Ana'}}
+    assert [page['page'] for page in details['page_journey']] == ['home', 'question_1']
+    assert details['page_journey'][0]['exit_time'] is not None
+    assert [b['action'] for b in details['behaviors']] == ['session_opened', 'clicked_demo']
+    assert CustomerService.get_customer_details('CID_unknown') is None
+
+
+def test_resolve_session_id_caches_found_customers_only():
+    session_id = new_session_id()
+    assert LeadService.create_lead(session_id, 'test')
+    customer_id = CustomerService.assign_customer_id(session_id)
+    customer_session_cache.delete(customer_id)
+
+    with statements() as executed:
+        assert CustomerService.resolve_session_id(customer_id) == session_id
+        assert CustomerService.resolve_session_id(customer_id) == session_id
+    assert len(executed) == 1
+
+    with statements() as executed:
+        assert CustomerService.resolve_session_id('CID_unknown') is None
+        assert CustomerService.resolve_session_id('CID_unknown') is None
+    assert len(executed) == 2
+
+
+def per_lead_leads_analytics():
+    """/api/analytics/leads as it was computed before, one lead at a time"""
+    db_session = get_db_session()
+    try:
+        leads = db_session.query(Lead).all()
+        conversions = db_session.query(UserBehavior).filter(
+            UserBehavior.action == 'ab_test_conversion').count()
+    finally:
+        db_session.close()
+    total_leads = len(leads)
+    completed = sum(1 for lead in leads if LeadService.check_all_questions_answered(
+        lead.session_id, lead.answered_mask))
+    return {
+        "total_leads": total_leads,
+        "sql_leads": len([lead for lead in leads if lead.lead_type == 'SQL']),
+        "mql_leads": len([lead for lead in leads if lead.lead_type == 'MQL']),
+        "unqualified_leads": len([lead for lead in leads if lead.lead_type == 'Unqualified']),
+        "conversion_rate": round(conversions / total_leads * 100, 2),
+        "average_score": round(sum(lead.lead_score or 0 for lead in leads) / total_leads, 2),
+        "completion_rate": round(completed / total_leads * 100, 2)
+    }
+
+
+def test_leads_analytics_query_matches_per_lead_totals(monkeypatch):
+    monkeypatch.setattr(services.Config, 'ANALYTICS_ROLLUPS_ENABLED', False)
+    required_mask = get_workflow().required_mask
+    db_session = get_db_session()
+    try:
+        db_session.execute(insert(Lead), [
+            {'session_id': new_session_id(), 'lead_score': 70, 'lead_type': 'SQL',
+             'answered_mask': required_mask},
+            {'session_id': new_session_id(), 'lead_score': 35, 'lead_type': 'MQL',
+             'answered_mask': required_mask & (required_mask - 1)},
+            {'session_id': new_session_id(), 'lead_score': None, 'lead_type': 'Unqualified'},
+        ])
+        db_session.execute(insert(UserBehavior).values(
+            session_id=new_session_id(), action='ab_test_conversion', score_change=0))
+        db_session.commit()
+    finally:
+        db_session.close()
+
+    with statements() as executed:
+        analytics = AnalyticsService._leads_analytics(NO_FILTER)
+    assert len(executed) == 1
+    assert analytics == per_lead_leads_analytics()
+    assert analytics['sql_leads'] and analytics['mql_leads'] and analytics['unqualified_leads']
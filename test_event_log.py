@@ -0,0 +1,72 @@
+import os
+import pytest
+from event_log import (SegmentedEventLog, EventLogLockedError, open_worker_log,
+                       read_segment)
+
+
+def test_append_and_read_back_across_rotation(tmp_path):
+    log = SegmentedEventLog(str(tmp_path / "events"), segment_bytes=200)
+    for i in range(10):
+        log.append({"events": [{"type": "behavior", "session_id": f"s{i}", "action": "clicked_demo"}]})
+
+    assert len(log.segments()) > 1
+    payloads, segment, position = log.read_from(0, 0, max_records=100)
+    assert [p["events"][0]["session_id"] for p in payloads] == [f"s{i}" for i in range(10)]
+    assert segment == log.active_segment
+
+    # Resuming from the returned offset yields nothing new
+    more, _, _ = log.read_from(segment, position, max_records=100)
+    assert more == []
+    log.close()
+
+
+def test_torn_tail_and_corrupt_sealed_segment(tmp_path):
+    directory = str(tmp_path / "events")
+    log = SegmentedEventLog(directory, segment_bytes=1024 * 1024)
+    log.append({"events": [{"type": "page_exit", "page_tracking_id": 1}]})
+    log.append({"events": [{"type": "page_exit", "page_tracking_id": 2}]})
+    log.close()
+    first_path = log.segment_path(log.active_segment)
+
+    # A half-written record at the tail is ignored
+    with open(first_path, "ab") as segment_file:
+        segment_file.write(b"\x00\x00\x00\x10\x00")
+    assert len(list(read_segment(first_path))) == 2
+
+    # Flip a payload byte: the sealed segment is skipped after the bad record
+    with open(first_path, "r+b") as segment_file:
+        segment_file.seek(10)
+        byte = segment_file.read(1)
+        segment_file.seek(10)
+        segment_file.write(bytes([byte[0] ^ 0xFF]))
+
+    reopened = SegmentedEventLog(directory, segment_bytes=1024 * 1024)
+    reopened.append({"events": [{"type": "page_exit", "page_tracking_id": 3}]})
+    payloads, segment, _ = reopened.read_from(0, 0, max_records=100)
+    assert [p["events"][0]["page_tracking_id"] for p in payloads] == [3]
+    assert segment == reopened.active_segment
+
+    reopened.remove_segments_before(segment)
+    assert not os.path.exists(first_path)
+    reopened.close()
+
+
+def test_workers_claim_separate_locked_slots(tmp_path):
+    base = str(tmp_path / "events")
+    first = open_worker_log(base, segment_bytes=1024)
+    second = open_worker_log(base, segment_bytes=1024)
+    assert first.directory != second.directory
+    assert (first.name, second.name) == ("events/worker-0", "events/worker-1")
+
+    with pytest.raises(EventLogLockedError):
+        SegmentedEventLog(first.directory, segment_bytes=1024)
+
+    # A closed slot is claimed again, with its leftover segments
+    first.append({"events": [{"type": "page_exit", "page_tracking_id": 1}]})
+    first.close()
+    reopened = open_worker_log(base, segment_bytes=1024)
+    assert reopened.directory == first.directory
+    payloads, _, _ = reopened.read_from(0, 0, max_records=10)
+    assert len(payloads) == 1
+    reopened.close()
+    second.close()
@@ -0,0 +1,81 @@
+import csv
+import io
+import json
+from types import SimpleNamespace
+import pytest
+import export_leads
+from analytics_filters import NO_FILTER
+from export_leads import encode_csv, encode_ndjson, export_chunks, CRM_FIELDS
+from services import LeadService
+
+SUMMARY = {
+    'session_id': 's1', 'name': 'Ana', 'location': 'Lagos', 'business_type': 'Retail',
+    'staff_size': '5-10', 'monthly_sales': '1000', 'features_interested': ['POS', 'Inventory'],
+    'contact_info': '555', 'email': 'ana@example.com', 'phone': None, 'lead_score': 42,
+    'lead_type': 'MQL', 'utm_source': 'google', 'created_at': '2024-05-01T12:00:00',
+    'updated_at': None
+}
+
+
+def test_crm_record_keeps_single_export_shape():
+    record = LeadService.to_crm_record(SUMMARY)
+    assert tuple(record) == CRM_FIELDS
+    # phone is present (None), so contact_info does not fall back to email
+    assert record['contact_info'] is None
+    assert record['session_start_time'] == '2024-05-01T12:00:00'
+    assert record['assigned_to'] == 'CTL-Team'
+
+
+def test_csv_writes_header_once_and_joins_lists():
+    record = LeadService.to_crm_record(SUMMARY)
+    chunks = list(encode_csv([[record], [], [dict(record, name='Bo')]]))
+    assert len(chunks) == 3
+    rows = list(csv.DictReader(io.StringIO(''.join(chunks))))
+    assert [row['name'] for row in rows] == ['Ana', 'Bo']
+    assert rows[0]['features_interested'] == 'POS; Inventory'
+    assert rows[0]['phone'] == ''
+
+
+def test_csv_without_leads_is_just_the_header():
+    assert list(encode_csv([])) == [','.join(CRM_FIELDS) + '\r\n']
+
+
+def test_ndjson_one_record_per_line():
+    record = LeadService.to_crm_record(SUMMARY)
+    text = ''.join(encode_ndjson([[record, record], []]))
+    lines = text.splitlines()
+    assert len(lines) == 2
+    assert json.loads(lines[0])['features_interested'] == ['POS', 'Inventory']
+
+
+def test_malformed_features_export_as_empty_list():
+    lead = SimpleNamespace(session_id='s1', features_interested='["POS"', phone=None, email=None)
+    assert LeadService._features_interested(lead) == []
+    assert LeadService._features_interested(SimpleNamespace(features_interested='["POS"]')) == ['POS']
+
+
+def failing_batches(filters, lead_type=None):
+    yield [LeadService.to_crm_record(SUMMARY)]
+    raise RuntimeError("connection lost")
+
+
+def test_failed_ndjson_export_ends_with_error_line(monkeypatch):
+    monkeypatch.setattr(export_leads.LeadService, 'iter_crm_batches', failing_batches)
+    chunks = []
+    with pytest.raises(RuntimeError):
+        for chunk in export_chunks('ndjson', NO_FILTER):
+            chunks.append(chunk)
+    lines = ''.join(chunks).splitlines()
+    assert len(lines) == 2
+    error = json.loads(lines[-1])
+    assert error['records_exported'] == 1
+    assert 'connection lost' in error['error']
+
+
+def test_failed_csv_export_ends_with_error_row(monkeypatch):
+    monkeypatch.setattr(export_leads.LeadService, 'iter_crm_batches', failing_batches)
+    chunks = []
+    with pytest.raises(RuntimeError):
+        for chunk in export_chunks('csv', NO_FILTER):
+            chunks.append(chunk)
+    assert ''.join(chunks).splitlines()[-1].startswith('#ERROR export failed after 1 records')
@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+from funnel import FunnelEvents, compute_funnel, START, ANSWER, SKIP, EXIT, UNKNOWN_QUESTION
+
+STEPS = [{'id': 1, 'step': 'greeting'}, {'id': 2, 'step': 'business_type'},
+         {'id': 3, 'step': 'staff_size'}]
+T0 = datetime(2024, 5, 1, 12, 0)
+
+
+def _at(seconds):
+    return T0 + timedelta(seconds=seconds)
+
+
+def _events(rows):
+    """rows: (session_id, kind, question_id, seconds) in session/time order, split in two chunks"""
+    columns = list(zip(*rows))
+    middle = len(rows) // 2
+    chunks = [tuple(column[:middle] for column in columns),
+              tuple(column[middle:] for column in columns)]
+    return FunnelEvents.from_chunks(
+        (sessions, kinds, questions, [_at(s) for s in seconds])
+        for sessions, kinds, questions, seconds in chunks)
+
+
+def test_counts_and_medians():
+    funnel = compute_funnel(_events([
+        ('a', START, UNKNOWN_QUESTION, 0),
+        ('a', ANSWER, 1, 10),
+        ('a', ANSWER, 2, 30),
+        ('a', ANSWER, 2, 35),  # re-answer counts once
+        ('a', ANSWER, 3, 40),
+        ('b', START, UNKNOWN_QUESTION, 0),
+        ('b', ANSWER, 1, 20),
+        ('b', SKIP, 2, 25),
+        ('b', EXIT, 3, 60),
+        ('c', START, UNKNOWN_QUESTION, 0),
+        ('c', EXIT, UNKNOWN_QUESTION, 5),
+    ]), STEPS)
+    by_id = {row['question_id']: row for row in funnel}
+
+    assert [row['reached'] for row in funnel] == [3, 2, 2]
+    assert [row['answered'] for row in funnel] == [2, 1, 1]
+    assert [row['skipped'] for row in funnel] == [0, 1, 0]
+    # c's exit has no question: attributed to the first step
+    assert [row['abandoned'] for row in funnel] == [1, 0, 1]
+    assert by_id[1]['median_time_seconds'] == 15.0
+    assert by_id[2]['median_time_seconds'] == 12.5
+    assert by_id[3]['median_time_seconds'] == 5.0
+
+
+def test_unattributed_skip_lands_after_furthest_step():
+    funnel = compute_funnel(_events([
+        ('a', START, UNKNOWN_QUESTION, 0),
+        ('a', ANSWER, 1, 5),
+        ('a', SKIP, UNKNOWN_QUESTION, 8),
+        ('b', SKIP, UNKNOWN_QUESTION, 3),
+    ]), STEPS)
+    assert [row['skipped'] for row in funnel] == [1, 1, 0]
+    assert [row['reached'] for row in funnel] == [2, 1, 0]
+
+
+def test_empty():
+    funnel = compute_funnel(FunnelEvents.from_chunks([]), STEPS)
+    assert all(row['reached'] == 0 and row['median_time_seconds'] is None for row in funnel)
@@ -0,0 +1,103 @@
+import time
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+from caching import LRUCache
+import idempotency
+from idempotency import IdempotencyStore, idempotent
+
+
+class CounterRequest(BaseModel):
+    session_id: str
+
+
+def make_client(monkeypatch):
+    monkeypatch.setattr(idempotency, 'idempotency_store',
+                        IdempotencyStore(max_entries=10, ttl_seconds=60))
+    calls = []
+    app = FastAPI()
+
+    @app.post("/count")
+    @idempotent
+    def count(request: CounterRequest):
+        calls.append(request.session_id)
+        if request.session_id == "fail":
+            raise HTTPException(status_code=400, detail="failed")
+        return {"calls": len(calls)}
+
+    return TestClient(app), calls
+
+
+def test_lru_cache_evicts_oldest_and_expires():
+    cache = LRUCache(max_entries=2, ttl_seconds=0.05)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)  # evicts 'b', the least recently used
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    time.sleep(0.06)
+    assert cache.get('c') is None
+
+
+def test_duplicate_key_replays_response(monkeypatch):
+    client, calls = make_client(monkeypatch)
+    headers = {"Idempotency-Key": "abc"}
+    first = client.post("/count", json={"session_id": "s1"}, headers=headers)
+    second = client.post("/count", json={"session_id": "s1"}, headers=headers)
+    assert first.json() == second.json() == {"calls": 1}
+    assert second.headers.get("Idempotent-Replayed") == "true"
+    assert len(calls) == 1
+
+    # Without a key every request runs
+    client.post("/count", json={"session_id": "s1"})
+    assert len(calls) == 2
+
+
+def test_key_reuse_with_different_body_is_rejected(monkeypatch):
+    client, calls = make_client(monkeypatch)
+    headers = {"Idempotency-Key": "abc"}
+    client.post("/count", json={"session_id": "s1"}, headers=headers)
+    response = client.post("/count", json={"session_id": "s2"}, headers=headers)
+    assert response.status_code == 422
+    assert len(calls) == 1
+
+
+def test_failed_request_is_not_remembered(monkeypatch):
+    client, calls = make_client(monkeypatch)
+    headers = {"Idempotency-Key": "retry"}
+    assert client.post("/count", json={"session_id": "fail"}, headers=headers).status_code == 400
+    assert client.post("/count", json={"session_id": "fail"}, headers=headers).status_code == 400
+    assert len(calls) == 2
+
+
+class UnavailableSession:
+    def execute(self, *args, **kwargs):
+        raise RuntimeError("database unavailable")
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_failed_behavior_write_is_not_replayed_as_success(monkeypatch):
+    import router
+    import services
+    monkeypatch.setattr(idempotency, 'idempotency_store',
+                        IdempotencyStore(max_entries=10, ttl_seconds=60))
+    monkeypatch.setattr(services, 'get_db_session', UnavailableSession)
+    app = FastAPI()
+    app.include_router(router.router)
+    client = TestClient(app)
+    headers = {"Idempotency-Key": "behavior-1"}
+    body = {"session_id": "s1", "action": "clicked_demo"}
+
+    for _ in range(2):
+        response = client.post("/api/behavior", json=body, headers=headers)
+        assert response.status_code == 400
+        assert response.headers.get("Idempotent-Replayed") is None
+    skipped = client.post("/api/skip-question", json={"session_id": "s1"},
+                          headers={"Idempotency-Key": "skip-1"})
+    assert skipped.status_code == 400
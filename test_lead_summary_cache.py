@@ -0,0 +1,26 @@
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+from services import LeadService, lead_summary_cache
+
+
+def test_summary_is_invalidated_only_after_commit():
+    engine = create_engine("sqlite://")
+    lead_summary_cache.set("s1", {"lead_score": 10})
+
+    with Session(engine) as db_session:
+        LeadService.invalidate_summary(db_session, "s1")
+        assert lead_summary_cache.get("s1") == {"lead_score": 10}
+        db_session.commit()
+    assert lead_summary_cache.get("s1") is None
+
+
+def test_rolled_back_write_keeps_summary():
+    engine = create_engine("sqlite://")
+    lead_summary_cache.set("s2", {"lead_score": 10})
+
+    with Session(engine) as db_session:
+        db_session.execute(text("SELECT 1"))  # the lead write
+        LeadService.invalidate_summary(db_session, "s2")
+        db_session.rollback()
+        db_session.commit()
+    assert lead_summary_cache.get("s2") == {"lead_score": 10}
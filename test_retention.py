@@ -0,0 +1,97 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import create_engine, select, func
+from sqlalchemy.orm import sessionmaker
+import retention
+from models import UserBehavior
+from retention import RetentionJob, purge_table, cutoff_from
+
+CUTOFF = datetime(2024, 5, 1)
+
+
+@pytest.fixture
+def behaviors(monkeypatch):
+    engine = create_engine("sqlite://")
+    UserBehavior.__table__.create(engine)
+    sessions = sessionmaker(bind=engine)
+    monkeypatch.setattr(retention, 'get_db_session', sessions)
+
+    def add(count, created_at):
+        with sessions() as db_session:
+            db_session.add_all(UserBehavior(session_id='s', action='a', created_at=created_at)
+                               for _ in range(count))
+            db_session.commit()
+
+    def remaining():
+        with sessions() as db_session:
+            return db_session.execute(select(func.count(UserBehavior.id))).scalar()
+
+    return add, remaining
+
+
+def test_purge_deletes_expired_rows_in_batches(behaviors):
+    add, remaining = behaviors
+    add(7, CUTOFF - timedelta(days=1))
+    add(3, CUTOFF)  # at the cutoff: kept
+
+    assert purge_table(UserBehavior, UserBehavior.created_at, CUTOFF, batch_rows=3) == 7
+    assert remaining() == 3
+    assert purge_table(UserBehavior, UserBehavior.created_at, CUTOFF, batch_rows=3) == 0
+
+
+def test_purge_stops_between_batches(behaviors):
+    add, remaining = behaviors
+    add(7, CUTOFF - timedelta(hours=1))
+    batches = []
+
+    def should_stop():
+        batches.append(1)
+        return len(batches) > 2
+
+    assert purge_table(UserBehavior, UserBehavior.created_at, CUTOFF,
+                       batch_rows=3, should_stop=should_stop) == 6
+    assert remaining() == 1
+
+
+def test_cutoff_is_floored_to_the_hour():
+    assert cutoff_from(datetime(2024, 5, 31, 13, 45, 12), 30) == datetime(2024, 5, 1, 13)
+
+
+def _lock(acquired):
+    @contextmanager
+    def lock():
+        yield acquired
+    return lock
+
+
+def test_run_once_reports_rows_per_table(monkeypatch):
+    monkeypatch.setattr(retention, 'retention_cutoff', lambda days: CUTOFF)
+    deleted = {'user_behaviors': 5, 'page_tracking': 0, 'session_exits': 2}
+
+    def fake_purge(model, time_column, cutoff, batch_rows, pause_seconds, should_stop):
+        if model.__tablename__ == 'page_tracking':
+            raise RuntimeError("lock timeout")
+        return deleted[model.__tablename__]
+
+    monkeypatch.setattr(retention, 'purge_table', fake_purge)
+    purges = []
+    monkeypatch.setattr(retention, 'record_purge', purges.append)
+    job = RetentionJob(90, 0, 100, lock=_lock(True))
+    report = job.run_once()
+
+    assert report['cutoff'] == CUTOFF.isoformat()
+    assert report['rows_deleted'] == {'user_behaviors': 5, 'session_exits': 2}
+    assert job.stats()['rows_deleted'] == 7
+    assert job.stats()['runs'] == 1
+    assert job.last_error.startswith('page_tracking')
+    # Analytics caches in every process see the stamped watermark
+    assert purges == [7]
+
+
+def test_run_once_skips_while_another_process_purges(monkeypatch):
+    monkeypatch.setattr(retention, 'purge_table', pytest.fail)
+    job = RetentionJob(90, 0, 100, lock=_lock(False))
+    assert job.run_once() is None
+    assert job.stats()['skipped_runs'] == 1
+    assert job.stats()['runs'] == 0
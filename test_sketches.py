@@ -0,0 +1,91 @@
+import numpy as np
+from sketches import HyperLogLog, TDigest, HLL_PRECISION, TDIGEST_COMPRESSION
+
+
+def _sketch(values):
+    sketch = HyperLogLog()
+    for value in values:
+        sketch.add(value)
+    return sketch
+
+
+def test_estimates_within_error_bounds():
+    for n in (0, 50, 5000, 100000):
+        estimate = _sketch(f"session-{i}" for i in range(n)).count()
+        assert abs(estimate - n) <= max(2, 0.05 * n)
+
+
+def test_duplicates_do_not_count():
+    assert _sketch(["a", "b", "a", "a", "b"]).count() == 2
+
+
+def test_merge_is_union():
+    merged = _sketch(range(0, 6000)).merge(_sketch(range(3000, 9000)))
+    assert abs(merged.count() - 9000) <= 0.05 * 9000
+
+
+def test_bytes_round_trip_sparse_and_dense():
+    sparse = _sketch(range(100))
+    dense = _sketch(range(50000))
+    assert sparse.to_bytes()[:1] == b'S' and len(sparse.to_bytes()) < 400
+    assert dense.to_bytes()[:1] == b'D'
+    for sketch in (sparse, dense):
+        restored = HyperLogLog.from_bytes(sketch.to_bytes())
+        assert np.array_equal(restored.registers, sketch.registers)
+
+
+def test_rank_layout_matches_sql():
+    # Register from the low bits, rank = first set bit of the high bits
+    sketch = HyperLogLog()
+    sketch.add_hashes(np.array([0, -1, 1 << HLL_PRECISION, -(1 << 63)], dtype=np.int64))
+    width = 64 - HLL_PRECISION
+    assert sketch.registers[0] == width + 1
+    assert sketch.registers[(1 << HLL_PRECISION) - 1] == 1
+
+
+def test_tdigest_merged_quantiles_close_to_exact():
+    values = np.random.default_rng(7).lognormal(3, 1.2, 50000)
+    merged = TDigest()
+    for chunk in np.array_split(values, 200):
+        merged.merge(TDigest.from_values(chunk))
+    assert merged.count == len(values)
+    for q in (0.5, 0.9, 0.99):
+        exact = np.quantile(values, q)
+        assert abs(merged.quantile(q) - exact) <= 0.02 * exact
+    assert len(merged.means) <= TDIGEST_COMPRESSION
+
+
+def test_tdigest_round_trip_and_small_inputs():
+    digest = TDigest.from_values([1, 2, 3, 4, 1000])
+    restored = TDigest.from_bytes(digest.to_bytes())
+    assert restored.quantile(0.5) == digest.quantile(0.5) == 3.0
+    assert restored.quantile(1.0) == 1000.0
+    assert TDigest.from_values([]).quantile(0.5) is None
+    assert TDigest.from_values([7]).quantile(0.99) == 7.0
+
+
+def test_hll_union_matches_pairwise_merge():
+    sketches = []
+    for part in range(5):
+        sketch = HyperLogLog()
+        for i in range(part * 1000, part * 1000 + 1500):
+            sketch.add(f"session-{i}")
+        sketches.append(sketch)
+    merged = HyperLogLog.from_bytes(sketches[0].to_bytes())
+    for sketch in sketches[1:]:
+        merged.merge(sketch)
+    union = HyperLogLog.union(sketches)
+    assert np.array_equal(union.registers, merged.registers)
+    assert abs(union.count() - 5500) / 5500 < 0.05
+
+
+def test_tdigest_union_compresses_once():
+    rng = np.random.default_rng(7)
+    parts = [rng.exponential(30.0, 2000) for _ in range(24)]
+    union = TDigest.union([TDigest.from_values(part) for part in parts] + [TDigest()])
+    values = np.concatenate(parts)
+    assert union.count == len(values)
+    assert len(union.means) <= union.compression
+    for q in (0.5, 0.9, 0.99):
+        assert abs(union.quantile(q) - np.quantile(values, q)) / np.quantile(values, q) < 0.03
+    assert TDigest.union([]).quantile(0.5) is None
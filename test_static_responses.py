@@ -0,0 +1,41 @@
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from workflow_config import WORKFLOW_CONFIG
+from workflow_index import reload_workflow
+from static_responses import static_json_response
+
+app = FastAPI()
+
+
+@app.get("/menu")
+def menu(request: Request):
+    return static_json_response(request, 'test_menu', lambda workflow: workflow.product_menu)
+
+
+client = TestClient(app)
+
+
+def test_serves_bytes_with_etag_and_304():
+    response = client.get("/menu")
+    assert response.status_code == 200
+    assert response.json() == WORKFLOW_CONFIG['product_menu']
+    etag = response.headers["etag"]
+    assert "max-age" in response.headers["cache-control"]
+
+    cached = client.get("/menu", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+    assert cached.headers["etag"] == etag
+
+
+def test_workflow_reload_changes_etag():
+    etag = client.get("/menu").headers["etag"]
+    changed = dict(WORKFLOW_CONFIG, product_menu=WORKFLOW_CONFIG['product_menu'][:1])
+    try:
+        reload_workflow(changed)
+        response = client.get("/menu", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert len(response.json()) == 1
+    finally:
+        reload_workflow()
+    assert client.get("/menu", headers={"If-None-Match": etag}).status_code == 304
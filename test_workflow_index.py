@@ -0,0 +1,62 @@
+import pytest
+from workflow_config import WORKFLOW_CONFIG
+from workflow_index import WorkflowIndex, get_workflow, reload_workflow, question_bit
+
+
+def test_next_required_question_skips_answered_and_optional():
+    workflow = get_workflow()
+    assert workflow.next_required_question(1, 0)['id'] == 2
+    answered = question_bit(2) | question_bit(3)
+    assert workflow.next_required_question(1, answered)['id'] == 4
+    # Question 7 is optional, so nothing is left after 6
+    assert workflow.next_required_question(6, 0) is None
+    assert workflow.next_required_question(999, 0) is None
+
+
+def test_question_bits_fit_a_signed_bigint():
+    assert question_bit(2) == 4
+    assert question_bit(62) == 1 << 62
+    assert question_bit(63) == 0
+    assert question_bit(None) == 0
+    assert get_workflow().required_mask.bit_count() == 6
+
+
+@pytest.mark.parametrize("question_id", [63, -1, "2", None])
+def test_question_ids_without_a_mask_bit_are_rejected(question_id):
+    questions = [dict(WORKFLOW_CONFIG['questions_workflow'][0], id=question_id)]
+    with pytest.raises(ValueError, match="answered_mask"):
+        WorkflowIndex(dict(WORKFLOW_CONFIG, questions_workflow=questions))
+
+
+def test_duplicate_question_ids_are_rejected():
+    question = WORKFLOW_CONFIG['questions_workflow'][0]
+    with pytest.raises(ValueError, match="more than once"):
+        WorkflowIndex(dict(WORKFLOW_CONFIG, questions_workflow=[question, question]))
+
+
+def test_greeting_dispatch_and_lookups():
+    workflow = get_workflow()
+    assert workflow.greeting_question_id == 1
+    assert workflow.greeting_next_question['continue_to_business_type']['id'] == 2
+    assert workflow.greeting_next_question['end_session'] is None
+    assert workflow.greeting_responses['No thanks']['next_action'] == 'end_session'
+    assert workflow.scoring['clicked_demo'] == WORKFLOW_CONFIG['scoring']['clicked_demo']
+
+
+def test_index_is_read_only():
+    workflow = get_workflow()
+    with pytest.raises(TypeError):
+        workflow.scoring['clicked_demo'] = 100
+    with pytest.raises(TypeError):
+        workflow.questions_by_id[1]['required'] = False
+
+
+def test_reload_changes_version():
+    original = get_workflow()
+    changed = dict(WORKFLOW_CONFIG, scoring=dict(WORKFLOW_CONFIG['scoring'], clicked_demo=20))
+    try:
+        assert reload_workflow(changed).version != original.version
+        assert get_workflow().scoring['clicked_demo'] == 20
+    finally:
+        reload_workflow()
+    assert get_workflow().version == WorkflowIndex(WORKFLOW_CONFIG).version
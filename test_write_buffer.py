@@ -0,0 +1,120 @@
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+import write_buffer
+from models import PageTracking, UserBehavior
+from write_buffer import WriteBehindBuffer, IdBlockAllocator
+
+
+def make_buffer(max_queue=100):
+    return WriteBehindBuffer(flush_interval_ms=1000, max_rows=50,
+                             max_queue=max_queue)
+
+
+def test_close_pending_page_updates_queued_row():
+    buffer = make_buffer()
+    entry_time = datetime(2024, 1, 1, 10, 0, 0)
+    row = {'id': 42, 'session_id': 's1', 'page_identifier': 'home',
+           'entry_time': entry_time, 'exit_time': None, 'time_spent': None}
+    buffer.enqueue(PageTracking, row)
+
+    assert buffer.close_pending_page(42, entry_time + timedelta(seconds=75))
+    assert row['time_spent'] == 75
+    assert not buffer.close_pending_page(43, entry_time)
+
+
+def test_queue_is_bounded_and_reported():
+    buffer = make_buffer(max_queue=3)
+    for i in range(5):
+        buffer.enqueue(UserBehavior, {'session_id': f's{i}', 'action': 'ignored_cta'})
+
+    stats = buffer.stats()
+    assert stats['queue_depth'] == 3
+    assert stats['dropped_rows'] == 2
+    assert stats['flushes'] == 0
+
+
+def test_rejected_rows_are_dead_lettered(monkeypatch):
+    engine = create_engine("sqlite://")
+    UserBehavior.__table__.create(engine)
+    monkeypatch.setattr(write_buffer, 'get_db_session', sessionmaker(bind=engine))
+    buffer = make_buffer()
+    buffer.enqueue(UserBehavior, {'session_id': 's1', 'action': 'ignored_cta'})
+    buffer.enqueue(UserBehavior, {'session_id': 's2', 'action': None})  # NOT NULL
+    buffer.enqueue(UserBehavior, {'session_id': 's3', 'action': 'page_view'})
+
+    assert buffer.flush() == 2
+    with engine.connect() as connection:
+        sessions = connection.execute(select(UserBehavior.session_id)).scalars().all()
+    assert sorted(sessions) == ['s1', 's3']
+    assert [(table, row['session_id']) for table, row, _ in buffer.dead_letters] == \
+        [('user_behaviors', 's2')]
+    stats = buffer.stats()
+    assert stats['dead_letter_rows'] == 1
+    assert stats['queue_depth'] == 0
+
+
+class FailingSession:
+    """Blocks in execute until released, then fails like a lost connection"""
+
+    def __init__(self, started, release):
+        self.started, self.release = started, release
+
+    def execute(self, *args, **kwargs):
+        self.started.set()
+        self.release.wait(5)
+        raise RuntimeError("connection lost")
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_exit_during_failed_flush_lands_on_requeued_row(monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    monkeypatch.setattr(write_buffer, 'get_db_session',
+                        lambda: FailingSession(started, release))
+    buffer = make_buffer()
+    entry_time = datetime(2024, 1, 1, 10, 0, 0)
+    row = {'id': 7, 'session_id': 's1', 'page_identifier': 'home',
+           'entry_time': entry_time, 'exit_time': None, 'time_spent': None}
+    buffer.enqueue(PageTracking, row)
+
+    flusher = threading.Thread(target=buffer.flush)
+    flusher.start()
+    assert started.wait(5)
+    closed = []
+    closer = threading.Thread(target=lambda: closed.append(
+        buffer.close_pending_page(7, entry_time + timedelta(seconds=30))))
+    closer.start()
+    release.set()
+    flusher.join()
+    closer.join()
+
+    assert closed == [True]
+    assert row['time_spent'] == 30
+    assert buffer.stats()['queue_depth'] == 1
+    assert buffer.stats()['failed_flushes'] == 1
+
+
+def test_reserved_ids_are_taken_without_the_database(monkeypatch):
+    allocator = IdBlockAllocator(block_size=3)
+    next_ids = iter(range(1, 100))
+    reserve_calls = []
+
+    def reserve(model, count):
+        reserve_calls.append(count)
+        return [next(next_ids) for _ in range(count)]
+
+    monkeypatch.setattr(allocator, '_reserve', reserve)
+    assert allocator.take(PageTracking) is None
+    assert allocator.refill(PageTracking, 5) == 5
+    assert allocator.refill(PageTracking, 5) == 0
+    assert [allocator.take(PageTracking) for _ in range(6)] == [1, 2, 3, 4, 5, None]
+    # allocate() still falls back to reserving a block
+    assert allocator.allocate(PageTracking) == 6
+    assert allocator.reserved(PageTracking) == 2
+    assert reserve_calls == [5, 3]
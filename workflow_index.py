@@ -0,0 +1,149 @@
+"""
+Compiled workflow index
+WORKFLOW_CONFIG is compiled once into read-only lookup tables so the
+question flow and scoring never sort, scan or copy the config per request:
+
+- questions in order_index order and an id -> question map
+- for every question id, the required questions that follow it
+- greeting answer -> response dispatch, and next_action -> next question
+- the scoring map, lead thresholds, product menu and CTA options
+
+Call reload_workflow() after changing WORKFLOW_CONFIG at runtime; readers
+always see either the old or the new index, never a mix.
+"""
+
+import hashlib
+import json
+import threading
+from types import MappingProxyType
+from workflow_config import WORKFLOW_CONFIG
+
+# leads.answered_mask is a signed BIGINT, so question ids 0..62 get a bit
+MAX_MASK_QUESTION_ID = 62
+
+# Question that follows the greeting for each greeting next_action
+GREETING_NEXT_QUESTION_IDS = {
+    'continue_to_business_type': 2,
+    'end_session': None
+}
+
+
+class FrozenDict(dict):
+    """A dict that rejects mutation; still serializes like a plain dict"""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("workflow index entries are read-only")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+
+def question_bit(question_id):
+    """
+    The answered_mask bit for a question id. WorkflowIndex rejects configured
+    ids outside 0..MAX_MASK_QUESTION_ID, so 0 means "not a workflow question".
+    """
+    if question_id is None or not 0 <= question_id <= MAX_MASK_QUESTION_ID:
+        return 0
+    return 1 << question_id
+
+
+def _check_question_ids(questions):
+    """Raise ValueError unless every question id is a unique answered_mask bit"""
+    seen = set()
+    for question in questions:
+        question_id = question.get('id')
+        if isinstance(question_id, bool) or not isinstance(question_id, int) \
+                or not 0 <= question_id <= MAX_MASK_QUESTION_ID:
+            raise ValueError(
+                f"Workflow question id {question_id!r} must be an integer from 0 to "
+                f"{MAX_MASK_QUESTION_ID} to be tracked in leads.answered_mask")
+        if question_id in seen:
+            raise ValueError(f"Workflow question id {question_id} is used more than once")
+        seen.add(question_id)
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return FrozenDict((key, _freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+class WorkflowIndex:
+    """Immutable lookup tables built from a workflow config dict"""
+
+    def __init__(self, config):
+        self.version = hashlib.sha256(json.dumps(
+            config, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+        _check_question_ids(config['questions_workflow'])
+        self.questions = tuple(sorted(
+            (_freeze(question) for question in config['questions_workflow']),
+            key=lambda question: question.get('order_index', question['id'])))
+        self.questions_by_id = MappingProxyType(
+            {question['id']: question for question in self.questions})
+        self.greeting_question_id = next(
+            (question['id'] for question in self.questions if question.get('step') == 'greeting'), None)
+        self.required_question_ids = tuple(
+            question['id'] for question in self.questions if question.get('required', True))
+
+        self.required_mask = 0
+        for question_id in self.required_question_ids:
+            self.required_mask |= question_bit(question_id)
+
+        # (answered_mask bit, question) of the required questions after each
+        # question, in order
+        required_after = {}
+        for position, question in enumerate(self.questions):
+            required_after[question['id']] = tuple(
+                (question_bit(later['id']), later)
+                for later in self.questions[position + 1:] if later.get('required', True))
+        self.required_after = MappingProxyType(required_after)
+
+        self.scoring = _freeze(config.get('scoring', {}))
+        self.scoring_actions = tuple(self.scoring)
+        self.lead_thresholds = _freeze(config.get('lead_thresholds', {}))
+
+        self.greeting_responses = _freeze(config.get('greeting_responses', {}))
+        self.greeting_next_question = MappingProxyType({
+            action: self.questions_by_id.get(question_id) if question_id else None
+            for action, question_id in GREETING_NEXT_QUESTION_IDS.items()
+        })
+
+        self.product_menu = _freeze(config.get('product_menu', []))
+        self.cta_options = _freeze(config.get('cta_options', []))
+
+    def next_required_question(self, last_question_id, answered_mask):
+        """First required question after last_question_id whose bit is not set"""
+        for bit, question in self.required_after.get(last_question_id, ()):
+            if not answered_mask & bit:
+                return question
+        return None
+
+
+_workflow = WorkflowIndex(WORKFLOW_CONFIG)
+_reload_lock = threading.Lock()
+
+
+def get_workflow():
+    """The current compiled workflow index"""
+    return _workflow
+
+
+def reload_workflow(config=None):
+    """Recompile the index from config (default: WORKFLOW_CONFIG) and swap it in"""
+    global _workflow
+    with _reload_lock:
+        _workflow = WorkflowIndex(WORKFLOW_CONFIG if config is None else config)
+    return _workflow
@@ -0,0 +1,320 @@
+"""
+Write-behind buffer for telemetry inserts
+Collects pure-tracking rows (zero-score behaviors, page entries, A/B
+assignments, notification logs) in memory and writes them in bulk every
+WRITE_BEHIND_FLUSH_INTERVAL_MS or WRITE_BEHIND_MAX_ROWS rows, whichever
+comes first. Score-affecting writes never go through this buffer.
+
+If a bulk write fails, the batch is retried row by row. Rows the database
+rejects (constraint or data errors) are logged and kept in a bounded
+dead-letter list instead of blocking every later flush; any other failure
+(e.g. the database is down) puts the whole batch back in the queue.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from sqlalchemy import insert, update, func, select
+from sqlalchemy.exc import IntegrityError, DataError
+from database import get_db_session
+from models import Lead, PageTracking
+from config import Config
+
+# Rejected rows kept for inspection (oldest dropped first)
+DEAD_LETTER_MAX_ROWS = 1000
+
+
+class IdBlockAllocator:
+    """
+    Reserves primary keys from a table's serial sequence in blocks, so rows
+    written later (buffered or replayed) can be referenced immediately.
+    """
+
+    def __init__(self, block_size):
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._blocks = {}  # model -> deque of reserved ids
+
+    def take(self, model):
+        """A reserved id, or None if none is left; never queries the database"""
+        with self._lock:
+            block = self._blocks.get(model)
+            return block.popleft() if block else None
+
+    def allocate(self, model):
+        """A reserved id, reserving a new block first if none is left"""
+        reserved = self.take(model)
+        if reserved is not None:
+            return reserved
+        ids = self._reserve(model, self.block_size)
+        with self._lock:
+            self._blocks.setdefault(model, deque()).extend(ids[1:])
+        return ids[0]
+
+    def refill(self, model, minimum):
+        """Reserve more ids when fewer than minimum are left; returns how many"""
+        with self._lock:
+            missing = minimum - len(self._blocks.get(model, ()))
+        if missing <= 0:
+            return 0
+        ids = self._reserve(model, max(missing, self.block_size))
+        with self._lock:
+            self._blocks.setdefault(model, deque()).extend(ids)
+        return len(ids)
+
+    def reserved(self, model):
+        with self._lock:
+            return len(self._blocks.get(model, ()))
+
+    def _reserve(self, model, count):
+        table = model.__table__.name
+        db_session = get_db_session()
+        try:
+            rows = db_session.execute(
+                select(func.nextval(func.pg_get_serial_sequence(table, 'id')))
+                .select_from(func.generate_series(1, count))
+            ).all()
+            db_session.commit()
+        finally:
+            db_session.close()
+        return [row[0] for row in rows]
+
+
+class WriteBehindBuffer:
+    """Thread-backed buffer that flushes queued rows with multi-row INSERTs"""
+
+    def __init__(self, flush_interval_ms, max_rows, max_queue):
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.max_rows = max_rows
+        self.max_queue = max_queue
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+        self._pending = deque()  # (model, row) in arrival order
+        self._pending_pages = {}  # page_tracking id -> queued row
+        self._in_flight_pages = set()
+        self.dead_letters = deque(maxlen=DEAD_LETTER_MAX_ROWS)  # (table, row, error)
+
+        self._stats = {
+            'flushes': 0,
+            'failed_flushes': 0,
+            'rows_flushed': 0,
+            'dropped_rows': 0,
+            'dead_letter_rows': 0,
+            'last_flush_ms': 0.0,
+            'max_flush_ms': 0.0,
+            'total_flush_ms': 0.0
+        }
+
+    def start(self):
+        """Start the background flusher thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self._run, name='write-behind-flusher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the flusher and write out everything still queued"""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def enqueue(self, model, row):
+        """Queue a row (dict of column values) for a bulk insert into model"""
+        with self._lock:
+            if len(self._pending) >= self.max_queue:
+                # Shed the oldest telemetry rather than grow without bound
+                dropped_model, dropped_row = self._pending.popleft()
+                if dropped_model is PageTracking:
+                    self._pending_pages.pop(dropped_row.get('id'), None)
+                self._stats['dropped_rows'] += 1
+            self._pending.append((model, row))
+            if model is PageTracking and row.get('id') is not None:
+                self._pending_pages[row['id']] = row
+            queue_depth = len(self._pending)
+        if queue_depth >= self.max_rows:
+            self._wakeup.set()
+
+    def allocate_id(self, model):
+        """Hand out a primary key so callers can return ids for queued rows"""
+        return id_allocator.allocate(model)
+
+    def close_pending_page(self, page_tracking_id, exit_time):
+        """
+        Apply a page exit to a queued page_tracking row.
+        Returns True if the row was still queued; otherwise the caller should
+        update the database (this waits for an in-progress flush first).
+        """
+        while True:
+            with self._lock:
+                row = self._pending_pages.get(page_tracking_id)
+                if row is not None:
+                    row['exit_time'] = exit_time
+                    row['time_spent'] = int(
+                        (exit_time - row['entry_time']).total_seconds())
+                    return True
+                if page_tracking_id not in self._in_flight_pages:
+                    return False
+            # A flush is writing the row; once it ends the row is either in
+            # the database or, if the flush failed, queued again
+            with self._flush_lock:
+                pass
+
+    def close_pending_session_pages(self, session_id, exit_time):
+        """Apply a page exit to every queued, still-open page of a session"""
+        closed = 0
+        while True:
+            with self._lock:
+                rows = [row for row in self._pending_pages.values()
+                        if row['session_id'] == session_id and row.get('exit_time') is None]
+                for row in rows:
+                    row['exit_time'] = exit_time
+                    row['time_spent'] = int(
+                        (exit_time - row['entry_time']).total_seconds())
+                closed += len(rows)
+                if not self._in_flight_pages:
+                    return closed
+            # Let an in-progress flush land so the database sees those rows;
+            # rows of a failed flush are queued again and closed above
+            with self._flush_lock:
+                pass
+
+    def flush(self):
+        """Write all queued rows, one multi-row INSERT per table"""
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._pending)
+                self._pending.clear()
+                self._in_flight_pages = set(self._pending_pages)
+                self._pending_pages = {}
+            if not batch:
+                return 0
+
+            started = time.perf_counter()
+            try:
+                written = self._write(batch)
+            except Exception as e:
+                logging.error(f"Write-behind flush failed: {e}")
+                with self._lock:
+                    self._stats['failed_flushes'] += 1
+                    # Re-queue ahead of newer rows; enqueue() bounds the size
+                    self._pending.extendleft(reversed(batch))
+                    for model, row in batch:
+                        if model is PageTracking and row.get('id') is not None:
+                            self._pending_pages.setdefault(row['id'], row)
+                return 0
+            finally:
+                with self._lock:
+                    self._in_flight_pages = set()
+
+            elapsed_ms = (time.perf_counter() - started) * 1000.0
+            with self._lock:
+                self._stats['flushes'] += 1
+                self._stats['rows_flushed'] += written
+                self._stats['last_flush_ms'] = elapsed_ms
+                self._stats['max_flush_ms'] = max(
+                    self._stats['max_flush_ms'], elapsed_ms)
+                self._stats['total_flush_ms'] += elapsed_ms
+            return written
+
+    def _write(self, batch):
+        """
+        Insert batch, one multi-row INSERT per table; after a failure, row by
+        row with rejected rows dead-lettered. Returns the rows written.
+        """
+        db_session = get_db_session()
+        try:
+            rows_by_model = {}
+            for model, row in batch:
+                rows_by_model.setdefault(model, []).append(row)
+            try:
+                for model, rows in rows_by_model.items():
+                    db_session.execute(insert(model), rows)
+                written = batch
+            except (IntegrityError, DataError) as e:
+                logging.error(f"Write-behind bulk insert failed, retrying row by row: {e}")
+                db_session.rollback()
+                written = self._write_each(db_session, batch)
+            _copy_customer_ids(db_session, [row for model, row in written if model is PageTracking])
+            db_session.commit()
+            return len(written)
+        except Exception:
+            db_session.rollback()
+            raise
+        finally:
+            db_session.close()
+
+    def _write_each(self, db_session, batch):
+        """Insert rows one savepoint at a time; returns the (model, row) pairs written"""
+        written = []
+        for model, row in batch:
+            try:
+                with db_session.begin_nested():
+                    db_session.execute(insert(model), [row])
+                written.append((model, row))
+            except (IntegrityError, DataError) as e:
+                logging.error(f"Write-behind row rejected from {model.__tablename__}: {e}")
+                with self._lock:
+                    self.dead_letters.append((model.__tablename__, row, str(e.orig)))
+                    self._stats['dead_letter_rows'] += 1
+        return written
+
+    def stats(self):
+        """Queue depth and flush latency figures for monitoring"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['queue_depth'] = len(self._pending)
+            stats['pending_pages'] = len(self._pending_pages)
+        total_ms = stats.pop('total_flush_ms')
+        stats['avg_flush_ms'] = total_ms / \
+            stats['flushes'] if stats['flushes'] else 0.0
+        stats['flush_interval_ms'] = self.flush_interval * 1000.0
+        stats['max_rows'] = self.max_rows
+        return stats
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Write-behind flusher error: {e}")
+
+
+def _copy_customer_ids(db_session, page_rows):
+    page_ids = [row['id'] for row in page_rows
+                if row.get('id') is not None and row.get('customer_id') is None]
+    if page_ids:
+        # Copy customer IDs in one statement instead of a lookup per entry
+        db_session.execute(
+            update(PageTracking.__table__)
+            .where(PageTracking.id.in_(page_ids))
+            .where(Lead.session_id == PageTracking.session_id)
+            .where(Lead.customer_id.isnot(None))
+            .values(customer_id=Lead.customer_id)
+        )
+
+
+id_allocator = IdBlockAllocator(block_size=Config.WRITE_BEHIND_ID_BLOCK_SIZE)
+
+write_buffer = WriteBehindBuffer(
+    flush_interval_ms=Config.WRITE_BEHIND_FLUSH_INTERVAL_MS,
+    max_rows=Config.WRITE_BEHIND_MAX_ROWS,
+    max_queue=Config.WRITE_BEHIND_MAX_QUEUE
+)
+
+
+def get_write_buffer():
+    """Return the shared buffer when write-behind is enabled, else None"""
+    return write_buffer if Config.WRITE_BEHIND_ENABLED else None